@@ -2,15 +2,18 @@ import pysam
 import tempfile
 import shutil
 import os
-from bamurai.utils import calculate_percentage, create_progress_bar_for_file, count_reads_async_generic
+from bamurai.utils import calculate_percentage, track_alignment_file, resolve_threads
+from bamurai.progress import create_progress_bar_for_file
 from bamurai.utils_samples import get_read_barcode, parse_barcode_donor_mapping
 
 def assign_samples(args):
     """
     Assign donor_id to RG tag in BAM file using barcode-to-donor mapping TSV.
     Args:
-        args: argparse.Namespace with .bam (str), .tsv (str), .output (str), .barcode_column (str, optional), .donor_id_column (str, optional)
+        args: argparse.Namespace with .bam (str), .tsv (str), .output (str), .barcode_column (str, optional), .donor_id_column (str, optional), .threads (int, optional)
     """
+    threads = resolve_threads(getattr(args, 'threads', None))
+
     # Load barcode-to-donor mapping with flexible column names
     barcode_to_donor = parse_barcode_donor_mapping(
         args.tsv,
@@ -22,7 +25,7 @@ def assign_samples(args):
     with tempfile.NamedTemporaryFile(suffix='.bam', delete=False) as tmpfile:
         tmp_output = tmpfile.name
     try:
-        with pysam.AlignmentFile(args.bam, "rb") as infile:
+        with pysam.AlignmentFile(args.bam, "rb", threads=threads) as infile:
             header = infile.header.to_dict()
             # Add an RG record per donor. Sorted so a given input always yields a
             # byte-identical header, and skipping IDs the input already carries
@@ -34,33 +37,31 @@ def assign_samples(args):
             for donor_id in donor_ids:
                 if donor_id not in existing_rg_ids:
                     header['RG'].append({'ID': donor_id, 'SM': donor_id})
-            with pysam.AlignmentFile(tmp_output, "wb", header=header) as outfile:
+            with pysam.AlignmentFile(tmp_output, "wb", header=header, threads=threads) as outfile:
                 no_match_count = 0
                 total_reads = 0
                 donor_counts = {donor_id: 0 for donor_id in donor_ids}
 
                 # Initialize progress bar using generic utility
                 pbar = create_progress_bar_for_file(args.bam, "Processing reads")
+                track_alignment_file(args.bam, infile)
 
-                # Start background thread to count total reads
-                count_thread = count_reads_async_generic(args.bam, pbar)
-
-                for read in infile:
-                    total_reads += 1
-                    pbar.update(1)
-
-                    barcode = get_read_barcode(read)
+                try:
+                    for read in pbar.iterate(infile):
+                        total_reads += 1
 
-                    if barcode and (barcode in barcode_to_donor):
-                        donor_id = barcode_to_donor[barcode]
-                        read.set_tag('RG', donor_id, value_type='Z')
-                        donor_counts[donor_id] += 1
-                    else:
-                        no_match_count += 1
+                        barcode = get_read_barcode(read)
 
-                    outfile.write(read)
+                        if barcode and (barcode in barcode_to_donor):
+                            donor_id = barcode_to_donor[barcode]
+                            read.set_tag('RG', donor_id, value_type='Z')
+                            donor_counts[donor_id] += 1
+                        else:
+                            no_match_count += 1
 
-                pbar.close()
+                        outfile.write(read)
+                finally:
+                    pbar.close()
         shutil.move(tmp_output, args.output)
         print(f"RG tags assigned and written to {args.output}")
         print(f"Total reads processed: {total_reads}")
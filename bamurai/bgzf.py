@@ -0,0 +1,263 @@
+"""
+BGZF (blocked gzip) support for Bamurai.
+
+BGZF files are a series of independent gzip members of at most 64 KB each,
+with the compressed block size recorded in a 'BC' extra field. Because every
+block can be inflated on its own, BgzfReader hands blocks to a thread pool
+(zlib releases the GIL while inflating) and returns the data in file order.
+BgzfWriter does the reverse, deflating blocks on a pool and writing them in
+order, so its output is both a valid gzip file and indexable by htslib.
+"""
+
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bamurai.utils import copy_range
+
+# gzip magic, deflate method and the FEXTRA flag every BGZF block sets
+_GZIP_MAGIC = b"\x1f\x8b\x08"
+_FEXTRA = 0x04
+_HEADER_SIZE = 12
+
+# Uncompressed bytes per block written; as in htslib, small enough that even
+# incompressible data still fits the 64 KB block limit once deflated.
+BGZF_BLOCK_DATA_SIZE = 0xff00
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# The empty block htslib writes at the end of every BGZF file
+_EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+def _find_bsize(extra):
+    """Return BSIZE from a gzip extra field, or None if it has no 'BC' subfield."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        si1, si2, slen = extra[pos], extra[pos + 1], struct.unpack_from("<H", extra, pos + 2)[0]
+        if si1 == 66 and si2 == 67 and slen == 2:
+            return struct.unpack_from("<H", extra, pos + 4)[0]
+        pos += 4 + slen
+    return None
+
+def is_bgzf(path):
+    """Check if a file starts with a BGZF block."""
+    with open(path, "rb") as f:
+        header = f.read(_HEADER_SIZE)
+        if len(header) < _HEADER_SIZE or header[:3] != _GZIP_MAGIC or not header[3] & _FEXTRA:
+            return False
+        xlen = struct.unpack_from("<H", header, 10)[0]
+        return _find_bsize(f.read(xlen)) is not None
+
+def virtual_offset(block_offset: int, within_block: int) -> int:
+    """
+    Combine a block's offset in the compressed file and an offset into its data.
+
+    As in htslib, the result orders positions in a BGZF file and lets a reader
+    seek straight to one: the block offset is in the upper 48 bits.
+    """
+    return block_offset << 16 | within_block
+
+def _inflate_block(cdata, crc, isize):
+    """Inflate one BGZF block and check it against its trailer."""
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError("Corrupt BGZF block: size or CRC mismatch")
+    return data
+
+class BgzfReader(io.RawIOBase):
+    """
+    Read-only raw stream that inflates BGZF blocks on a thread pool.
+
+    Up to ``threads * 4`` blocks are in flight at once, so memory stays bounded
+    while every worker has a block queued. Wrap in io.BufferedReader (or use
+    bamurai.fastq.open_fastq) for line-oriented reading. ``start`` is a BGZF
+    virtual offset to start reading from (see virtual_offset).
+    """
+
+    def __init__(self, path, threads: int = 2, start: int = 0):
+        super().__init__()
+        self._raw = open(path, "rb")
+        self._raw.seek(start >> 16)
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = deque()
+        self._max_pending = threads * 4
+        self._block = b""
+        self._pos = 0
+        # skipped in the first block, to start part-way through it
+        self._skip = start & 0xffff
+        self._raw_eof = False
+        self._fill()
+
+    def readable(self):
+        return True
+
+    def _next_compressed_block(self):
+        """Read the next block from disk as (offset, cdata, crc, isize), or None at EOF."""
+        offset = self._raw.tell()
+        header = self._raw.read(_HEADER_SIZE)
+        if not header:
+            return None
+        if len(header) < _HEADER_SIZE or header[:3] != _GZIP_MAGIC or not header[3] & _FEXTRA:
+            raise ValueError(f"Not a BGZF block at offset {offset}")
+        xlen = struct.unpack_from("<H", header, 10)[0]
+        extra = self._raw.read(xlen)
+        bsize = _find_bsize(extra)
+        if bsize is None:
+            raise ValueError("gzip member without a BGZF 'BC' field")
+        remaining = self._raw.read(bsize + 1 - _HEADER_SIZE - xlen)
+        crc, isize = struct.unpack_from("<II", remaining, len(remaining) - 8)
+        return offset, remaining[:-8], crc, isize
+
+    def _fill(self):
+        """Queue blocks on the pool until the in-flight limit or EOF is reached."""
+        while not self._raw_eof and len(self._pending) < self._max_pending:
+            block = self._next_compressed_block()
+            if block is None:
+                self._raw_eof = True
+                break
+            offset, *compressed = block
+            self._pending.append((offset, self._executor.submit(_inflate_block, *compressed)))
+
+    def _next_block(self):
+        """Return the next inflated block as (offset, data), or None at EOF."""
+        if not self._pending:
+            return None
+        offset, future = self._pending.popleft()
+        data = future.result()
+        self._fill()
+        skip, self._skip = self._skip, 0
+        return virtual_offset(offset, skip), data[skip:] if skip else data
+
+    def compressed_tell(self) -> int:
+        """Return the offset in the compressed file up to which blocks have been read from disk."""
+        return self._raw.tell()
+
+    def blocks(self):
+        """
+        Yield ``(virtual_offset, data)`` for each remaining block, bypassing read.
+
+        The virtual offset is that of the first byte of ``data``, so offsets of
+        positions within a block are found by adding to it.
+        """
+        self._block, self._pos = b"", 0
+        while True:
+            block = self._next_block()
+            if block is None:
+                return
+            yield block
+
+    def readinto(self, b):
+        while self._pos >= len(self._block):
+            block = self._next_block()
+            if block is None:
+                return 0
+            self._block = block[1]
+            self._pos = 0
+        n = min(len(b), len(self._block) - self._pos)
+        b[:n] = self._block[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for _, future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._raw.close()
+        super().close()
+
+def _deflate_block(data, level):
+    """Compress one block of data into a complete BGZF block."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    # BSIZE is the total block size minus one: 18 header bytes, 8 trailer bytes
+    header = struct.pack("<4BI2BH2BHH", 31, 139, 8, _FEXTRA, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+class BgzfWriter:
+    """
+    Write-only BGZF file that deflates blocks on a thread pool.
+
+    Data is cut into blocks of BGZF_BLOCK_DATA_SIZE bytes, and up to
+    ``threads * 4`` blocks are compressed at once before the oldest is written
+    out, so blocks always land in order. With one thread blocks are compressed
+    inline. Closing the writer flushes the last partial block and appends the
+    BGZF end-of-file marker. Whole blocks of another BGZF file can be spliced
+    in with copy_blocks, without inflating and deflating them again.
+    """
+
+    def __init__(self, path, threads: int = 1, level: int = DEFAULT_COMPRESSION_LEVEL):
+        if not 0 <= level <= 9:
+            raise ValueError(f"Compression level must be between 0 and 9, got {level}")
+        self._raw = open(path, "wb")
+        self._level = level
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        self._pending = deque()
+        self._max_pending = threads * 4
+        self._buffer = bytearray()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= BGZF_BLOCK_DATA_SIZE:
+            self._submit(bytes(self._buffer[:BGZF_BLOCK_DATA_SIZE]))
+            del self._buffer[:BGZF_BLOCK_DATA_SIZE]
+        return len(data)
+
+    def _submit(self, block):
+        """Compress a block, or queue it on the pool, writing out finished blocks in order."""
+        if self._executor is None:
+            self._raw.write(_deflate_block(block, self._level))
+            return
+        self._pending.append(self._executor.submit(_deflate_block, block, self._level))
+        while len(self._pending) >= self._max_pending:
+            self._raw.write(self._pending.popleft().result())
+
+    @property
+    def compressed_size(self) -> int:
+        """Bytes of the file written so far; blocks still being compressed are not counted."""
+        return self._raw.tell()
+
+    def finish_block(self):
+        """End the current block early, so whatever is written next starts a new block."""
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+    def copy_blocks(self, src_fd: int, offset: int, count: int):
+        """
+        Append ``count`` bytes of whole BGZF blocks at ``offset`` of file descriptor ``src_fd``.
+
+        The data written before them is finished off as a block of its own,
+        and the blocks are copied by the kernel where possible (see copy_range).
+        """
+        self.finish_block()
+        self.flush()
+        copy_range(src_fd, self._raw.fileno(), offset, count)
+        # move the buffered file object to the end of the copied bytes
+        self._raw.seek(0, os.SEEK_END)
+
+    def flush(self):
+        """Write out every block queued so far; a partial block stays buffered."""
+        while self._pending:
+            self._raw.write(self._pending.popleft().result())
+        self._raw.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.finish_block()
+        self.flush()
+        self._raw.write(_EOF_BLOCK)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._raw.close()
+        self.closed = True
@@ -1,7 +1,39 @@
-from bamurai.core import parse_reads
-from bamurai.utils import create_progress_bar_for_file, count_reads_async_generic
+import os
+import struct
+
+import numpy as np
+import pysam
+
+from bamurai.core import parse_reads, iter_bam_lengths
+from bamurai.bgzf import BgzfReader, BgzfWriter, DEFAULT_COMPRESSION_LEVEL
+from bamurai.fastq import (
+    FastqWriter, FASTQ_BLOCK_SIZE, map_fastq, find_record_start, open_fastq, iter_fastq_stream_spans,
+    iter_fastq_views, iter_fastq_lengths,
+)
+from bamurai.index import load_index
+from bamurai.progress import create_progress_bar_for_file
+from bamurai.utils import is_fastq, track_read_position, untrack_read_position, copy_range, resolve_threads
+
+# a BAM record starts with its length, not counting these four bytes
+_BAM_RECORD_LENGTH = struct.Struct("<i").unpack_from
+
+# What --parts balances between the parts: the number of reads or their total length
+BALANCE_MODES = ("bases", "records")
 
 def chunk_reads(args):
+    parts = getattr(args, 'parts', None)
+    if parts is not None:
+        do_chunk_parts(
+            args.reads,
+            parts,
+            args.prefix,
+            balance=getattr(args, 'balance', "bases"),
+            threads=getattr(args, 'threads', None),
+            compress=getattr(args, 'compress', False),
+            compression_level=getattr(args, 'compression_level', DEFAULT_COMPRESSION_LEVEL),
+        )
+        return
+
     # Convert size string to bytes
     units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
     size = args.size.upper()
@@ -12,33 +44,282 @@ def chunk_reads(args):
         chunk_size = int(size)
 
     # Do the chunking
-    do_chunk(args.reads, chunk_size, args.prefix)
+    do_chunk(
+        args.reads,
+        chunk_size,
+        args.prefix,
+        threads=getattr(args, 'threads', None),
+        compress=getattr(args, 'compress', False),
+        compression_level=getattr(args, 'compression_level', DEFAULT_COMPRESSION_LEVEL),
+        bam=getattr(args, 'bam', False),
+    )
+
+def _record_ends(data, line_starts, line_ends):
+    """Return the offset just past each record in ``data``, its final line ending included."""
+    ends = np.empty(len(line_starts), dtype=np.int64)
+    ends[:-1] = line_starts[1:, 0]
+    last = int(line_ends[-1, 3])
+    # step over the whitespace stripped from the end of the last line, then its newline
+    while last < len(data) and int(data[last]) in b" \t\r\x0b\x0c":
+        last += 1
+    if last < len(data) and data[last] == 10:
+        last += 1
+    ends[-1] = last
+    return ends
+
+def _chunk_fastq_copy(input_file, chunk_size, output_prefix, pbar):
+    """
+    Chunk an uncompressed FASTQ file into uncompressed chunks by copying byte ranges.
+
+    Only the bytes around each chunk boundary are read, to find the record
+    that crosses it; everything else is copied by the kernel (see copy_range).
+    """
+    mapping = map_fastq(input_file)
+    if mapping is None:
+        return
+    size = len(mapping)
+    # end of the last chunk written, for the progress bar
+    position = [0]
+
+    def tell():
+        return position[0]
+
+    track_read_position(input_file, tell)
+    try:
+        with mapping, open(input_file, "rb") as src:
+            start, current_chunk = 0, 1
+            while start < size:
+                # the chunk ends with the record holding its chunk_size-th byte
+                end = find_record_start(mapping, start + max(chunk_size, 1))
+                with open(f"{output_prefix}_{current_chunk}.fastq", "wb") as dst:
+                    copy_range(src.fileno(), dst.fileno(), start, end - start)
+                position[0] = start = end
+                current_chunk += 1
+                pbar.poll()
+    finally:
+        untrack_read_position(input_file, tell)
+
+def _chunk_fastq_blocks(input_file, chunk_size, output_prefix, extension, threads, compression_level, pbar):
+    """
+    Chunk a FASTQ file by locating its records in blocks of raw bytes and writing whole ranges of them.
+
+    Used for gzipped input or compressed chunks, where the bytes have to pass
+    through this process anyway. Records are not parsed into reads; as with
+    the other parsers, reading stops at the first empty header line.
+    """
+    current_chunk = 1
+    current_out = None
+    with open_fastq(input_file, threads=threads) as handle:
+        chunks = iter(lambda: handle.read(FASTQ_BLOCK_SIZE), b"")
+        for _, data, line_starts, line_ends in iter_fastq_stream_spans(chunks):
+            ends = _record_ends(data, line_starts, line_ends)
+            view = memoryview(data)
+            pos = first = 0
+            while first < len(ends):
+                if current_out is None:
+                    current_out = FastqWriter(
+                        f"{output_prefix}_{current_chunk}{extension}",
+                        threads=threads,
+                        compression_level=compression_level,
+                    )
+                # the first record taking the chunk to chunk_size closes it;
+                # every chunk takes at least one record
+                needed = max(chunk_size - current_out.bytes_written, 1)
+                last = int(np.searchsorted(ends, pos + needed, side="left"))
+                stop = min(last + 1, len(ends))
+                current_out.write_fastq(view[pos:ends[stop - 1]], stop - first)
+                pbar.update(stop - first)
+                pos, first = int(ends[stop - 1]), stop
+                if last < len(ends):
+                    current_out.close()
+                    current_out = None
+                    current_chunk += 1
+    if current_out:
+        current_out.close()
+
+def _iter_bam_blocks(reader, file_size, records_start):
+    """
+    Yield ``(offset, size, data, first_record)`` for each BGZF block of a BAM file.
+
+    ``offset`` and ``size`` give the block's place in the compressed file,
+    ``data`` is its contents and ``first_record`` the offset in ``data`` of
+    the first record starting in it, or None if none does. Records are found
+    by following their length prefixes from ``records_start``, the virtual
+    offset of the first record (the end of the header).
+    """
+    # uncompressed offset of the next record, once the header has been passed
+    next_record = None
+    # the start of a length prefix cut off by the end of a block
+    carry = b""
+    block_start = 0
+    previous = None
+    for voffset, data in reader.blocks():
+        offset = voffset >> 16
+        if previous is not None:
+            yield previous[0], offset - previous[0], previous[1], previous[2]
+        first = None
+        if next_record is None and offset >= records_start >> 16:
+            next_record = block_start + (records_start & 0xffff if offset == records_start >> 16 else 0)
+        if next_record is not None:
+            if carry:
+                prefix = carry + data[:4 - len(carry)]
+                carry = b""
+                if len(prefix) < 4:
+                    carry = prefix
+                else:
+                    next_record += 4 + _BAM_RECORD_LENGTH(prefix)[0]
+            pos = next_record - block_start
+            if not carry and pos < len(data):
+                first = pos
+                while pos + 4 <= len(data):
+                    pos += 4 + _BAM_RECORD_LENGTH(data, pos)[0]
+                next_record = block_start + pos
+                carry = data[pos:]
+        previous = offset, data, first
+        block_start += len(data)
+    if previous is not None:
+        yield previous[0], file_size - previous[0], previous[1], previous[2]
+
+def _chunk_bam_blocks(input_file, chunk_size, output_prefix, threads, compression_level, pbar):
+    """
+    Chunk a BAM file into BAM files, copying its BGZF blocks.
+
+    Every chunk starts with the input's header. Once a chunk's compressed
+    size reaches chunk_size it ends at the first record starting in a later
+    block. Blocks in between are copied unchanged (see BgzfWriter.copy_blocks);
+    only the header and blocks cut by a chunk boundary are compressed again.
+    htslib starts a new block after the header and where a record would not
+    fit in the current one, so chunks of BAM files it wrote are nearly all
+    copied.
+    """
+    with pysam.AlignmentFile(input_file, "rb", check_sq=False) as bam:
+        records_start = bam.tell()
+
+    header = bytearray()
+    in_header = True
+    current_chunk = 1
+    current_out = None
+    closing = False
+    # range of input blocks waiting to be copied to current_out
+    copy_start = copy_end = 0
+
+    def start_chunk():
+        out = BgzfWriter(f"{output_prefix}_{current_chunk}.bam", resolve_threads(threads), compression_level)
+        out.write(header)
+        out.finish_block()
+        return out
+
+    def copy_pending():
+        nonlocal copy_start, copy_end
+        if copy_end > copy_start:
+            current_out.copy_blocks(src.fileno(), copy_start, copy_end - copy_start)
+        copy_start = copy_end = 0
+
+    def copy_block(offset, size):
+        nonlocal copy_start, copy_end
+        if copy_end != offset:
+            copy_pending()
+            copy_start = offset
+        copy_end = offset + size
+
+    def write_data(data):
+        copy_pending()
+        current_out.write(data)
+
+    with BgzfReader(input_file, resolve_threads(threads)) as reader, open(input_file, "rb") as src:
+        track_read_position(input_file, reader.compressed_tell)
+        for offset, size, data, first in _iter_bam_blocks(reader, os.fstat(src.fileno()).st_size, records_start):
+            if not data:
+                # the end-of-file marker, or another empty block
+                continue
+            if in_header:
+                if first is None:
+                    header += data
+                    continue
+                header += data[:first]
+                in_header = False
+                current_out = start_chunk()
+                if first:
+                    write_data(data[first:])
+                else:
+                    copy_block(offset, size)
+            elif closing and first is not None:
+                if first:
+                    write_data(data[:first])
+                copy_pending()
+                current_out.close()
+                current_chunk += 1
+                closing = False
+                current_out = start_chunk()
+                if first:
+                    write_data(data[first:])
+                else:
+                    copy_block(offset, size)
+            else:
+                copy_block(offset, size)
+            closing = current_out.compressed_size + copy_end - copy_start >= chunk_size
+            pbar.poll()
+        if current_out is not None:
+            copy_pending()
+            current_out.close()
+
+def do_chunk(input_file, chunk_size, output_prefix, threads=None, compress=False,
+             compression_level=DEFAULT_COMPRESSION_LEVEL, bam=False):
+    """
+    Split input file into chunks of at least chunk_size bytes.
+
+    FASTQ input is chunked without parsing its reads: records are found in
+    the raw bytes and copied to the chunks unchanged, and chunk size is
+    measured on those bytes. Uncompressed input chunked to uncompressed
+    output is copied by the kernel, so the reads never pass through Python;
+    records are then not validated. BAM/SAM/CRAM input is parsed and written
+    as FASTQ, its chunk size measured on the FASTQ written. With ``compress``
+    each chunk is written BGZF-compressed as <prefix>_<n>.fastq.gz.
+
+    With ``bam`` a BAM input is instead chunked into BAM files <prefix>_<n>.bam
+    holding its header and all its records, chunk size being measured on the
+    compressed chunks (see _chunk_bam_blocks).
+    """
+    extension = ".fastq.gz" if compress else ".fastq"
+
+    if bam:
+        if not input_file.endswith(".bam"):
+            raise ValueError(f"BAM chunks can only be made from a BAM file, got {input_file}")
+        pbar = create_progress_bar_for_file(input_file, "Chunking reads", count_reads=False)
+        _chunk_bam_blocks(input_file, chunk_size, output_prefix, threads, compression_level, pbar)
+        pbar.close()
+        return
+
+    if is_fastq(input_file):
+        if not compress and not input_file.endswith(".gz"):
+            pbar = create_progress_bar_for_file(input_file, "Chunking reads", count_reads=False)
+            _chunk_fastq_copy(input_file, chunk_size, output_prefix, pbar)
+        else:
+            pbar = create_progress_bar_for_file(input_file, "Chunking reads")
+            _chunk_fastq_blocks(input_file, chunk_size, output_prefix, extension, threads, compression_level, pbar)
+        pbar.close()
+        return
 
-def do_chunk(input_file, chunk_size, output_prefix):
-    """Split input file into chunks of at least chunk_size bytes"""
-    current_size = 0
     current_chunk = 1
     current_out = None
 
     # Create progress bar
     pbar = create_progress_bar_for_file(input_file, "Chunking reads")
-    count_thread = count_reads_async_generic(input_file, pbar)
 
-    for read in parse_reads(input_file):
-        pbar.update(1)
-        
+    for read in pbar.iterate(parse_reads(input_file, decode=False, threads=threads)):
         # Open new file if needed
         if current_out is None:
-            current_out = open(f"{output_prefix}_{current_chunk}.fastq", 'w')
-            current_size = 0
+            current_out = FastqWriter(
+                f"{output_prefix}_{current_chunk}{extension}",
+                threads=threads,
+                compression_level=compression_level,
+            )
 
         # Write read
-        read_str = read.to_fastq() + "\n"
-        current_out.write(read_str)
-        current_size += len(read_str.encode('utf-8'))
+        current_out.write(read)
 
         # Check if chunk is big enough
-        if current_size >= chunk_size:
+        if current_out.bytes_written >= chunk_size:
             current_out.close()
             current_out = None
             current_chunk += 1
@@ -47,3 +328,159 @@ def do_chunk(input_file, chunk_size, output_prefix):
 
     if current_out:
         current_out.close()
+
+class _PartWriter:
+    """
+    Writes parts <prefix>_1<extension> to <prefix>_<parts><extension> in turn.
+
+    Every part is created, empty or not, so a fixed number of downstream jobs
+    always finds its input.
+    """
+
+    def __init__(self, output_prefix, extension, parts, threads=None, compression_level=DEFAULT_COMPRESSION_LEVEL):
+        self.output_prefix = output_prefix
+        self.extension = extension
+        self.parts = parts
+        self.threads = threads
+        self.compression_level = compression_level
+        self.part = 0
+        self.out = self._open()
+
+    def _open(self):
+        return FastqWriter(
+            f"{self.output_prefix}_{self.part + 1}{self.extension}",
+            threads=self.threads,
+            compression_level=self.compression_level,
+        )
+
+    def to_part(self, part) -> FastqWriter:
+        """Return the writer of a part, closing the parts before it."""
+        while self.part < part:
+            self.out.close()
+            self.part += 1
+            self.out = self._open()
+        return self.out
+
+    def close(self):
+        self.to_part(self.parts - 1)
+        self.out.close()
+
+def _record_weights(line_starts, line_ends, balance):
+    """Return the weight of each FASTQ record of a block: 1, or its sequence length with ``balance="bases"``."""
+    if balance == "records":
+        return np.ones(len(line_starts), dtype=np.int64)
+    return (line_ends[:, 1] - line_starts[:, 1]).astype(np.int64)
+
+def _record_parts(before, weights, parts, total):
+    """
+    Return the part that records go to, from their weights and the weight of all records before each.
+
+    The total weight is cut into ``parts`` equal shares and each record goes
+    to the share holding its midpoint, so a part differs from an equal share
+    by at most the weight of the largest record.
+    """
+    return np.minimum((2 * before + weights) * parts // (2 * max(total, 1)), parts - 1)
+
+def _balance_total(input_file, balance, threads=None):
+    """
+    Return the number of reads in a file, or their total length with ``balance="bases"``.
+
+    Taken from the file's index when it has an up-to-date one; otherwise the
+    read lengths are counted in a pre-pass that does not parse the reads (see
+    iter_fastq_lengths and iter_bam_lengths).
+    """
+    index = load_index(input_file)
+    if index is not None:
+        return index.records if balance == "records" else index.bases
+    pbar = create_progress_bar_for_file(input_file, "Counting reads", count_reads=False)
+    if is_fastq(input_file):
+        lengths = iter_fastq_lengths(input_file, threads=threads)
+    else:
+        lengths = iter_bam_lengths(input_file, threads=threads)
+    total = 0
+    for batch in lengths:
+        total += len(batch) if balance == "records" else int(batch.sum())
+        pbar.poll()
+    pbar.close()
+    return total
+
+def _part_fastq_copy(input_file, parts, total, balance, output_prefix, pbar):
+    """
+    Divide an uncompressed FASTQ file into uncompressed parts by copying byte ranges.
+
+    The records are located in the mapped file to find where each part
+    starts; the parts are then copied by the kernel (see copy_range).
+    """
+    size = os.path.getsize(input_file)
+    # offset at which each part starts, and the end of the last one
+    bounds = [0] + [size] * parts
+    done, current = 0, 0
+    for _, line_starts, line_ends in iter_fastq_views(input_file):
+        weights = _record_weights(line_starts, line_ends, balance)
+        record_parts = _record_parts(done + np.cumsum(weights) - weights, weights, parts, total)
+        done += int(weights.sum())
+        last = int(record_parts[-1])
+        for part in range(current + 1, last + 1):
+            bounds[part] = int(line_starts[np.searchsorted(record_parts, part), 0])
+        current = last
+        pbar.update(len(line_starts))
+    with open(input_file, "rb") as src:
+        for part in range(parts):
+            with open(f"{output_prefix}_{part + 1}.fastq", "wb") as dst:
+                copy_range(src.fileno(), dst.fileno(), bounds[part], bounds[part + 1] - bounds[part])
+
+def _part_fastq_blocks(input_file, parts, total, balance, writer, threads, pbar):
+    """Divide a FASTQ file into parts, writing whole ranges of the raw records of each block (see _chunk_fastq_blocks)."""
+    done = 0
+    with open_fastq(input_file, threads=threads) as handle:
+        chunks = iter(lambda: handle.read(FASTQ_BLOCK_SIZE), b"")
+        for _, data, line_starts, line_ends in iter_fastq_stream_spans(chunks):
+            ends = _record_ends(data, line_starts, line_ends)
+            weights = _record_weights(line_starts, line_ends, balance)
+            record_parts = _record_parts(done + np.cumsum(weights) - weights, weights, parts, total)
+            done += int(weights.sum())
+            view = memoryview(data)
+            pos = first = 0
+            while first < len(ends):
+                part = int(record_parts[first])
+                stop = int(np.searchsorted(record_parts, part, side="right"))
+                writer.to_part(part).write_fastq(view[pos:ends[stop - 1]], stop - first)
+                pbar.update(stop - first)
+                pos, first = int(ends[stop - 1]), stop
+
+def do_chunk_parts(input_file, parts, output_prefix, balance="bases", threads=None, compress=False,
+                   compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Divide input file into ``parts`` chunks of about the same number of bases, or of reads with ``balance="records"``.
+
+    Exactly ``parts`` files <prefix>_1.fastq to <prefix>_<parts>.fastq are
+    written, some of them empty if there are fewer reads than parts, keeping
+    the reads in input order. The total to share out is taken from the file's
+    index or counted in a pre-pass (see _balance_total), and each read goes to
+    the part its midpoint falls in (see _record_parts). FASTQ records are
+    copied as they are, as in do_chunk.
+    """
+    if parts < 1:
+        raise ValueError(f"Number of parts must be at least 1, got {parts}")
+    if balance not in BALANCE_MODES:
+        raise ValueError(f"Balance must be one of {', '.join(BALANCE_MODES)}, got {balance}")
+    extension = ".fastq.gz" if compress else ".fastq"
+    total = _balance_total(input_file, balance, threads)
+
+    pbar = create_progress_bar_for_file(input_file, "Chunking reads")
+    if is_fastq(input_file) and not compress and not input_file.endswith(".gz"):
+        _part_fastq_copy(input_file, parts, total, balance, output_prefix, pbar)
+        pbar.close()
+        return
+
+    writer = _PartWriter(output_prefix, extension, parts, threads, compression_level)
+    if is_fastq(input_file):
+        _part_fastq_blocks(input_file, parts, total, balance, writer, threads, pbar)
+    else:
+        done = 0
+        for read in pbar.iterate(parse_reads(input_file, decode=False, threads=threads)):
+            weight = 1 if balance == "records" else len(read)
+            writer.to_part(int(_record_parts(done, weight, parts, total))).write(read)
+            done += weight
+    pbar.close()
+    writer.close()
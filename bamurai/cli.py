@@ -11,6 +11,10 @@ from bamurai.split_samples import *
 from bamurai.extract_sample import *
 from bamurai.assign_samples import *
 from bamurai.get_hto import *
+from bamurai.index import index_files, DEFAULT_INDEX_INTERVAL
+from bamurai.utils import resolve_threads
+from bamurai.progress import configure_progress, DEFAULT_JSON_INTERVAL, NO_PROGRESS_ENV_VAR
+from bamurai.bgzf import DEFAULT_COMPRESSION_LEVEL
 from bamurai import __version__
 
 def main():
@@ -46,14 +50,16 @@ def main():
             return indent + '\n'.join(lines)
 
     input_read_arg_description = "Input reads file (BAM/FASTQ)"
-    output_file_arg_description = "Output file (FASTQ)"
+    output_file_arg_description = "Output file (FASTQ), BGZF-compressed if it ends in .gz; unaligned BAM keeping the input's tags if it ends in .bam"
+    compression_level_arg_description = f"Compression level for gzipped FASTQ output, 0-9 (default: {DEFAULT_COMPRESSION_LEVEL})"
+    workers_arg_description = "Number of worker processes splitting reads for FASTQ output; the output is the same for any number (default: 1)"
 
     # Subparser for the "split" command
     parser_split = subparsers.add_parser(
         "split",
         help="Split reads in a BAM/FASTQ file to a target length",
         description = """
-        Split reads in a BAM/FASTQ file to a target length. Each read will be split into fragments as close to the target length as possible. The output will be in FASTQ format written to the output file specified. If no output file is defined then the otuput is written to stdout. Reads that are shorter than the target length are not split.
+        Split reads in a BAM/FASTQ file to a target length. Each read will be split into fragments as close to the target length as possible. The output will be in FASTQ format written to the output file specified, or unaligned BAM keeping each read's tags if the output file ends in .bam. If no output file is defined then the otuput is written to stdout. Reads that are shorter than the target length are not split.
         """,
         formatter_class=CustomFormatter
     )
@@ -61,34 +67,68 @@ def main():
     parser_split.add_argument("-l", "--len-target", type=int, help="Target length for splitting reads")
     parser_split.add_argument("--len_target", dest="len_target", type=int, help=argparse.SUPPRESS)
     parser_split.add_argument("-o", "--output", type=str, nargs='?', help=output_file_arg_description)
+    parser_split.add_argument("--compression-level", type=int, choices=range(10), metavar="LEVEL", default=DEFAULT_COMPRESSION_LEVEL, help=compression_level_arg_description)
+    parser_split.add_argument("-w", "--workers", type=int, default=1, help=workers_arg_description)
     parser_split.set_defaults(func=split_reads)
 
     # Subparser for the "stats" command
     parser_stat = subparsers.add_parser(
         "stats",
-        help="Calculate statistics for a BAM or FASTQ(.gz) file",
+        help="Calculate statistics for BAM or FASTQ(.gz) files",
         description = """
-        Calculate statistics for a BAM or FASTQ(.gz) file. The statistics include:
+        Calculate statistics for BAM or FASTQ(.gz) files. The statistics include:
 
         - Total number of reads
-        - Average read length
+        - Average, median, minimum and maximum read length
         - Total throughput (in gigabases)
-        - N50 read length
+        - N50 and N10-N90 read lengths
+
+        Several files, directories or glob patterns can be given; each file gets its own statistics, followed by those of all files together.
+
+        --extended adds the mean base quality, the mean of the reads' mean qualities (both averaged as error probabilities) and the GC content, and --qual-histogram writes reads and bases by read length and mean quality.
+
+        --summary also writes the read length histogram of all the inputs to a small file, and --merge combines such files into the statistics of all their reads without reading the reads again.
 
         NOTE: For BAM/SAM/CRAM files, only primary alignments are processed. Secondary and supplementary alignments are ignored.
         """,
         formatter_class=CustomFormatter
     )
-    parser_stat.add_argument("reads", type=str, help=input_read_arg_description)
+    parser_stat.add_argument("reads", type=str, nargs="+", help="Input reads files (BAM/FASTQ), directories of them or glob patterns")
     parser_stat.add_argument("--tsv", action="store_true", help="Output in TSV format", default=False)
+    parser_stat.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes reading files in parallel when given several (default: 1)")
+    parser_stat.add_argument("--extended", action="store_true", default=False, help="Also report the mean base and read quality and GC content, reading every sequence and quality in the same pass")
+    parser_stat.add_argument("--qual-histogram", type=str, default=None, help="Write a histogram of reads and bases by read length and mean quality to this TSV file (implies --extended)")
+    parser_stat.add_argument("--summary", type=str, default=None, help="Also write a mergeable summary of all the inputs' read lengths to this file (gzipped if it ends in .gz)")
+    parser_stat.add_argument("--merge", action="store_true", default=False, help="Inputs are summaries written by --summary (or bamurai index files); combine them without reading any reads")
     parser_stat.set_defaults(func=file_stats)
 
+    # Subparser for the "index" command
+    parser_index = subparsers.add_parser(
+        "index",
+        help="Index BAM or FASTQ(.gz) files for faster repeated runs",
+        description = """
+        Write a sidecar index <file>.bamurai.idx next to each input file, holding its read count, total bases and read length histogram, and a seek point every --interval reads.
+
+        Other commands use an index when it is present and the file has not changed since:
+
+        - stats reads its statistics from the index instead of the file
+        - progress bars count reads against the read count in the index
+        - with --workers, split and divide workers read their own parts of the file
+
+        Seek points are written for uncompressed and BGZF-compressed FASTQ files and BAM files; other files get an index without them.
+        """,
+        formatter_class=CustomFormatter
+    )
+    parser_index.add_argument("reads", type=str, nargs="+", help="Input reads files (BAM/FASTQ), directories of them or glob patterns")
+    parser_index.add_argument("--interval", type=int, default=DEFAULT_INDEX_INTERVAL, help=f"Number of reads between seek points (default: {DEFAULT_INDEX_INTERVAL})")
+    parser_index.set_defaults(func=index_files)
+
     # Subparser for the "divide" command
     parser_divide = subparsers.add_parser(
         "divide",
         help="Divide reads in a BAM/FASTQ into fixed number of fragments",
         description = """
-        Divide reads in a BAM/FASTQ file into a fixed number of fragments. The output will be in FASTQ format written to the output file specified. If no output file is defined then the output is written to stdout. Reads that are shorter than the minimum length are not divided.
+        Divide reads in a BAM/FASTQ file into a fixed number of fragments. The output will be in FASTQ format written to the output file specified, or unaligned BAM keeping each read's tags if the output file ends in .bam. If no output file is defined then the output is written to stdout. Reads that are shorter than the minimum length are not divided.
 
         NOTE: For BAM/SAM/CRAM files, only primary alignments are processed. Secondary and supplementary alignments are ignored.
         """,
@@ -100,6 +140,8 @@ def main():
     parser_divide.add_argument("-m", "--min-length", type=int, help="Minimum length for a fragment, reads will not be divided if resultant length is less than this (default = 100)", default=100)
     parser_divide.add_argument("--min_length", dest="min_length", type=int, help=argparse.SUPPRESS)
     parser_divide.add_argument("-o", "--output", type=str, nargs='?', help=output_file_arg_description)
+    parser_divide.add_argument("--compression-level", type=int, choices=range(10), metavar="LEVEL", default=DEFAULT_COMPRESSION_LEVEL, help=compression_level_arg_description)
+    parser_divide.add_argument("-w", "--workers", type=int, default=1, help=workers_arg_description)
     parser_divide.set_defaults(func=divide_reads)
 
     # Subparser for the "validate" command
@@ -134,6 +176,16 @@ def main():
         will be named <prefix>_1.fastq, <prefix>_2.fastq, etc. Each chunk will be at
         least as large as the specified size, but may be larger to avoid splitting
         individual reads.
+
+        With --bam, a BAM file is chunked into BAM files <prefix>_1.bam, etc., each
+        with the input's header and records, and the size is that of the compressed
+        chunks. The input's compressed blocks are copied into the chunks unchanged
+        wherever possible.
+
+        With --parts N, the reads are instead divided into exactly N chunks holding
+        about the same number of bases (or reads, with --balance records), so N jobs
+        working on them finish at about the same time. The total is read from the
+        file's index when it has one, and otherwise counted in a first pass.
         """,
         formatter_class=CustomFormatter
     )
@@ -141,15 +193,44 @@ def main():
     parser_chunk.add_argument(
         "-s", "--size",
         type=str,
-        required=True,
         help="Minimum chunk size (e.g. 1G, 100M, 1000K)"
     )
+    parser_chunk.add_argument(
+        "-n", "--parts",
+        type=int,
+        metavar="N",
+        help="Divide the reads into exactly N chunks instead of chunks of a given size"
+    )
+    parser_chunk.add_argument(
+        "--balance",
+        choices=BALANCE_MODES,
+        default="bases",
+        help="What --parts shares out equally between the chunks: total bases or number of reads (default: bases)"
+    )
     parser_chunk.add_argument(
         "-p", "--prefix",
         type=str,
         default="chunk",
         help="Output file prefix (default: 'chunk')"
     )
+    parser_chunk.add_argument(
+        "-z", "--compress",
+        action="store_true",
+        help="Write BGZF-compressed chunks named <prefix>_1.fastq.gz, etc."
+    )
+    parser_chunk.add_argument(
+        "--bam",
+        action="store_true",
+        help="Write BAM chunks named <prefix>_1.bam, etc., keeping the header and all records of a BAM input"
+    )
+    parser_chunk.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(10),
+        metavar="LEVEL",
+        default=DEFAULT_COMPRESSION_LEVEL,
+        help=compression_level_arg_description
+    )
     parser_chunk.set_defaults(func=chunk_reads)
 
     # Subparser for the "split_samples" command
@@ -162,6 +243,8 @@ def main():
     split_parser.add_argument("--output-dir", default="output", help="Output directory for split files (default: 'output')")
     split_parser.add_argument("--barcode-column", type=str, default=None, help="Column name for barcode in TSV (default: auto-detect 'barcode' or 'cell')")
     split_parser.add_argument("--donor-id-column", type=str, default=None, help="Column name for donor_id in TSV (default: 'donor_id')")
+    split_parser.add_argument("-z", "--compress", action="store_true", help="Write FASTQ output BGZF-compressed as <donor_id>.fastq.gz")
+    split_parser.add_argument("--compression-level", type=int, choices=range(10), metavar="LEVEL", default=DEFAULT_COMPRESSION_LEVEL, help=compression_level_arg_description)
     split_parser.set_defaults(func=split_samples)
 
     # Subparser for the "extract_sample" command
@@ -211,11 +294,69 @@ def main():
     parser_get_hto.add_argument("--hashtag-left-buffer", type=int, default=10, help="Hashtag left buffer (default: 10).")
     parser_get_hto.set_defaults(func=get_hto)
 
+    # Global options shared by every subcommand
+    parser.add_argument(
+        "-t", "--threads",
+        type=int,
+        default=None,
+        help="Number of threads for BAM/BGZF decompression and compression (default: $BAMURAI_THREADS or 1)"
+    )
+    parser.add_argument(
+        "--no-progress",
+        action="store_true",
+        default=None,
+        help=f"Do not show progress bars (also turned off by setting ${NO_PROGRESS_ENV_VAR})"
+    )
+    parser.add_argument(
+        "--progress-json",
+        type=str,
+        default=None,
+        metavar="FILE|FD",
+        help="Write progress records (reads and bytes processed, rate, ETA, memory use) as JSON lines to this file or open file descriptor; SIGUSR1 writes one at any time"
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=DEFAULT_JSON_INTERVAL,
+        metavar="SECONDS",
+        help=f"Seconds between --progress-json records (default: {DEFAULT_JSON_INTERVAL:g})"
+    )
+
     # Print version if "--version" is passed
     parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
 
     args = parser.parse_args()
 
+    try:
+        args.threads = resolve_threads(args.threads)
+    except ValueError as e:
+        parser.error(str(e))
+    if getattr(args, "workers", 1) < 1:
+        parser.error(f"--workers must be at least 1, got {args.workers}")
+    if getattr(args, "merge", False) and (args.extended or args.qual_histogram):
+        parser.error("--extended and --qual-histogram need the reads and cannot be used with --merge")
+    if getattr(args, "interval", 1) < 1:
+        parser.error(f"--interval must be at least 1, got {args.interval}")
+    if args.command == "chunk":
+        if (args.size is None) == (args.parts is None):
+            parser.error("chunk needs one of --size and --parts")
+        if args.parts is not None and args.parts < 1:
+            parser.error(f"--parts must be at least 1, got {args.parts}")
+        if args.parts is not None and args.bam:
+            parser.error("--parts cannot be used with --bam")
+        if args.bam and not args.reads.endswith(".bam"):
+            parser.error(f"--bam needs a BAM input file, got {args.reads}")
+    if args.progress_interval <= 0:
+        parser.error(f"--progress-interval must be positive, got {args.progress_interval}")
+    try:
+        configure_progress(
+            enabled=False if args.no_progress else None,
+            json_target=args.progress_json,
+            json_interval=args.progress_interval,
+        )
+    except OSError as e:
+        parser.error(f"cannot open --progress-json {args.progress_json}: {e}")
+
     if args.command:
         args.func(args)
     else:
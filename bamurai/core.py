@@ -8,24 +8,82 @@ Secondary and supplementary alignments are always ignored.
 
 import os
 import pysam
-import gzip
 
 import numpy as np
 
 from dataclasses import dataclass
+from bamurai.fastq import (
+    open_fastq,
+    iter_fastq_lines,
+    iter_fastq_records,
+    iter_fastq_records_mmap,
+    iter_fastq_views,
+    gather_spans,
+)
+from bamurai.utils import resolve_threads, track_alignment_file
+from bamurai.ubam import unaligned_fields, slice_tags
 
-@dataclass
+# FASTQ parsing engines accepted by parse_reads. "block" is the bulk binary
+# parser and "mmap" the zero-copy reader for uncompressed regular files, for
+# callers that want views or byte ranges of the file. "readline" is the
+# original line-at-a-time text loop. "auto" picks readline for parse_reads: the
+# block parser is faster on long reads, but slower on short ones, where the
+# per-record cost of slicing in Python outweighs the C readline loop.
+# parse_read_batches cannot use readline, so there "auto" picks block.
+FASTQ_ENGINES = ("auto", "block", "mmap", "readline")
+
+# Number of reads per ReadBatch yielded by parse_read_batches.
+DEFAULT_BATCH_SIZE = 10_000
+
+# Bases at which a ReadBatch is full even with fewer than DEFAULT_BATCH_SIZE
+# reads, so batches of long reads stay tens of megabytes rather than gigabytes.
+DEFAULT_BATCH_BASES = 4 * 1024 * 1024
+
+# FASTQ stores Phred scores as ASCII characters offset by 33; BAM stores them
+# as raw bytes. Translating through a table converts a whole buffer in one call.
+PHRED_OFFSET = 33
+_PHRED_TO_FASTQ = bytes((i + PHRED_OFFSET) % 256 for i in range(256))
+_FASTQ_TO_PHRED = bytes((i - PHRED_OFFSET) % 256 for i in range(256))
+
+def phred_to_fastq(phred) -> bytes:
+    """Convert raw Phred scores (bytes, memoryview or array('B')) to FASTQ quality bytes."""
+    return bytes(phred).translate(_PHRED_TO_FASTQ)
+
+def fastq_to_phred(quality) -> bytes:
+    """Convert FASTQ quality characters (str or bytes-like) to raw Phred score bytes."""
+    if isinstance(quality, str):
+        quality = quality.encode()
+    return bytes(quality).translate(_FASTQ_TO_PHRED)
+
+@dataclass(slots=True)
 class Read:
-    """Class to represent a FASTQ read."""
+    """
+    Class to represent a FASTQ read.
+
+    The sequence and quality may be ``str``, ``bytes`` or ``memoryview``;
+    slicing a ``bytes``-backed read with a memoryview avoids copying the
+    payload. Validation runs on construction unless ``validate=False``, which
+    is meant for reads derived from an already validated record.
+
+    With ``raw_quality=True`` the quality holds raw Phred scores as read from
+    a BAM file rather than FASTQ characters; they are only converted when the
+    read is written as FASTQ. ``tags`` optionally holds the BAM tags of the
+    record as (tag, value, type) tuples, for unaligned BAM output.
+    """
     read_id: str
-    sequence: str
-    quality: str
+    sequence: str | bytes | memoryview
+    quality: str | bytes | memoryview
+    raw_quality: bool
+    tags: list | None
 
-    def __init__(self, read_id, sequence, quality):
+    def __init__(self, read_id, sequence, quality, validate=True, raw_quality=False, tags=None):
         self.read_id = read_id
         self.sequence = sequence
         self.quality = quality
-        self.validate()
+        self.raw_quality = raw_quality
+        self.tags = tags
+        if validate:
+            self.validate()
 
     def __len__(self):
         return len(self.sequence)
@@ -43,72 +101,507 @@ class Read:
             return False
 
     def to_fastq(self):
-        return f"@{self.read_id}\n{self.sequence}\n+\n{self.quality}"
+        if isinstance(self.sequence, str) and not self.raw_quality:
+            return f"@{self.read_id}\n{self.sequence}\n+\n{self.quality}"
+        return self.to_fastq_bytes()[:-1].decode()
+
+    def to_fastq_bytes(self):
+        """Return the read as FASTQ bytes, terminated by a newline."""
+        sequence, quality = self.sequence, self.quality
+        if self.raw_quality:
+            quality = phred_to_fastq(quality)
+        elif isinstance(quality, str):
+            quality = quality.encode()
+        if isinstance(sequence, str):
+            sequence = sequence.encode()
+        return b"".join((b"@", self.read_id.encode(), b"\n", sequence, b"\n+\n", quality, b"\n"))
+
+    def fastq_quality(self):
+        """Return the quality as FASTQ characters in bytes, converting raw Phred scores."""
+        if self.raw_quality:
+            return phred_to_fastq(self.quality)
+        if isinstance(self.quality, str):
+            return self.quality.encode()
+        return self.quality
+
+    def phred_quality(self):
+        """Return the quality as raw Phred score bytes, as stored in BAM records."""
+        if self.raw_quality:
+            return bytes(self.quality)
+        return fastq_to_phred(self.quality)
+
+@dataclass
+class ReadBatch:
+    """
+    Class to represent a batch of reads in columnar form.
+
+    Read IDs, sequences and qualities are each stored as a single
+    concatenated bytes buffer. ``name_offsets`` and ``offsets`` are int64
+    arrays of length n + 1 giving the start of each record in the name and
+    sequence/quality buffers respectively, and ``lengths`` holds the n
+    sequence lengths. Qualities are FASTQ characters, or raw Phred scores
+    when ``raw_quality`` is set (batches read from BAM files).
+    """
+    names: bytes
+    name_offsets: np.ndarray
+    sequences: bytes
+    qualities: bytes
+    offsets: np.ndarray
+    lengths: np.ndarray
+    raw_quality: bool = False
+
+    @classmethod
+    def from_records(cls, read_ids, sequences, qualities, raw_quality=False):
+        """Build a batch from parallel lists of read ID, sequence and quality bytes."""
+        n = len(read_ids)
+        name_lengths = np.fromiter(map(len, read_ids), dtype=np.int64, count=n)
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=n)
+        qual_lengths = np.fromiter(map(len, qualities), dtype=np.int64, count=n)
+
+        mismatched = np.flatnonzero(lengths != qual_lengths)
+        if mismatched.size:
+            read_id = bytes(read_ids[mismatched[0]]).decode()
+            raise ValueError(f"Sequence and quality strings must be of equal length. Offending read: {read_id}")
+
+        return cls(
+            names=b"".join(read_ids),
+            name_offsets=_offsets_from_lengths(name_lengths),
+            sequences=b"".join(sequences),
+            qualities=b"".join(qualities),
+            offsets=_offsets_from_lengths(lengths),
+            lengths=lengths,
+            raw_quality=raw_quality,
+        )
+
+    @classmethod
+    def from_spans(cls, data, line_starts, line_ends):
+        """
+        Build a batch from FASTQ line spans (see bamurai.fastq.iter_fastq_spans).
+
+        Each field is gathered out of the uint8 array ``data`` with one NumPy
+        call, so no per-record objects are created.
+        """
+        names, name_lengths = gather_spans(data, line_starts[:, 0] + 1, line_ends[:, 0])
+        sequences, lengths = gather_spans(data, line_starts[:, 1], line_ends[:, 1])
+        qualities, qual_lengths = gather_spans(data, line_starts[:, 3], line_ends[:, 3])
+        name_offsets = _offsets_from_lengths(name_lengths)
+
+        mismatched = np.flatnonzero(lengths != qual_lengths)
+        if mismatched.size:
+            i = mismatched[0]
+            read_id = names[name_offsets[i]:name_offsets[i + 1]].decode()
+            raise ValueError(f"Sequence and quality strings must be of equal length. Offending read: {read_id}")
+
+        return cls(
+            names=names,
+            name_offsets=name_offsets,
+            sequences=sequences,
+            qualities=qualities,
+            offsets=_offsets_from_lengths(lengths),
+            lengths=lengths,
+        )
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def total_bases(self):
+        return int(self.lengths.sum())
+
+    @property
+    def nbytes(self):
+        """Bytes held by the batch's names, sequences and qualities."""
+        return len(self.names) + len(self.sequences) + len(self.qualities)
+
+    def read_id(self, i):
+        return self.names[self.name_offsets[i]:self.name_offsets[i + 1]].decode()
+
+    def fastq_qualities(self):
+        """Return the quality buffer as FASTQ characters, converting raw Phred scores in one pass."""
+        if self.raw_quality:
+            return phred_to_fastq(self.qualities)
+        return self.qualities
+
+    def read(self, i, decode=True):
+        """
+        Return the i-th read of the batch as a Read.
+
+        With ``decode=False`` the sequence and quality are memoryviews into the
+        batch buffers, and raw Phred scores are left unconverted. The batch is
+        validated as a whole, so the read is not.
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if decode:
+            quality = self.qualities[start:end]
+            if self.raw_quality:
+                quality = phred_to_fastq(quality)
+            return Read(self.read_id(i), self.sequences[start:end].decode(), quality.decode(), validate=False)
+        return Read(self.read_id(i), memoryview(self.sequences)[start:end], memoryview(self.qualities)[start:end],
+                    validate=False, raw_quality=self.raw_quality)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read(i)
+
+    def fragments(self, starts, ends, counts):
+        """
+        Return a batch of the fragments of every read, named <read_id>_<n>.
+
+        ``starts``, ``ends`` and ``counts`` are as returned by fragment_bounds.
+        The fragments of a read must cover it end to end, so the sequence and
+        quality buffers are shared with this batch and only the offsets change.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        read_index = np.repeat(np.arange(len(self)), counts)
+        fragment_number = np.arange(len(read_index)) - np.repeat(_offsets_from_lengths(counts)[:-1], counts)
+
+        names, name_offsets = self.names, self.name_offsets.tolist()
+        read_ids = [names[name_offsets[i]:name_offsets[i + 1]] for i in range(len(self))]
+        fragment_ids = [b"%s_%d" % (read_ids[i], n) for i, n in zip(read_index.tolist(), fragment_number.tolist())]
+        lengths = np.asarray(ends, dtype=np.int64) - starts
+
+        return ReadBatch(
+            names=b"".join(fragment_ids),
+            name_offsets=_offsets_from_lengths(np.fromiter(map(len, fragment_ids), dtype=np.int64, count=len(fragment_ids))),
+            sequences=self.sequences,
+            qualities=self.qualities,
+            offsets=_offsets_from_lengths(lengths),
+            lengths=lengths,
+            raw_quality=self.raw_quality,
+        )
+
+    def to_fastq(self):
+        """Serialise the batch as FASTQ bytes, each record terminated by a newline."""
+        names, sequences, qualities = self.names, self.sequences, self.fastq_qualities()
+        name_offsets = self.name_offsets.tolist()
+        offsets = self.offsets.tolist()
+        parts = []
+        for i in range(len(self)):
+            start, end = offsets[i], offsets[i + 1]
+            parts.append(b"@%s\n%s\n+\n%s\n" % (
+                names[name_offsets[i]:name_offsets[i + 1]],
+                sequences[start:end],
+                qualities[start:end],
+            ))
+        return b"".join(parts)
+
+def _offsets_from_lengths(lengths):
+    """Turn an array of n lengths into n + 1 int64 start offsets."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def fragment_bounds(lengths, counts, sizes):
+    """
+    Lay out the fragments of a batch of reads as flat arrays.
+
+    Read i is cut into ``counts[i]`` fragments of ``sizes[i]`` bases, the last
+    running to the end of the read. Returns int64 ``(starts, ends)`` arrays
+    holding every fragment of every read in order, relative to the start of
+    its read.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    fragment_number = np.arange(int(counts.sum())) - np.repeat(_offsets_from_lengths(counts)[:-1], counts)
+    starts = fragment_number * np.repeat(sizes, counts)
+    is_last = fragment_number == np.repeat(counts, counts) - 1
+    ends = np.where(is_last, np.repeat(lengths, counts), starts + np.repeat(sizes, counts))
+    return starts, ends
 
 def qual_to_fastq_numpy(qualities):
     """Convert query_qualities to FASTQ QUAL using NumPy (Best for Large Arrays)."""
     return (np.array(qualities, dtype=np.uint8) + 33).tobytes().decode()
 
-def parse_reads(read_file):
+def _resolve_fastq_engine(read_file, engine, auto="readline"):
+    """Check a FASTQ engine name for the given file and resolve "auto" to ``auto``."""
+    if engine not in FASTQ_ENGINES:
+        raise ValueError(f"Unknown FASTQ engine '{engine}', expected one of: {', '.join(FASTQ_ENGINES)}")
+    uncompressed = not read_file.endswith(".gz")
+    if engine == "mmap" and not uncompressed:
+        raise ValueError("The mmap FASTQ engine requires an uncompressed FASTQ file")
+    if engine == "auto":
+        return auto
+    return engine
+
+def parse_reads(read_file, engine: str = "auto", decode: bool = True, validate: bool = True, threads: int | None = None,
+                tags: bool = False):
     """
     Parse reads from a file.
 
     For BAM/SAM/CRAM files, only primary alignments are parsed; secondary and supplementary alignments are ignored.
+    With ``decode=False`` their sequences are ``bytes`` and their qualities the
+    raw Phred scores (``raw_quality=True``), converted only if written as FASTQ.
+    With ``tags=True`` they also carry their tags and are returned in their
+    original sequencing orientation (see bamurai.ubam.unaligned_fields).
+    FASTQ files are parsed with the given engine, one of FASTQ_ENGINES, and
+    "auto" picks readline. With the block engine, ``decode=False`` keeps each
+    sequence and quality as ``bytes``; with the mmap engine they are
+    memoryviews into the mapped file.
+    Every record is validated once unless ``validate=False``. ``threads`` sets
+    the number of BAM or BGZF decompression threads (see resolve_threads).
     """
+    fastq_engine = _resolve_fastq_engine(read_file, engine)
+
     # if file is a BAM/SAM/CRAM
     if read_file.endswith(".bam") or read_file.endswith(".sam") or read_file.endswith(".cram"):
-        with pysam.AlignmentFile(read_file, "rb", check_sq=False) as bam:
+        with pysam.AlignmentFile(read_file, "rb", check_sq=False, threads=resolve_threads(threads)) as bam:
+            track_alignment_file(read_file, bam)
             for read in bam:
                 if read.is_secondary or read.is_supplementary:
                     continue
                 try:
-                    qualities = read.query_qualities
-                    yield Read(read.query_name, read.query_sequence, qual_to_fastq_numpy(qualities))
+                    if tags:
+                        sequence, phred, read_tags = unaligned_fields(read)
+                        if decode:
+                            yield Read(read.query_name, sequence, phred_to_fastq(phred).decode(), validate, tags=read_tags)
+                        else:
+                            yield Read(read.query_name, sequence.encode(), phred, validate, raw_quality=True, tags=read_tags)
+                        continue
+                    phred = read.query_qualities.tobytes()
+                    if decode:
+                        yield Read(read.query_name, read.query_sequence, phred_to_fastq(phred).decode(), validate)
+                    else:
+                        yield Read(read.query_name, read.query_sequence.encode(), phred, validate, raw_quality=True)
                 except Exception as e:
                     print(f"Failed to parse BAM read: {str(read)}\nError: {e}")
                     continue
 
-    # if file is a FASTQ
-    elif read_file.endswith(".fastq") or read_file.endswith(".fq"):
-        with open(read_file, "r", encoding='utf-8') as f:
-            while True:
-                read_id = f.readline().strip()
-                if not read_id:
-                    break
-                sequence = f.readline().strip()
-                f.readline()
-                quality = f.readline().strip()
-                yield Read(read_id[1:], sequence, quality)
-
-    # if file is a gzipped FASTQ
-    elif read_file.endswith(".fastq.gz") or read_file.endswith(".fq.gz"):
-        with gzip.open(read_file, "rt") as f:
-            while True:
-                read_id = f.readline().strip()
-                if not read_id:
+    # if file is a plain or gzipped FASTQ
+    elif read_file.endswith((".fastq", ".fq", ".fastq.gz", ".fq.gz")):
+        if fastq_engine == "block":
+            records = iter_fastq_records(read_file, threads=threads, decode=decode)
+            if decode:
+                for read_id, sequence, quality in records:
+                    yield Read(read_id, sequence, quality, validate)
+            else:
+                for read_id, sequence, quality in records:
+                    yield Read(read_id.decode(), sequence, quality, validate)
+        elif fastq_engine == "mmap":
+            for read_id, sequence, quality in iter_fastq_records_mmap(read_file, decode=decode):
+                if not decode:
+                    read_id = str(read_id, "utf-8")
+                yield Read(read_id, sequence, quality, validate)
+        else:
+            yield from _parse_fastq_readline(read_file, validate, threads)
+
+def _parse_fastq_readline(read_file, validate=True, threads=None):
+    """Parse a plain or gzipped FASTQ file one line at a time in text mode."""
+    with open_fastq(read_file, "rt", threads=threads) as f:
+        while True:
+            read_id = f.readline().strip()
+            if not read_id:
+                break
+            sequence = f.readline().strip()
+            f.readline()
+            quality = f.readline().strip()
+            yield Read(read_id[1:], sequence, quality, validate)
+
+
+def parse_read_batches(read_file, batch_size: int = DEFAULT_BATCH_SIZE, threads: int | None = None, engine: str = "auto",
+                       start: int | None = None, limit: int | None = None, max_bases: int = DEFAULT_BATCH_BASES):
+    """
+    Parse reads from a file as ReadBatch objects of up to batch_size reads.
+
+    A batch also ends with the read that takes it to ``max_bases`` bases, so
+    memory use does not grow with read length.
+
+    Accepts the same inputs as parse_reads; for BAM/SAM/CRAM files only primary
+    alignments are included. FASTQ files are read with the block or mmap engine;
+    the mmap engine may yield short batches at its internal block edges.
+
+    ``start`` and ``limit`` read part of a file: parsing starts at a seek point
+    from a bamurai index (a byte offset into an uncompressed FASTQ file, a BGZF
+    virtual offset into a BAM or BGZF-compressed FASTQ file; see
+    bamurai.index) and stops after ``limit`` records. Records are counted as
+    the index counts them, so BAM records with a sequence but no qualities
+    count although they are skipped.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if max_bases < 1:
+        raise ValueError("max_bases must be at least 1")
+    fastq_engine = _resolve_fastq_engine(read_file, engine, auto="block")
+    if fastq_engine == "readline":
+        raise ValueError("parse_read_batches does not support the readline engine")
+
+    if read_file.endswith(".bam") or read_file.endswith(".sam") or read_file.endswith(".cram"):
+        yield from _parse_bam_batches(read_file, batch_size, threads, start, limit, max_bases)
+    elif read_file.endswith((".fastq", ".fq", ".fastq.gz", ".fq.gz")):
+        if fastq_engine == "mmap":
+            yield from _parse_fastq_batches_mmap(read_file, batch_size, start, limit, max_bases)
+        else:
+            yield from _parse_fastq_batches(read_file, batch_size, threads, start, limit, max_bases)
+
+def _batch_ends(lengths, batch_size, max_bases):
+    """
+    Return the end of each full batch of a run of records with the given sequence lengths.
+
+    A batch is full at ``batch_size`` records or with the record that takes it
+    to ``max_bases`` bases; records after the last full batch are not in one.
+    """
+    totals = np.cumsum(lengths)
+    ends = []
+    start = 0
+    while start < len(totals):
+        before = int(totals[start - 1]) if start else 0
+        end = min(start + batch_size, int(np.searchsorted(totals, before + max_bases, side="left")) + 1)
+        if end > len(totals):
+            break
+        ends.append(end)
+        start = end
+    return ends
+
+def _parse_bam_batches(read_file, batch_size, threads=None, start=None, limit=None, max_bases=DEFAULT_BATCH_BASES):
+    """Yield ReadBatch objects from the primary alignments of a BAM/SAM/CRAM file."""
+    read_ids, sequences, qualities = [], [], []
+    records = bases = 0
+    with pysam.AlignmentFile(read_file, "rb", check_sq=False, threads=resolve_threads(threads)) as bam:
+        track_alignment_file(read_file, bam)
+        if start is not None:
+            bam.seek(start)
+        for read in bam:
+            if read.is_secondary or read.is_supplementary:
+                continue
+            sequence = read.query_sequence
+            if sequence is not None:
+                if records == limit:
                     break
-                sequence = f.readline().strip()
-                f.readline()
-                quality = f.readline().strip()
-                yield Read(read_id[1:], sequence, quality)
+                records += 1
+            phred = read.query_qualities
+            if sequence is None or phred is None:
+                print(f"Failed to parse BAM read: {str(read)}\nError: missing sequence or qualities")
+                continue
+            read_ids.append(read.query_name.encode())
+            sequences.append(sequence.encode())
+            qualities.append(phred.tobytes())
+            bases += len(sequence)
+            if len(read_ids) == batch_size or bases >= max_bases:
+                yield _bam_batch(read_ids, sequences, qualities)
+                read_ids, sequences, qualities = [], [], []
+                bases = 0
+    if read_ids:
+        yield _bam_batch(read_ids, sequences, qualities)
+
+# SAM flags of alignments other than the primary one
+_NON_PRIMARY_FLAGS = 0x100 | 0x800
+
+# htslib's SAM_FLAG | SAM_SEQ: the fields iter_bam_lengths has CRAM decode.
+# htslib only sets a record's length when it decodes the sequence, so that
+# cannot be skipped too; names, qualities and tags are.
+_CRAM_LENGTH_FIELDS = 0x002 | 0x200
+
+def iter_bam_lengths(read_file, batch_size: int = DEFAULT_BATCH_SIZE, threads: int | None = None):
+    """
+    Yield int64 arrays of the read lengths of the primary alignments in a BAM/SAM/CRAM file.
+
+    Only the flag and query_length of each record are read, so no sequence,
+    quality or tag is turned into a Python object, and CRAM files are opened
+    with htslib's required_fields option so names, qualities and tags are not
+    decoded at all. Records without a sequence are skipped, as in
+    parse_read_batches; records with a sequence but no qualities are counted.
+    """
+    format_options = None
+    if read_file.endswith(".cram"):
+        format_options = [f"required_fields={_CRAM_LENGTH_FIELDS:#x}".encode()]
+    lengths = []
+    with pysam.AlignmentFile(read_file, "rb", check_sq=False, threads=resolve_threads(threads),
+                             format_options=format_options) as bam:
+        track_alignment_file(read_file, bam)
+        for read in bam.fetch(until_eof=True):
+            if read.flag & _NON_PRIMARY_FLAGS:
+                continue
+            length = read.query_length
+            if length:
+                lengths.append(length)
+                if len(lengths) == batch_size:
+                    yield np.array(lengths, dtype=np.int64)
+                    lengths = []
+    if lengths:
+        yield np.array(lengths, dtype=np.int64)
+
+def _bam_batch(read_ids, sequences, qualities):
+    """Build a ReadBatch from BAM records, keeping their raw Phred scores."""
+    return ReadBatch.from_records(read_ids, sequences, qualities, raw_quality=True)
+
+def _parse_fastq_batches(read_file, batch_size, threads=None, start=None, limit=None, max_bases=DEFAULT_BATCH_BASES):
+    """Yield ReadBatch objects from a plain or gzipped FASTQ file."""
+    pending = []
+    remaining = limit
+    with open_fastq(read_file, threads=threads, start=start or 0) as handle:
+        for lines in iter_fastq_lines(handle):
+            headers = lines[0::4]
+            # like parse_reads, stop at the first empty header line
+            stop = b"" in headers
+            if stop:
+                del lines[headers.index(b"") * 4:]
+            if remaining is not None:
+                if len(lines) >= remaining * 4:
+                    del lines[remaining * 4:]
+                    stop = True
+                remaining -= len(lines) // 4
+            if pending:
+                lines = pending + lines
+            sequences = lines[1::4]
+            lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+            start = 0
+            for end in _batch_ends(lengths, batch_size, max_bases):
+                yield _fastq_batch(lines[start * 4:end * 4])
+                start = end
+            pending = lines[start * 4:]
+            if stop:
+                break
+    if pending:
+        yield _fastq_batch(pending)
 
+def _parse_fastq_batches_mmap(read_file, batch_size, start=None, limit=None, max_bases=DEFAULT_BATCH_BASES):
+    """Yield ReadBatch objects gathered straight out of a memory-mapped FASTQ file."""
+    remaining = limit
+    for data, line_starts, line_ends in iter_fastq_views(read_file, start=start or 0):
+        if remaining is not None:
+            line_starts, line_ends = line_starts[:remaining], line_ends[:remaining]
+            remaining -= len(line_starts)
+        ends = _batch_ends(line_ends[:, 1] - line_starts[:, 1], batch_size, max_bases)
+        if (ends[-1] if ends else 0) < len(line_starts):
+            ends.append(len(line_starts))
+        start = 0
+        for end in ends:
+            yield ReadBatch.from_spans(data, line_starts[start:end], line_ends[start:end])
+            start = end
+        if remaining == 0:
+            return
+
+def _fastq_batch(lines):
+    """Build a ReadBatch from a list of FASTQ lines holding whole records."""
+    return ReadBatch.from_records([header[1:] for header in lines[0::4]], lines[1::4], lines[3::4])
 
 def split_read(read, at: list[int]):
-    """Split a read at a given positions."""
-    reads = []
+    """
+    Split a read at a given positions.
+
+    The input read is assumed valid, so the fragments are not re-validated. For
+    ``bytes``-backed reads the fragments are memoryviews into the parent. Tags
+    are copied to every fragment, with per-base tags cut to its coordinates.
+    """
+    read_id, raw_quality, tags = read.read_id, read.raw_quality, read.tags
+    sequence, quality = read.sequence, read.quality
 
     if len(at) == 0:
-        return [Read(f'{read.read_id}_0', read.sequence, read.quality)]
+        return [Read(f'{read_id}_0', sequence, quality, validate=False, raw_quality=raw_quality, tags=tags)]
 
-    count = 0
-    start = 0
+    if tags:
+        full_sequence = sequence.encode() if isinstance(sequence, str) else bytes(sequence)
+    if isinstance(sequence, bytes):
+        sequence = memoryview(sequence)
+    if isinstance(quality, bytes):
+        quality = memoryview(quality)
 
-    for pos in at:
-        reads.append(Read(f'{read.read_id}_{count}', read.sequence[start:pos], read.quality[start:pos]))
-        start = pos
-        count += 1
+    reads = []
+    bounds = [0, *at, len(sequence)]
 
-    reads.append(Read(f'{read.read_id}_{count}', read.sequence[start:], read.quality[start:]))
+    for count, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        fragment_tags = slice_tags(tags, full_sequence, start, end) if tags else tags
+        reads.append(Read(f'{read_id}_{count}', sequence[start:end], quality[start:end], validate=False,
+                          raw_quality=raw_quality, tags=fragment_tags))
 
     return reads
 
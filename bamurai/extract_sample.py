@@ -9,12 +9,14 @@ from bamurai.utils_samples import (
     get_read_barcode,
     concatenate_bam_files
 )
+from bamurai.utils import resolve_threads
 
 def extract_reads_from_bam(
     input_bam: str,
     donor_barcodes: Set[str],
     output_file: str | None = None,
-    temp_dir: str | None = None
+    temp_dir: str | None = None,
+    threads: int | None = None
 ) -> tuple[int, str]:
     """
     Extract reads from a BAM file for a specific donor's barcodes
@@ -24,6 +26,7 @@ def extract_reads_from_bam(
         donor_barcodes: Set of barcodes associated with the donor
         output_file: Path to output BAM file (if None, create a temp file)
         temp_dir: Directory for temporary files
+        threads: Number of htslib threads for reading and writing
 
     Returns:
         tuple containing:
@@ -36,10 +39,11 @@ def extract_reads_from_bam(
             temp_dir = os.path.dirname(input_bam)
         output_file = os.path.join(temp_dir, f"{os.path.basename(input_bam)}.temp")
 
+    threads = resolve_threads(threads)
     read_count = 0
-    with pysam.AlignmentFile(input_bam, "rb") as input_file:
+    with pysam.AlignmentFile(input_bam, "rb", threads=threads) as input_file:
         # Create output BAM file using the template of the input
-        with pysam.AlignmentFile(output_file, "wb", template=input_file) as output_file_handle:
+        with pysam.AlignmentFile(output_file, "wb", template=input_file, threads=threads) as output_file_handle:
             # Process each read
             for read in input_file:
                 # Extract barcode from read
@@ -64,7 +68,9 @@ def extract_sample(args):
             - output: Path to output BAM file
             - barcode_column: Optional column name for barcodes
             - donor_id_column: Optional column name for donor IDs
+            - threads: Optional number of htslib threads
     """
+    threads = getattr(args, 'threads', None)
     # Parse barcode-to-donor mapping
     barcode_column = getattr(args, 'barcode_column', None)
     donor_id_column = getattr(args, 'donor_id_column', None)
@@ -90,7 +96,8 @@ def extract_sample(args):
         read_count, _ = extract_reads_from_bam(
             bam_files[0],
             donor_barcodes,
-            output_file=args.output
+            output_file=args.output,
+            threads=threads
         )
         print(f"Extracted {read_count} reads for donor '{args.donor_id}' to {args.output}")
         return
@@ -107,13 +114,14 @@ def extract_sample(args):
             read_count, temp_file = extract_reads_from_bam(
                 bam_file,
                 donor_barcodes,
-                temp_dir=temp_dir
+                temp_dir=temp_dir,
+                threads=threads
             )
             temp_files.append(temp_file)
             total_read_count += read_count
             print(f"Extracted {read_count} reads from {bam_file}")
 
         # Concatenate all temp files into final output
-        concatenate_bam_files(temp_files, args.output)
+        concatenate_bam_files(temp_files, args.output, threads=threads)
 
     print(f"Total: Extracted {total_read_count} reads for donor '{args.donor_id}' to {args.output}")
@@ -0,0 +1,530 @@
+"""
+Block-buffered FASTQ reading and writing for Bamurai.
+
+FASTQ input is read in binary blocks, either split into lines in bulk for
+batches of reads or scanned for newlines and sliced into records one at a
+time. Only a record that straddles a block edge is carried over into the next
+block, and nothing is decoded to ``str`` unless the caller asks for it, in
+which case a block is decoded at once. As with the line-based parser, lines
+are stripped of surrounding whitespace.
+
+Uncompressed files can instead be memory-mapped, in which case records are
+returned as memoryviews into the mapping and never copied.
+
+Output goes through FastqWriter, which joins records into large binary writes
+and counts the bytes it serialises as it goes.
+"""
+
+import io
+import os
+import sys
+import gzip
+import mmap
+import itertools
+
+import numpy as np
+
+from bamurai.bgzf import BgzfReader, BgzfWriter, is_bgzf, DEFAULT_COMPRESSION_LEVEL
+from bamurai.utils import resolve_threads, track_read_position, untrack_read_position
+
+# Size of each binary read; large enough that per-block overhead is negligible
+# against the bulk split, small enough to keep a handful in memory at once.
+FASTQ_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Size of each binary read when records are sliced out one at a time; small
+# enough for the block to stay in cache while its records are copied out.
+FASTQ_RECORD_BLOCK_SIZE = 128 * 1024
+
+def open_fastq(read_file, mode: str = "rb", threads: int | None = None, start: int = 0):
+    """
+    Open a plain or gzipped FASTQ file for reading in binary ("rb") or text ("rt") mode.
+
+    BGZF-compressed files are inflated on a pool of ``threads`` threads when more
+    than one thread is available; other gzip files use the gzip module.
+    ``start`` opens the file part-way through, at a byte offset into an
+    uncompressed file or a BGZF virtual offset into a BGZF-compressed one;
+    other gzip files can only be read from the beginning.
+    """
+    if mode not in ("rb", "rt"):
+        raise ValueError(f"Unsupported mode '{mode}', expected 'rb' or 'rt'")
+
+    if not read_file.endswith(".gz"):
+        if mode == "rt":
+            handle = open(read_file, "r", encoding="utf-8")
+        else:
+            handle = open(read_file, "rb")
+        if start:
+            handle.seek(start)
+        raw = handle.buffer.raw if mode == "rt" else handle.raw
+        track_read_position(read_file, raw.tell)
+        return handle
+
+    threads = resolve_threads(threads)
+    if start and not is_bgzf(read_file):
+        raise ValueError(f"Cannot start part-way through a gzip file that is not BGZF-compressed: {read_file}")
+    if start or threads > 1 and is_bgzf(read_file):
+        reader = BgzfReader(read_file, threads, start)
+        track_read_position(read_file, reader.compressed_tell)
+        handle = io.BufferedReader(reader, buffer_size=FASTQ_BLOCK_SIZE)
+        if mode == "rt":
+            return io.TextIOWrapper(handle, encoding="utf-8")
+        return handle
+    handle = gzip.open(read_file, "rb")
+    # the position of the compressed file under the gzip stream
+    track_read_position(read_file, handle.fileobj.tell)
+    if mode == "rt":
+        return io.TextIOWrapper(handle, encoding="utf-8")
+    return handle
+
+def _start_of_last_lines(buffer, count: int) -> int:
+    """Offset in ``buffer`` where its last ``count`` lines start, the last one cut off by the end."""
+    pos = len(buffer)
+    for _ in range(count):
+        pos = buffer.rfind(b"\n", 0, pos)
+    return pos + 1
+
+def _has_padded_lines(buffer) -> bool:
+    """Whether a line of ``buffer`` may start or end with whitespace besides its newline."""
+    return (b"\r" in buffer or b"\t" in buffer or b" \n" in buffer or b"\n " in buffer
+            or b"\x0b" in buffer or b"\x0c" in buffer or buffer[:1].isspace())
+
+def iter_fastq_lines(handle, block_size: int = FASTQ_BLOCK_SIZE):
+    """
+    Yield lists of lines from a binary FASTQ handle.
+
+    Every list holds whole records only (its length is a multiple of four).
+    Lines are stripped of surrounding whitespace, line endings included, as
+    the line-based parser strips them. A truncated final record is padded
+    with empty lines so callers can always step through the list four lines
+    at a time.
+    """
+    leftover = b""
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            break
+        buffer = leftover + block if leftover else block
+        lines = buffer.split(b"\n")
+        # the last element is a partial line (empty if the block ended on a
+        # newline); carry it, and the rest of its record, over to the next block
+        complete = (len(lines) - 1) // 4 * 4
+        leftover = buffer[_start_of_last_lines(buffer, len(lines) - complete):]
+        if complete:
+            del lines[complete:]
+            if _has_padded_lines(buffer):
+                lines = [line.strip() for line in lines]
+            yield lines
+
+    if leftover:
+        lines = [line.strip() for line in leftover.split(b"\n")]
+        if not lines[-1]:
+            lines.pop()
+        remainder = len(lines) % 4
+        if remainder:
+            lines.extend([b""] * (4 - remainder))
+        yield lines
+
+def iter_fastq_records(read_file, block_size: int = FASTQ_RECORD_BLOCK_SIZE, threads: int | None = None,
+                       decode: bool = False):
+    """
+    Yield ``(read_id, sequence, quality)`` tuples from a FASTQ file.
+
+    Fields are ``bytes``, or ``str`` with ``decode=True``, in which case the
+    whole lines of each block are decoded at once rather than field by field.
+    Each block is scanned for newlines with index and its records sliced out
+    by offset. Only the record cut off by the end of the block is carried over
+    to the next one; a record longer than a block is completed with a read as
+    long as what is held of it. As with the line-based parser, fields are
+    stripped of surrounding whitespace, the leading '@' is removed from the
+    read ID and parsing stops at the first empty header line.
+    """
+    newline = "\n" if decode else b"\n"
+    leftover = b""
+    read_size = block_size
+    with open_fastq(read_file, threads=threads) as handle:
+        while True:
+            block = handle.read(read_size)
+            buffer = leftover + block if leftover else block
+            if not block:
+                if not buffer:
+                    return
+                # buffer starts at a record; close its last line and pad it to whole records
+                if not buffer.endswith(b"\n"):
+                    buffer += b"\n"
+                buffer += b"\n" * (-buffer.count(b"\n") % 4)
+
+            lines_end = buffer.rfind(b"\n") + 1
+            records = str(memoryview(buffer)[:lines_end], "utf-8") if decode else buffer
+            index = records.index
+            pos = 0
+            try:
+                while True:
+                    header_end = index(newline, pos)
+                    sequence_end = index(newline, header_end + 1)
+                    separator_end = index(newline, sequence_end + 1)
+                    quality_end = index(newline, separator_end + 1)
+                    header = records[pos:header_end].strip()
+                    if not header:
+                        return
+                    yield header[1:], records[header_end + 1:sequence_end].strip(), records[separator_end + 1:quality_end].strip()
+                    pos = quality_end + 1
+            except ValueError:
+                # the rest of the buffer is a record cut off by the end of the block
+                pass
+            if not block:
+                return
+            leftover = records[pos:].encode() + buffer[lines_end:] if decode else buffer[pos:]
+            read_size = block_size if pos else max(block_size, len(leftover))
+
+def map_fastq(read_file):
+    """Memory-map an uncompressed FASTQ file read-only, or return None if it is empty."""
+    with open(read_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def find_record_start(data, offset: int):
+    """
+    Return the offset of the first FASTQ record starting at or after ``offset``.
+
+    ``data`` is any bytes-like object holding a whole uncompressed FASTQ file,
+    such as a mapping from map_fastq. A line is taken as a header when it starts
+    with '@' and the line two below it starts with '+'; a quality line starting
+    with '@' fails this test because it is followed by a header and a sequence.
+    Returns ``len(data)`` if no record starts after ``offset``.
+    """
+    size = len(data)
+    if offset > 0 and data[offset - 1:offset] != b"\n":
+        newline = data.find(b"\n", offset)
+        offset = size if newline < 0 else newline + 1
+    while offset < size:
+        line_starts = [offset]
+        for _ in range(2):
+            newline = data.find(b"\n", line_starts[-1])
+            if newline < 0:
+                break
+            line_starts.append(newline + 1)
+        if data[offset:offset + 1] == b"@" and (
+            len(line_starts) < 3 or data[line_starts[2]:line_starts[2] + 1] == b"+"
+        ):
+            return offset
+        if len(line_starts) < 2:
+            break
+        offset = line_starts[1]
+    return size
+
+def _pad_final_record(newlines, size: int):
+    """Add line ends at ``size`` closing an unterminated last line and padding a truncated last record."""
+    if not len(newlines) or newlines[-1] != size - 1:
+        newlines = np.append(newlines, size)
+    if len(newlines) % 4:
+        newlines = np.append(newlines, [size] * (4 - len(newlines) % 4))
+    return newlines
+
+# the bytes bytes.strip() removes: ASCII whitespace, including the '\r' of CRLF
+_WHITESPACE = np.zeros(256, dtype=bool)
+_WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+
+def _strip_spans(data, line_starts, line_ends):
+    """Narrow line spans to exclude surrounding whitespace, as bytes.strip() would."""
+    while True:
+        trailing = line_ends > line_starts
+        trailing[trailing] = _WHITESPACE[data[line_ends[trailing] - 1]]
+        if not trailing.any():
+            break
+        line_ends = line_ends - trailing
+    while True:
+        leading = line_starts < line_ends
+        leading[leading] = _WHITESPACE[data[line_starts[leading]]]
+        if not leading.any():
+            break
+        line_starts = line_starts + leading
+    return line_starts, line_ends
+
+def _record_spans(data, pos: int, line_ends):
+    """
+    Turn the 4n line ends of whole records starting at ``pos`` into (n, 4) line spans.
+
+    As the line-based parser strips every line, the spans exclude surrounding
+    whitespace, line endings and the '\r' of CRLF included.
+    """
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = pos
+    line_starts[1:] = line_ends[:-1] + 1
+    line_starts = np.minimum(line_starts, line_ends)
+    line_starts, line_ends = _strip_spans(data, line_starts, line_ends)
+    return line_starts.reshape(-1, 4), line_ends.reshape(-1, 4)
+
+def _first_empty_header(line_starts, line_ends):
+    """Index of the first record with an empty header line, or None; parsing stops there."""
+    empty_headers = np.flatnonzero(line_starts[:, 0] == line_ends[:, 0])
+    return int(empty_headers[0]) if empty_headers.size else None
+
+def iter_fastq_spans(data, start: int = 0, end: int | None = None, block_size: int = FASTQ_BLOCK_SIZE):
+    """
+    Yield the line spans of the FASTQ records in an uncompressed buffer.
+
+    ``data`` is a uint8 NumPy array over the whole file (e.g. over a mapping from
+    map_fastq). Newlines are located in bulk one block at a time, and each item
+    is a pair of int64 ``(line_starts, line_ends)`` arrays of shape (n, 4): the
+    byte ranges of the header (including its '@'), sequence, separator and
+    quality lines of n records, line endings excluded. Only records whose header
+    starts in ``[start, end)`` are returned; ``start`` must be a record boundary
+    (see find_record_start), which lets parallel workers each take a byte range
+    of the same file.
+    """
+    size = len(data)
+    end = size if end is None else min(end, size)
+    pos = start
+    while pos < end:
+        block_end = min(pos + block_size, size)
+        newlines = np.flatnonzero(data[pos:block_end] == 10) + pos
+        at_eof = block_end == size
+        if at_eof:
+            newlines = _pad_final_record(newlines, size)
+        n_records = len(newlines) // 4
+        if n_records == 0:
+            # a single record larger than the block; widen the window
+            block_size *= 2
+            continue
+
+        line_starts, line_ends = _record_spans(data, pos, newlines[:n_records * 4])
+        keep = int(np.searchsorted(line_starts[:, 0], end))
+        # like the other parsers, stop at the first empty header line
+        empty_header = _first_empty_header(line_starts[:keep], line_ends[:keep])
+        done = keep < n_records or at_eof
+        if empty_header is not None:
+            keep = empty_header
+            done = True
+
+        if keep:
+            yield line_starts[:keep], line_ends[:keep]
+        if done:
+            break
+        pos = int(newlines[n_records * 4 - 1]) + 1
+
+def gather_spans(data, starts, ends):
+    """
+    Concatenate the byte ranges ``[starts[i], ends[i])`` of a uint8 array.
+
+    The ranges must be sorted and non-overlapping, as the lines of a FASTQ file
+    are. Returns the concatenated bytes and the int64 range lengths, selecting
+    every range at once with a boolean mask rather than one slice per range.
+    """
+    lengths = ends - starts
+    if not len(lengths):
+        return b"", lengths
+    # the block alternates wanted and unwanted runs: range, gap, range, ...
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends
+    wanted = np.zeros(len(bounds) - 1, dtype=bool)
+    wanted[0::2] = True
+    mask = np.repeat(wanted, np.diff(bounds))
+    return data[bounds[0]:bounds[-1]][mask].tobytes(), lengths
+
+def iter_fastq_views(read_file, start: int = 0, end: int | None = None, block_size: int = FASTQ_BLOCK_SIZE):
+    """
+    Yield ``(data, line_starts, line_ends)`` for the records of a memory-mapped FASTQ file.
+
+    ``data`` is a uint8 array over the mapping and the spans are as for
+    iter_fastq_spans. The mapping is closed once ``data`` and every view derived
+    from it have been released.
+    """
+    mapping = map_fastq(read_file)
+    if mapping is None:
+        return
+
+    data = np.frombuffer(mapping, dtype=np.uint8)
+    # end of the last block of records handed out
+    position = [start]
+
+    def tell():
+        return position[0]
+
+    track_read_position(read_file, tell)
+    try:
+        for line_starts, line_ends in iter_fastq_spans(data, start, end, block_size):
+            position[0] = int(line_ends[-1, 3])
+            yield data, line_starts, line_ends
+    finally:
+        untrack_read_position(read_file, tell)
+
+def iter_fastq_records_mmap(read_file, start: int = 0, end: int | None = None, decode: bool = False,
+                            block_size: int = FASTQ_BLOCK_SIZE):
+    """
+    Yield ``(read_id, sequence, quality)`` from a memory-mapped FASTQ file.
+
+    Fields are zero-copy memoryviews into the mapping, or ``str`` with
+    ``decode=True``; ASCII blocks are then decoded once and sliced, rather than
+    decoding every field separately.
+    """
+    for data, line_starts, line_ends in iter_fastq_views(read_file, start, end, block_size):
+        view = memoryview(data)
+        starts = line_starts.tolist()
+        ends = line_ends.tolist()
+        if decode:
+            base = starts[0][0]
+            text = str(view[base:ends[-1][3]], "utf-8")
+            if text.isascii():
+                for s, e in zip(starts, ends):
+                    yield text[s[0] + 1 - base:e[0] - base], text[s[1] - base:e[1] - base], text[s[3] - base:e[3] - base]
+            else:
+                # byte offsets do not index the decoded text; decode field by field
+                for s, e in zip(starts, ends):
+                    yield str(view[s[0] + 1:e[0]], "utf-8"), str(view[s[1]:e[1]], "utf-8"), str(view[s[3]:e[3]], "utf-8")
+            continue
+        for s, e in zip(starts, ends):
+            yield view[s[0] + 1:e[0]], view[s[1]:e[1]], view[s[3]:e[3]]
+
+def iter_fastq_lengths(read_file, block_size: int = FASTQ_BLOCK_SIZE, threads: int | None = None):
+    """
+    Yield int64 arrays of the sequence lengths of the records in a FASTQ file.
+
+    Lengths come from the positions of newlines alone, located in bulk one
+    block at a time, so sequences and qualities are never copied out of the
+    file's blocks. Uncompressed files are memory-mapped and scanned in place;
+    gzipped ones are read ``block_size`` bytes at a time. Records are not
+    validated: a record whose quality does not match its sequence still counts.
+    """
+    if not read_file.endswith(".gz"):
+        for _, line_starts, line_ends in iter_fastq_views(read_file, block_size=block_size):
+            yield line_ends[:, 1] - line_starts[:, 1]
+        return
+
+    with open_fastq(read_file, threads=threads) as handle:
+        chunks = iter(lambda: handle.read(block_size), b"")
+        for _, _, line_starts, line_ends in iter_fastq_stream_spans(chunks):
+            yield line_ends[:, 1] - line_starts[:, 1]
+
+def iter_fastq_stream_spans(chunks):
+    """
+    Yield the line spans of the FASTQ records in a stream of byte chunks.
+
+    The streaming counterpart of iter_fastq_spans, for input that cannot be
+    mapped: records may straddle chunks, and are held back until complete.
+    Each item is ``(base, data, line_starts, line_ends)``, where ``data`` is a
+    uint8 array over the bytes at stream offsets ``base`` onwards and the spans
+    are relative to ``data``. Stops at the first empty header line.
+    """
+    leftover = b""
+    base = 0
+    for block in itertools.chain(chunks, [b""]):
+        at_eof = not block
+        buffer = leftover + block if leftover else block
+        if not buffer:
+            return
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        newlines = np.flatnonzero(data == 10)
+        if at_eof:
+            newlines = _pad_final_record(newlines, len(data))
+        complete = len(newlines) // 4 * 4
+        # records cut off by the end of the chunk wait for the next one
+        consumed = int(newlines[complete - 1]) + 1 if complete else 0
+        leftover = buffer[consumed:]
+        if complete:
+            line_starts, line_ends = _record_spans(data, 0, newlines[:complete])
+            empty_header = _first_empty_header(line_starts, line_ends)
+            if empty_header is not None:
+                if empty_header:
+                    yield base, data, line_starts[:empty_header], line_ends[:empty_header]
+                return
+            yield base, data, line_starts, line_ends
+        base += consumed
+
+class FastqWriter:
+    """
+    Buffered binary FASTQ writer shared by the read-processing commands.
+
+    Records are serialised to bytes and collected until ``buffer_size`` bytes
+    are pending, then written with a single call. ``path`` of None or "-"
+    writes to standard output. Paths ending in .gz are BGZF-compressed at
+    ``compression_level`` on ``threads`` threads (see resolve_threads).
+    ``records_written`` and ``bytes_written`` count the records and the
+    uncompressed FASTQ bytes accepted so far, pending ones included.
+    """
+
+    def __init__(self, path=None, buffer_size: int = FASTQ_BLOCK_SIZE, threads: int | None = None,
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.records_written = 0
+        self.bytes_written = 0
+        self._pending = []
+        self._pending_size = 0
+        if path is None or path == "-":
+            # anything already printed must come out before our binary writes
+            sys.stdout.flush()
+            self._handle = sys.stdout.buffer
+            self._owns_handle = False
+        elif path.endswith(".gz"):
+            self._handle = BgzfWriter(path, resolve_threads(threads), compression_level)
+            self._owns_handle = True
+        else:
+            self._handle = open(path, "wb")
+            self._owns_handle = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _add(self, data: bytes, records: int):
+        self._pending.append(data)
+        self._pending_size += len(data)
+        self.records_written += records
+        self.bytes_written += len(data)
+        if self._pending_size >= self.buffer_size:
+            self._write_pending()
+
+    def write(self, read) -> int:
+        """Write one Read and return the number of FASTQ bytes it took."""
+        record = read.to_fastq_bytes()
+        self._add(record, 1)
+        return len(record)
+
+    def write_reads(self, reads) -> int:
+        """Write an iterable of Reads and return the number of FASTQ bytes they took."""
+        pending = self._pending
+        size = records = 0
+        for read in reads:
+            record = read.to_fastq_bytes()
+            pending.append(record)
+            size += len(record)
+            records += 1
+        self._pending_size += size
+        self.records_written += records
+        self.bytes_written += size
+        if self._pending_size >= self.buffer_size:
+            self._write_pending()
+        return size
+
+    def write_batch(self, batch) -> int:
+        """Write a ReadBatch and return its size in bytes."""
+        return self.write_fastq(batch.to_fastq(), len(batch))
+
+    def write_fastq(self, data: bytes, records: int) -> int:
+        """Write ``records`` records already serialised as FASTQ and return their size in bytes."""
+        self._add(data, records)
+        return len(data)
+
+    def _write_pending(self):
+        """Hand the pending records to the output; a BGZF writer keeps compressing them in the background."""
+        if self._pending:
+            self._handle.write(b"".join(self._pending))
+            self._pending.clear()
+            self._pending_size = 0
+
+    def flush(self):
+        """Write out every record accepted so far, waiting for any compression still running."""
+        self._write_pending()
+        self._handle.flush()
+
+    def close(self):
+        if self._handle is None:
+            return
+        self.flush()
+        if self._owns_handle:
+            self._handle.close()
+        self._handle = None
@@ -1,5 +1,5 @@
-import gzip
 from bamurai.utils import smart_open
+from bamurai.fastq import open_fastq
 import logging
 from itertools import zip_longest
 
@@ -25,10 +25,10 @@ def get_hto(args):
     logging.info(f"Barcode length: {barcode_len}, UMI length: {umi_len}, Hashtag length: {hashtag_len}, Hashtag left buffer: {hashtag_left_buffer}")
     logging.info(f"Output file: {output_file}")
 
-    r1_open = gzip.open if r1_file.endswith('.gz') else open
-    r2_open = gzip.open if r2_file.endswith('.gz') else open
+    threads = getattr(args, 'threads', None)
 
-    with r1_open(r1_file, 'rt') as f_r1, r2_open(r2_file, 'rt') as f_r2:
+    # BGZF inputs are inflated on a thread pool, other gzip files fall back to gzip
+    with open_fastq(r1_file, 'rt', threads=threads) as f_r1, open_fastq(r2_file, 'rt', threads=threads) as f_r2:
         with smart_open(output_file, 'wt', encoding='utf-8') as out_f:
             out_f.write("read_name\tcell_barcode\tumi\thto\tbc_qual\tumi_qual\thto_qual\n")
             read_count = 0
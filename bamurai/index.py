@@ -0,0 +1,285 @@
+"""
+Sidecar indexes of read files for Bamurai.
+
+``bamurai index`` writes ``<file>.bamurai.idx`` next to a read file: a small
+JSON document holding the file's record count, total bases and length
+histogram (a LengthStats), and a seek point every ``interval`` records. Seek
+points are byte offsets into uncompressed FASTQ files and BGZF virtual offsets
+into BAM and BGZF-compressed FASTQ files; plain gzip, SAM and CRAM files get
+none. Records are counted as stats counts them: primary alignments with a
+sequence, or FASTQ records up to the first empty header line.
+
+Other commands pick the index up when it is there: stats reads its histogram
+instead of the file, progress bars take its record count as their total,
+chunk --parts takes its record and base counts instead of counting them, and
+the workers of split and divide each parse their own range of the file. An
+index is only used while the file is unchanged, which is checked against the
+size, modification time and a checksum of the first bytes it recorded.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import functools
+from dataclasses import dataclass
+
+import numpy as np
+import pysam
+
+from bamurai.bgzf import BgzfReader, is_bgzf
+from bamurai.core import DEFAULT_BATCH_SIZE, _NON_PRIMARY_FLAGS, parse_read_batches, iter_bam_lengths
+from bamurai.fastq import FASTQ_BLOCK_SIZE, iter_fastq_views, iter_fastq_stream_spans, iter_fastq_lengths
+from bamurai.utils import (
+    LengthStats, is_fastq, resolve_threads, ordered_map, track_alignment_file, track_read_position,
+    DEFAULT_MAX_PENDING_BYTES,
+)
+
+INDEX_SUFFIX = ".bamurai.idx"
+INDEX_FORMAT_VERSION = 1
+
+# Records between seek points; one batch, so each worker range is one batch
+DEFAULT_INDEX_INTERVAL = DEFAULT_BATCH_SIZE
+
+# Bytes at the start of a file covered by the checksum in its index
+_CHECKSUM_SIZE = 64 * 1024
+
+logger = logging.getLogger("bamurai.index")
+
+def index_path(read_file) -> str:
+    """Return the path of the sidecar index of a read file."""
+    return read_file + INDEX_SUFFIX
+
+def file_signature(read_file) -> dict:
+    """Return the size, modification time and a checksum of the start of a file, as stored in its index."""
+    stat = os.stat(read_file)
+    with open(read_file, "rb") as f:
+        checksum = hashlib.sha256(f.read(_CHECKSUM_SIZE)).hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": checksum}
+
+@dataclass
+class ReadIndex:
+    """
+    Contents of the sidecar index of a read file.
+
+    ``seek_points[i]`` is the offset of record ``i * interval``, of the type
+    named by ``offset_type``: "byte", "bgzf" (a BGZF virtual offset) or None
+    when the file has no seek points.
+    """
+    source: dict
+    interval: int
+    offset_type: str | None
+    lengths: LengthStats
+    seek_points: list
+
+    @property
+    def records(self) -> int:
+        return self.lengths.count
+
+    @property
+    def bases(self) -> int:
+        return self.lengths.total
+
+    @property
+    def seekable(self) -> bool:
+        return self.offset_type is not None
+
+    def ranges(self):
+        """
+        Return ``(start, limit)`` for the records from each seek point to the next.
+
+        Each pair can be passed to parse_read_batches to parse that range alone.
+        """
+        return [(offset, min(self.interval, self.records - i * self.interval))
+                for i, offset in enumerate(self.seek_points)]
+
+    def to_dict(self) -> dict:
+        return {
+            "format": "bamurai-index",
+            "version": INDEX_FORMAT_VERSION,
+            "source": self.source,
+            "interval": self.interval,
+            "offset_type": self.offset_type,
+            "lengths": self.lengths.to_dict(),
+            "seek_points": self.seek_points,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReadIndex":
+        if data.get("format") != "bamurai-index" or data.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Not a version {INDEX_FORMAT_VERSION} Bamurai index")
+        return cls(data["source"], data["interval"], data["offset_type"],
+                   LengthStats.from_dict(data["lengths"]), data["seek_points"])
+
+def _scan_plain_fastq(read_file, interval):
+    """Yield the lengths and seek points (byte offsets) of the records of an uncompressed FASTQ file."""
+    records = 0
+    for _, line_starts, line_ends in iter_fastq_views(read_file):
+        # first record of this block at a multiple of interval
+        first = -records % interval
+        records += len(line_starts)
+        yield line_ends[:, 1] - line_starts[:, 1], line_starts[first::interval, 0].tolist()
+
+def _scan_bgzf_fastq(read_file, interval, threads):
+    """Yield the lengths and seek points (BGZF virtual offsets) of the records of a BGZF-compressed FASTQ file."""
+    # stream offset and virtual offset of the start of each block read, from
+    # the block holding the last record seen onwards
+    block_starts, block_offsets = [], []
+
+    def chunks(reader):
+        position, pending, size = 0, [], 0
+        for offset, data in reader.blocks():
+            block_starts.append(position)
+            block_offsets.append(offset)
+            position += len(data)
+            pending.append(data)
+            size += len(data)
+            if size >= FASTQ_BLOCK_SIZE:
+                yield b"".join(pending)
+                pending, size = [], 0
+        if pending:
+            yield b"".join(pending)
+
+    records = 0
+    with BgzfReader(read_file, resolve_threads(threads)) as reader:
+        track_read_position(read_file, reader.compressed_tell)
+        for base, _, line_starts, line_ends in iter_fastq_stream_spans(chunks(reader)):
+            first = -records % interval
+            records += len(line_starts)
+            record_starts = base + line_starts[first::interval, 0]
+            starts = np.asarray(block_starts)
+            blocks = np.searchsorted(starts, record_starts, side="right") - 1
+            seek_points = np.asarray(block_offsets)[blocks] + (record_starts - starts[blocks])
+            yield line_ends[:, 1] - line_starts[:, 1], seek_points.tolist()
+            # later records start in the block holding this batch's last one or after
+            done = int(np.searchsorted(starts, base + line_starts[-1, 0], side="right")) - 1
+            del block_starts[:done], block_offsets[:done]
+
+def _scan_bam(read_file, interval, threads, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield the lengths and seek points (BGZF virtual offsets) of the primary alignments of a BAM file."""
+    lengths, seek_points = [], []
+    records = 0
+    with pysam.AlignmentFile(read_file, "rb", check_sq=False, threads=resolve_threads(threads)) as bam:
+        track_alignment_file(read_file, bam)
+        # the offset of the next record is only taken while it could be a seek point
+        offset = bam.tell()
+        for read in bam:
+            if not read.flag & _NON_PRIMARY_FLAGS and read.query_length:
+                if records % interval == 0:
+                    seek_points.append(offset)
+                records += 1
+                lengths.append(read.query_length)
+                if len(lengths) == batch_size:
+                    yield np.array(lengths, dtype=np.int64), seek_points
+                    lengths, seek_points = [], []
+            if records % interval == 0:
+                offset = bam.tell()
+    if lengths:
+        yield np.array(lengths, dtype=np.int64), seek_points
+
+def build_index(read_file, interval: int = DEFAULT_INDEX_INTERVAL, threads: int | None = None) -> ReadIndex:
+    """Read a BAM/SAM/CRAM or FASTQ file and build its index, with a seek point every ``interval`` records."""
+    if interval < 1:
+        raise ValueError(f"Index interval must be at least 1, got {interval}")
+    source = file_signature(read_file)
+
+    if is_fastq(read_file):
+        if not read_file.endswith(".gz"):
+            offset_type, scan = "byte", _scan_plain_fastq(read_file, interval)
+        elif is_bgzf(read_file):
+            offset_type, scan = "bgzf", _scan_bgzf_fastq(read_file, interval, threads)
+        else:
+            offset_type, scan = None, ((lengths, []) for lengths in iter_fastq_lengths(read_file, threads=threads))
+    elif read_file.endswith(".bam"):
+        offset_type, scan = "bgzf", _scan_bam(read_file, interval, threads)
+    else:
+        offset_type, scan = None, ((lengths, []) for lengths in iter_bam_lengths(read_file, threads=threads))
+
+    lengths = LengthStats()
+    seek_points = []
+    for batch_lengths, batch_seek_points in scan:
+        lengths.add_lengths(batch_lengths)
+        seek_points.extend(batch_seek_points)
+    return ReadIndex(source, interval, offset_type, lengths, seek_points)
+
+def write_index(index: ReadIndex, read_file) -> str:
+    """Write an index next to its read file and return the index's path."""
+    path = index_path(read_file)
+    # written whole and renamed, so readers never see a partial index
+    partial = path + ".tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f, separators=(",", ":"))
+    os.replace(partial, path)
+    return path
+
+def load_index(read_file) -> ReadIndex | None:
+    """
+    Load the index of a read file, or return None if it has none.
+
+    An index that cannot be read, or that was built from a different version
+    of the file, is ignored with a warning.
+    """
+    path = index_path(read_file)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            index = ReadIndex.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring unreadable index %s: %s", path, e)
+        return None
+    if index.source != file_signature(read_file):
+        logger.warning("Ignoring index %s: %s has changed since it was indexed", path, read_file)
+        return None
+    return index
+
+def _batch_nbytes(batch) -> int:
+    return batch.nbytes
+
+def _map_range(read_range, func, read_file, threads=None):
+    """Apply func to each ReadBatch of one index range of a file, returning the results as a list."""
+    start, limit = read_range
+    return [func(batch) for batch in parse_read_batches(read_file, threads=threads, start=start, limit=limit)]
+
+def _range_nbytes(index, read_range) -> int:
+    """Estimate the bytes of sequence and quality in one index range of a file, from its mean read length."""
+    return int(2 * index.lengths.mean * read_range[1])
+
+def map_read_batches(func, read_file, workers: int = 1, threads: int | None = None,
+                     max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES):
+    """
+    Apply func to every ReadBatch of a file on ``workers`` processes, yielding the results in order.
+
+    When the file has an up-to-date index with seek points, each worker parses
+    its own ranges of the file; otherwise batches are parsed here and sent to
+    the workers (see ordered_map). Either way at most ``max_pending_bytes`` of
+    reads are handed out at once. A worker returns the results of a whole
+    range together, so files whose ranges are too large for every worker to
+    hold one within that bound are parsed here instead.
+    """
+    index = load_index(read_file) if workers > 1 else None
+    if index is not None and index.seekable and index.records:
+        range_bytes = _range_nbytes(index, (None, index.interval))
+        if range_bytes * workers > max_pending_bytes:
+            logger.debug("Not using index ranges of %s: about %d bytes each", read_file, range_bytes)
+            index = None
+    if index is None or not index.seekable:
+        batches = parse_read_batches(read_file, threads=threads)
+        yield from ordered_map(func, batches, workers, size=_batch_nbytes, max_pending_bytes=max_pending_bytes)
+        return
+    map_range = functools.partial(_map_range, func=func, read_file=read_file, threads=threads)
+    range_nbytes = functools.partial(_range_nbytes, index)
+    for results in ordered_map(map_range, index.ranges(), workers, size=range_nbytes,
+                               max_pending_bytes=max_pending_bytes):
+        yield from results
+
+def index_files(args):
+    from bamurai.stats import find_read_files
+
+    paths = args.reads if isinstance(args.reads, list) else [args.reads]
+    interval = getattr(args, "interval", DEFAULT_INDEX_INTERVAL)
+    for read_file in find_read_files(paths):
+        index = build_index(read_file, interval, threads=getattr(args, "threads", None))
+        path = write_index(index, read_file)
+        seek_points = f"{len(index.seek_points)} seek points" if index.seekable else "no seek points"
+        print(f"Indexed {read_file}: {index.records} reads, {index.bases} bases, {seek_points} -> {path}")
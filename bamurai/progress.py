@@ -0,0 +1,306 @@
+"""
+Progress reporting for Bamurai commands.
+
+Commands create a FileProgressBar for the file they read and report the
+reads they process with update(n), once per batch where they work in
+batches; per-read loops go through FileProgressBar.iterate, which reports
+every PROGRESS_BATCH_SIZE reads. The bar follows how far the file's reader
+has got through it on disk (see bamurai.utils.track_read_position) and only
+looks at the clock every so many reads, so an update between polls costs an
+addition and a comparison.
+
+configure_progress, called by the command line from its global options,
+turns the terminal bar off or sends progress records as JSON lines to a file
+or an inherited file descriptor, for workflow managers to read. SIGUSR1
+writes a snapshot record of every open bar to that stream, or to standard
+error when there is none.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+from dataclasses import dataclass
+from typing import IO, Optional
+
+from tqdm import tqdm
+
+from bamurai.utils import read_position
+
+# Environment variable that turns the terminal progress bar off when set to
+# anything but 0, so batch jobs can set it once rather than on every command.
+NO_PROGRESS_ENV_VAR = "BAMURAI_NO_PROGRESS"
+
+# Seconds between the JSON progress records of a bar
+DEFAULT_JSON_INTERVAL = 10.0
+
+# Reads handed out by FileProgressBar.iterate between updates
+PROGRESS_BATCH_SIZE = 1024
+
+# Most reads between two looks at the clock; the stride between looks grows
+# up to this while reads arrive faster than the bar is polled
+_MAX_CHECK_STRIDE = 4096
+
+@dataclass
+class ProgressSettings:
+    enabled: bool = True
+    json_stream: Optional[IO] = None
+    json_interval: float = DEFAULT_JSON_INTERVAL
+    # whether json_stream was opened here and should be closed when replaced
+    owns_stream: bool = False
+
+_settings = ProgressSettings()
+
+# bars created and not yet closed, for SIGUSR1 snapshots
+_open_bars = []
+# the handler SIGUSR1 had before the first bar was opened, and the process
+# that installed ours, as worker processes inherit it on fork
+_previous_handler = None
+_handler_pid = None
+# set while a record is being written, so a snapshot cannot interleave with it
+_writing = False
+
+def no_progress_from_env() -> bool:
+    """Return whether NO_PROGRESS_ENV_VAR asks for the progress bar to be off."""
+    return os.environ.get(NO_PROGRESS_ENV_VAR, "0") not in ("", "0")
+
+def open_json_target(target) -> IO:
+    """
+    Open the destination of --progress-json for writing.
+
+    A number is taken as a file descriptor inherited from the parent process,
+    which is left open when the stream is closed; anything else is a path.
+    """
+    target = str(target)
+    if target.isdigit():
+        return os.fdopen(int(target), "w", buffering=1, closefd=False)
+    return open(target, "w", buffering=1, encoding="utf-8")
+
+def configure_progress(enabled: Optional[bool] = None, json_target=None,
+                       json_interval: float = DEFAULT_JSON_INTERVAL):
+    """
+    Set how progress is reported by the bars created from now on.
+
+    ``enabled`` turns the terminal bar on or off, defaulting to off when
+    NO_PROGRESS_ENV_VAR is set. ``json_target`` is a path or file descriptor
+    (see open_json_target) to write a JSON progress record to every
+    ``json_interval`` seconds and when each bar closes, or None for no records.
+    """
+    if json_interval <= 0:
+        raise ValueError(f"Progress interval must be positive, got {json_interval}")
+    if _settings.owns_stream:
+        _settings.json_stream.close()
+    _settings.enabled = not no_progress_from_env() if enabled is None else enabled
+    _settings.json_stream = None if json_target is None else open_json_target(json_target)
+    _settings.owns_stream = json_target is not None
+    _settings.json_interval = json_interval
+
+def progress_enabled() -> bool:
+    """Return whether terminal progress bars are shown."""
+    return _settings.enabled
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of this process in bytes, or its peak where the current size is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _write_record(record: dict, stream: Optional[IO] = None):
+    """Write a progress record as one JSON line to ``stream``, by default the configured JSON stream."""
+    global _writing
+    stream = stream or _settings.json_stream
+    if stream is None:
+        return
+    _writing = True
+    try:
+        stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+        stream.flush()
+    finally:
+        _writing = False
+
+def _snapshot(signum, frame):
+    """SIGUSR1 handler writing a snapshot record of every open bar."""
+    if os.getpid() != _handler_pid or _writing:
+        return
+    for bar in list(_open_bars):
+        record = bar.record("snapshot")
+        if _settings.json_stream is not None:
+            _write_record(record)
+        else:
+            tqdm.write(json.dumps(record, separators=(",", ":")), file=sys.stderr)
+
+def _open_bar(bar):
+    global _previous_handler, _handler_pid
+    if not _open_bars and hasattr(signal, "SIGUSR1"):
+        try:
+            _previous_handler = signal.signal(signal.SIGUSR1, _snapshot)
+            _handler_pid = os.getpid()
+        except ValueError:
+            # signal handlers can only be set from the main thread
+            _handler_pid = None
+    _open_bars.append(bar)
+
+def _close_bar(bar):
+    if bar not in _open_bars:
+        return
+    _open_bars.remove(bar)
+    if not _open_bars and _handler_pid == os.getpid():
+        signal.signal(signal.SIGUSR1, _previous_handler)
+
+class FileProgressBar:
+    """
+    Progress of a command reading through a file.
+
+    Commands report the reads they process with update(n). The bar shows how
+    far the file's reader has got through the file on disk (see
+    bamurai.utils.track_read_position), polled at most every ``mininterval``
+    seconds, so its total is the file size for plain and compressed files
+    alike and no second pass is needed to count reads. Files with an
+    up-to-date bamurai index instead count reads against the read count in
+    the index. Commands that copy the file without counting its reads pass
+    ``count_reads=False`` and call poll() as they go instead of update(n).
+    """
+
+    def __init__(self, filepath, desc="Processing", mininterval=0.2, count_reads=True):
+        from bamurai.index import load_index
+
+        self.filepath = filepath
+        self.desc = desc
+        self.count_reads = count_reads
+        self.reads = 0
+        self.position = 0
+        self.mininterval = mininterval
+        index = load_index(filepath) if count_reads else None
+        self.by_bytes = index is None
+        self.total_bytes = os.path.getsize(filepath)
+        self.total_records = None if index is None else index.records
+        if self.by_bytes:
+            self.bar = tqdm(total=self.total_bytes, desc=desc, unit="B", unit_scale=True,
+                            mininterval=mininterval, disable=not _settings.enabled)
+        else:
+            self.bar = tqdm(total=self.total_records, desc=desc, unit="reads", mininterval=mininterval,
+                            disable=not _settings.enabled)
+
+        self.start_time = time.monotonic()
+        self._json_stream = _settings.json_stream
+        self._json_interval = _settings.json_interval
+        self._next_poll = self.start_time
+        self._next_record = self.start_time + self._json_interval
+        # reads at which the clock is next looked at, and the reads between looks
+        self._stride = 1
+        self._check_at = 1 if _settings.enabled or self._json_stream is not None else float("inf")
+        _open_bar(self)
+
+    def update(self, n=1):
+        """Record that ``n`` more reads have been processed."""
+        self.reads += n
+        if self.reads >= self._check_at:
+            self._check()
+
+    def poll(self):
+        """Bring the bar up to date with the file's reader, at most every ``mininterval`` seconds."""
+        if self._check_at != float("inf"):
+            self._check()
+
+    def iterate(self, items, batch_size=PROGRESS_BATCH_SIZE):
+        """
+        Yield ``items``, each counting as a read processed, reporting them ``batch_size`` at a time.
+
+        Each item is handed on as soon as it is read; items taken since the last
+        report are reported when the loop ends, however it ends.
+        """
+        taken = 0
+        try:
+            for item in items:
+                taken += 1
+                yield item
+                if taken == batch_size:
+                    self.update(taken)
+                    taken = 0
+        finally:
+            if taken:
+                self.update(taken)
+
+    def _check(self):
+        now = time.monotonic()
+        if now < self._next_poll:
+            # reads are arriving faster than the bar is polled; look less often
+            self._stride = min(self._stride * 2, _MAX_CHECK_STRIDE)
+        else:
+            if now > self._next_poll + self.mininterval:
+                self._stride = max(self._stride // 2, 1)
+            self._next_poll = now + self.mininterval
+            self._poll(now)
+        self._check_at = self.reads + self._stride
+
+    def _poll(self, now, position=None):
+        if position is None:
+            position = read_position(self.filepath)
+        if position is not None:
+            self.position = min(position, self.total_bytes)
+        if self.by_bytes:
+            self.bar.update(self.position - self.bar.n)
+            if self.count_reads:
+                self.bar.set_postfix_str(f"{self.reads} reads", refresh=False)
+        else:
+            self.bar.update(self.reads - self.bar.n)
+        if self._json_stream is not None and now >= self._next_record:
+            self._next_record = now + self._json_interval
+            _write_record(self.record("progress"), self._json_stream)
+
+    def record(self, event="progress") -> dict:
+        """Return the bar's state as a JSON-serialisable progress record."""
+        elapsed = time.monotonic() - self.start_time
+        records_per_sec = self.reads / elapsed if elapsed > 0 and self.count_reads else None
+        bytes_per_sec = self.position / elapsed if elapsed > 0 else None
+        # remaining time at the average rate so far
+        eta = None
+        if self.by_bytes and bytes_per_sec:
+            eta = (self.total_bytes - self.position) / bytes_per_sec
+        elif not self.by_bytes and records_per_sec:
+            eta = max(self.total_records - self.reads, 0) / records_per_sec
+        return {
+            "event": event,
+            "time": round(time.time(), 3),
+            "pid": os.getpid(),
+            "desc": self.desc,
+            "file": self.filepath,
+            "records": self.reads if self.count_reads else None,
+            "total_records": self.total_records,
+            "bytes": self.position,
+            "total_bytes": self.total_bytes,
+            "elapsed": round(elapsed, 3),
+            "records_per_sec": None if records_per_sec is None else round(records_per_sec, 1),
+            "bytes_per_sec": None if bytes_per_sec is None else round(bytes_per_sec, 1),
+            "eta": None if eta is None else round(eta, 1),
+            "rss": current_rss(),
+        }
+
+    def clear(self):
+        self.bar.clear()
+
+    def close(self):
+        if self not in _open_bars:
+            return
+        # a reader that has been closed has finished with the file
+        position = read_position(self.filepath)
+        finished = self.reads or not self.count_reads
+        self._poll(time.monotonic(), self.total_bytes if position is None and finished else position)
+        if self._json_stream is not None:
+            _write_record(self.record("end"), self._json_stream)
+        self.bar.close()
+        _close_bar(self)
+
+def create_progress_bar_for_file(filepath, desc="Processing", mininterval=0.2, count_reads=True):
+    """Create a FileProgressBar following the reading of a file."""
+    return FileProgressBar(filepath, desc, mininterval, count_reads)
@@ -1,8 +1,14 @@
 import sys
 import time
 import logging
+import functools
+import numpy as np
 from bamurai.core import *
-from bamurai.utils import print_elapsed_time_pretty, smart_open, create_progress_bar_for_file, count_reads_async_generic
+from bamurai.bgzf import DEFAULT_COMPRESSION_LEVEL
+from bamurai.ubam import open_read_writer, is_bam_output
+from bamurai.utils import print_elapsed_time_pretty, LengthStats
+from bamurai.progress import create_progress_bar_for_file
+from bamurai.index import map_read_batches
 from bamurai.logging_config import configure_logging
 
 def calculate_split_len(read, target_len: int):
@@ -16,6 +22,32 @@ def calculate_split_len(read, target_len: int):
 
     return [i * split_size for i in range(1, split_loc)]
 
+def calculate_split_len_batch(lengths, target_len: int):
+    """
+    Calculate the fragments of many reads at once given a target length.
+
+    Vectorised calculate_split_len over an array of read lengths. Returns flat
+    int64 ``(starts, ends)`` arrays of every fragment, relative to the start
+    of its read, and the number of fragments of each read.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    # np.round rounds halves to even, as round() does in calculate_split_len
+    counts = np.where(lengths < target_len, 1, np.round(lengths / target_len)).astype(np.int64)
+    starts, ends = fragment_bounds(lengths, counts, lengths // counts)
+    return starts, ends, counts
+
+def _split_batch(batch, target_len: int):
+    """
+    Split a ReadBatch to a target length and serialise the fragments as FASTQ.
+
+    Runs in the worker processes of split_reads. Returns the FASTQ bytes and
+    the batch's input and unsplit read counts and fragment lengths.
+    """
+    starts, ends, counts = calculate_split_len_batch(batch.lengths, target_len)
+    fragments = batch.fragments(starts, ends, counts)
+    unsplit = int(np.count_nonzero(counts == 1))
+    return fragments.to_fastq(), len(batch), unsplit, fragments.lengths
+
 def split_reads(args):
     configure_logging()
     logger = logging.getLogger("bamurai.split")
@@ -23,62 +55,70 @@ def split_reads(args):
     start_time = time.time()
 
     total_input_reads = 0
-    total_output_reads = 0
     total_unsplit_reads = 0
     # pretty print the arguments in arg: value format
     arg_desc_dict = {
         "reads": "Input file",
         "len_target": "Target length",
-        "output": "Output file"
+        "output": "Output file",
+        "workers": "Worker processes"
     }
     logger.info("Arguments:")
     for arg, value in vars(args).items():
         if arg in arg_desc_dict:
             logger.info("  %s: %s", arg_desc_dict[arg], value)
 
-    # Read the input reads file
-    read_lens = []
+    # lengths of the output reads, summarised in constant memory
+    output_lengths = LengthStats()
 
-    # clear the output file
-    if args.output:
-        f = smart_open(args.output, "wt", encoding="utf-8")
-    else:
-        f = None
+    # write to the output file (FASTQ, or unaligned BAM if it ends in .bam),
+    # or standard output if none is given
+    writer = open_read_writer(
+        args.output,
+        args.reads,
+        threads=getattr(args, 'threads', None),
+        compression_level=getattr(args, 'compression_level', DEFAULT_COMPRESSION_LEVEL),
+    )
 
     # Create progress bar
     pbar = create_progress_bar_for_file(args.reads, "Splitting reads")
-    count_thread = count_reads_async_generic(args.reads, pbar)
 
-    for read in parse_reads(args.reads):
-        total_input_reads += 1
-        pbar.update(1)
-        
-        split_locs = calculate_split_len(read, target_len = args.len_target)
-        split = split_read(read, at = split_locs)
+    threads = getattr(args, 'threads', None)
+    workers = getattr(args, 'workers', 1)
+    if is_bam_output(args.output):
+        if workers > 1:
+            logger.warning("--workers is not supported for unaligned BAM output; using one process")
+        # tags are sliced per fragment, so uBAM output goes read by read
+        for read in pbar.iterate(parse_reads(args.reads, decode=False, threads=threads, tags=True)):
+            total_input_reads += 1
 
-        if len(split) == 1:
-            total_unsplit_reads += 1
+            split_locs = calculate_split_len(read, target_len = args.len_target)
+            split = split_read(read, at = split_locs)
 
-        for read in split:
-            total_output_reads += 1
-            read_lens.append(len(read))
+            if len(split) == 1:
+                total_unsplit_reads += 1
+            for fragment in split:
+                output_lengths.add(len(fragment))
 
-            if args.output:
-                assert f is not None
-                f.write(read.to_fastq())
-                f.write("\n")
-            else:
-                print(read.to_fastq())
+            writer.write_reads(split)
+    else:
+        # batches are split and serialised on the workers and written back in input
+        # order; with an index, the workers read their own ranges of the input
+        split_batch = functools.partial(_split_batch, target_len=args.len_target)
+        batches = map_read_batches(split_batch, args.reads, workers, threads=threads)
+        for data, input_reads, unsplit_reads, fragment_lengths in batches:
+            total_input_reads += input_reads
+            pbar.update(input_reads)
+            total_unsplit_reads += unsplit_reads
+            output_lengths.add_lengths(fragment_lengths)
+            writer.write_fastq(data, len(fragment_lengths))
 
     pbar.close()
+    writer.close()
 
-    if args.output:
-        assert f is not None
-        f.close()
-
-    avg_read_len = round(sum(read_lens) / len(read_lens)) if read_lens else 0
+    avg_read_len = round(output_lengths.mean)
     logger.info("Total input reads: %d", total_input_reads)
-    logger.info("Total output reads: %d", total_output_reads)
+    logger.info("Total output reads: %d", output_lengths.count)
     logger.info("Total unsplit reads: %d", total_unsplit_reads)
     logger.info("Average split read length: %d", avg_read_len)
     logger.info("Time taken: %.2f seconds", time.time() - start_time)
@@ -10,12 +10,15 @@ from bamurai.utils_samples import (
     get_read_barcode,
     concatenate_bam_files
 )
-from bamurai.utils import is_fastq, smart_open
+from bamurai.utils import is_fastq, smart_open, resolve_threads
+from bamurai.fastq import open_fastq
+from bamurai.bgzf import BgzfWriter, DEFAULT_COMPRESSION_LEVEL
 
 def split_bam_by_donor(
     input_bam: str,
     barcode_donor_map: Dict[str, str],
-    temp_dir: str
+    temp_dir: str,
+    threads: int | None = None
 ) -> Tuple[Set[str], Dict[str, str]]:
     """
     Split a BAM file by donor ID and write to temporary files
@@ -24,6 +27,7 @@ def split_bam_by_donor(
         input_bam: Path to input BAM file
         barcode_donor_map: Dictionary mapping barcodes to donor IDs
         temp_dir: Directory to write temporary BAM files
+        threads: Number of htslib threads for reading the input
 
     Returns:
         Tuple containing:
@@ -40,8 +44,9 @@ def split_bam_by_donor(
     # Dictionary to store temp file paths for each donor
     temp_files = {}
 
-    # Open input BAM file
-    with pysam.AlignmentFile(input_bam, "rb") as input_file:
+    # Open input BAM file. Only the reader is threaded: one thread pool per
+    # donor output would multiply the thread count by the number of donors.
+    with pysam.AlignmentFile(input_bam, "rb", threads=resolve_threads(threads)) as input_file:
         # Create a dictionary to store output files, keyed by donor ID
         output_files = {}
 
@@ -81,7 +86,8 @@ def split_bam_by_donor(
 def split_fastq_by_donor(
     input_fastq: str,
     barcode_donor_map: Dict[str, str],
-    temp_dir: str
+    temp_dir: str,
+    threads: int | None = None
 ) -> Tuple[Set[str], Dict[str, str]]:
     """
     Split a FASTQ file by donor ID and write to temporary files.
@@ -90,13 +96,13 @@ def split_fastq_by_donor(
         input_fastq: Path to input FASTQ file
         barcode_donor_map: Dictionary mapping barcodes to donor IDs
         temp_dir: Directory to write temporary FASTQ files
+        threads: Number of threads for decompressing BGZF input
 
     Returns:
         Tuple containing:
         - Set of unique donor IDs
         - Dictionary mapping donor IDs to temporary file paths
     """
-    import gzip
     # Create a unique identifier for this FASTQ file's outputs
     fastq_uuid = str(uuid.uuid4())[:8]
     fastq_basename = os.path.basename(input_fastq).split('.')[0]
@@ -119,9 +125,8 @@ def split_fastq_by_donor(
     temp_files["unmapped"] = unmapped_temp_path
     output_files["unmapped"] = smart_open(unmapped_temp_path, "wt", encoding="utf-8")
 
-    # Open input FASTQ file (support gzipped files)
-    open_func = gzip.open if input_fastq.endswith('.gz') else open
-    with open_func(input_fastq, 'rt') as infile:
+    # Open input FASTQ file (support gzipped and BGZF files)
+    with open_fastq(input_fastq, 'rt', threads=threads) as infile:
         while True:
             # Read 4 lines for each FASTQ record
             lines = [infile.readline() for _ in range(4)]
@@ -154,6 +159,9 @@ def split_samples(args):
     barcode_column = getattr(args, 'barcode_column', None)
     donor_id_column = getattr(args, 'donor_id_column', None)
     barcode_donor_map = parse_barcode_donor_mapping(args.tsv, barcode_column, donor_id_column)
+    threads = getattr(args, 'threads', None)
+    compress = getattr(args, 'compress', False)
+    compression_level = getattr(args, 'compression_level', DEFAULT_COMPRESSION_LEVEL)
 
     # Handle whether we received a list of files or just one
     input_files = args.input if isinstance(args.input, list) else [args.input]
@@ -177,14 +185,16 @@ def split_samples(args):
                 donors, temp_files = split_bam_by_donor(
                     input_file,
                     barcode_donor_map,
-                    temp_dir
+                    temp_dir,
+                    threads=threads
                 )
             elif is_fastq(input_file):
                 filetype = 'fastq'
                 donors, temp_files = split_fastq_by_donor(
                     input_file,
                     barcode_donor_map,
-                    temp_dir
+                    temp_dir,
+                    threads=threads
                 )
             else:
                 print(f"Unsupported file type: {input_file}")
@@ -203,13 +213,18 @@ def split_samples(args):
                     shutil.copy2(temp_files_for_donor[0], final_output_path)
                     print(f"Copied {donor_id} file to {final_output_path}")
                 elif len(temp_files_for_donor) > 1:
-                    concatenate_bam_files(temp_files_for_donor, final_output_path)
+                    concatenate_bam_files(temp_files_for_donor, final_output_path, threads=threads)
             elif filetype == 'fastq':
-                final_output_path = os.path.join(args.output_dir, f"{donor_id}.fastq")
-                with smart_open(final_output_path, 'wt', encoding='utf-8') as outfile:
+                if compress:
+                    final_output_path = os.path.join(args.output_dir, f"{donor_id}.fastq.gz")
+                    outfile = BgzfWriter(final_output_path, resolve_threads(threads), compression_level)
+                else:
+                    final_output_path = os.path.join(args.output_dir, f"{donor_id}.fastq")
+                    outfile = open(final_output_path, 'wb')
+                with outfile:
                     for temp_file in temp_files_for_donor:
-                        with smart_open(temp_file, 'rt', encoding='utf-8') as infile:
-                            shutil.copyfileobj(infile, outfile)
+                        with open(temp_file, 'rb') as infile:
+                            shutil.copyfileobj(infile, outfile, 4 * 1024 * 1024)
                 print(f"Wrote {donor_id} FASTQ to {final_output_path}")
 
         print("All processing complete. Temporary files will be deleted.")
@@ -1,65 +1,446 @@
-from bamurai.utils import is_fastq, create_progress_bar_for_file, count_reads_async_generic
-from bamurai.core import parse_reads
+import os
+import glob
+import gzip
+import json
+import functools
+
+import numpy as np
+from tqdm import tqdm
+
+from bamurai.utils import is_fastq, is_read_file, LengthStats, ordered_map
+from bamurai.progress import create_progress_bar_for_file, progress_enabled
+from bamurai.core import iter_bam_lengths, parse_read_batches, PHRED_OFFSET
+from bamurai.fastq import iter_fastq_lengths
+from bamurai.index import load_index, INDEX_SUFFIX
+
+# Nx statistics reported by stats, in percent of total bases
+NX_PERCENTAGES = (10, 20, 30, 40, 50, 60, 70, 80, 90)
+
+# Columns of the --tsv output after file_name, in order. The first four are
+# the original columns; new ones go at the end.
+TSV_COLUMNS = (
+    "total_reads", "avg_read_len", "throughput", "n50",
+    "min_read_len", "q25_read_len", "median_read_len", "q75_read_len", "max_read_len",
+    *(f"n{x}" for x in NX_PERCENTAGES if x != 50),
+)
+
+# file_name of the row summarising every input when stats is given several
+AGGREGATE_NAME = "all"
+
+# Columns added to the --tsv output by --extended, after TSV_COLUMNS
+EXTENDED_TSV_COLUMNS = ("mean_qual", "mean_read_qual", "gc_content")
+
+# Bins of the length-by-quality histogram of --extended: one per whole Q of
+# a read's mean quality up to QC_QUAL_BIN_LIMIT, which takes anything higher,
+# and QC_LENGTH_BINS_PER_DECADE log-spaced length bins up to
+# QC_LENGTH_BIN_LIMIT, the last taking anything longer.
+QC_QUAL_BIN_LIMIT = 50
+QC_LENGTH_BINS_PER_DECADE = 10
+QC_LENGTH_BIN_LIMIT = 10**8
+QC_LENGTH_EDGES = np.unique(np.ceil(
+    10.0 ** (np.arange(int(np.log10(QC_LENGTH_BIN_LIMIT)) * QC_LENGTH_BINS_PER_DECADE + 1) / QC_LENGTH_BINS_PER_DECADE)
+).astype(np.int64))
+
+# Error probability of each Phred score, and of each FASTQ quality character
+_ERROR_PROB = 10.0 ** (-np.arange(256) / 10)
+_FASTQ_ERROR_PROB = _ERROR_PROB[np.maximum(np.arange(256) - PHRED_OFFSET, 0)]
+
+# Bases per slice of a batch whose error probabilities are held at once
+_QC_SLICE_BASES = 1 << 22
+
+SUMMARY_FORMAT = "bamurai-stats-summary"
+SUMMARY_FORMAT_VERSION = 1
 
 def calc_n50(read_lengths):
-    """Calculate the N50 statistic for a list of read lengths."""
-    if not read_lengths:
+    """Calculate the N50 statistic for a list or array of read lengths."""
+    if len(read_lengths) == 0:
+        return None
+    read_lengths = np.sort(np.asarray(read_lengths, dtype=np.int64))[::-1]
+    bp_sum = np.cumsum(read_lengths)
+    half_bp = bp_sum[-1] / 2
+    # first read at which the cumulative sum reaches half the total
+    return int(read_lengths[np.searchsorted(bp_sum, half_bp)])
+
+def _bin_length(length_stats, i):
+    """Length standing for histogram bin i: exact below the exact limit, the mean length of the bin above it."""
+    if i < length_stats.exact_limit:
+        return int(i)
+    return round(int(length_stats.bases[i]) / int(length_stats.counts[i]))
+
+def calc_nx(length_stats, x):
+    """
+    Calculate the Nx statistic from a LengthStats histogram.
+
+    Nx is the length L such that reads at least L long hold x% of all bases.
+    The result is exact when L is below the histogram's exact limit, and
+    otherwise the mean length of the log-spaced bin it falls in.
+    """
+    if length_stats.count == 0:
+        return None
+    # walk the occupied bins from the longest reads down
+    bins = np.flatnonzero(length_stats.counts)[::-1]
+    bp_sum = np.cumsum(length_stats.bases[bins])
+    return _bin_length(length_stats, bins[np.searchsorted(bp_sum, length_stats.total * x / 100)])
+
+def calc_quantile(length_stats, q):
+    """
+    Calculate the q-th quantile (0 to 1) of the read lengths in a LengthStats histogram.
+
+    Interpolates between the lengths either side of the quantile as
+    numpy.quantile does, so the result is exact below the exact limit.
+    """
+    if length_stats.count == 0:
         return None
-    read_lengths = sorted(read_lengths, reverse=True)
-    total_bp = sum(read_lengths)
-    half_bp = total_bp / 2
-    bp_sum = 0
-    for read_len in read_lengths:
-        bp_sum += read_len
-        if bp_sum >= half_bp:
-            return read_len
-
-def file_read_stats(read_file):
-    """Calculate statistics for a BAM or FASTQ file using parse_reads."""
-    read_lengths = []
-    total_reads = 0
-    
-    # Create progress bar
-    pbar = create_progress_bar_for_file(read_file, "Calculating statistics")
-    count_thread = count_reads_async_generic(read_file, pbar)
-    
-    for read in parse_reads(read_file):
-        read_lengths.append(len(read))
-        total_reads += 1
-        pbar.update(1)
-
-    pbar.close()
-
-    if not read_lengths:
-        return {
-            "total_reads": 0,
-            "avg_read_len": 0,
-            "throughput": 0,
-            "n50": 0
-        }
-
-    throughput = sum(read_lengths)
-    avg_read_len = round(throughput / len(read_lengths))
-    n50 = calc_n50(read_lengths)
+    cumulative = np.cumsum(length_stats.counts)
+    position = q * (length_stats.count - 1)
+    lower, upper = int(np.floor(position)), int(np.ceil(position))
+    # length of the read at each rank, counting from the shortest
+    lower_len, upper_len = (
+        _bin_length(length_stats, np.searchsorted(cumulative, rank, side="right"))
+        for rank in (lower, upper)
+    )
+    return lower_len + (upper_len - lower_len) * (position - lower)
+
+def summarise_lengths(length_stats):
+    """Build the statistics reported by stats from a LengthStats summary of read lengths."""
+    if length_stats.count == 0:
+        return {column: 0 for column in TSV_COLUMNS}
+
+    stats = {
+        "total_reads": length_stats.count,
+        "avg_read_len": round(length_stats.mean),
+        "throughput": length_stats.total,
+        "min_read_len": length_stats.min,
+        "q25_read_len": round(calc_quantile(length_stats, 0.25)),
+        "median_read_len": round(calc_quantile(length_stats, 0.5)),
+        "q75_read_len": round(calc_quantile(length_stats, 0.75)),
+        "max_read_len": length_stats.max,
+    }
+    for x in NX_PERCENTAGES:
+        stats[f"n{x}"] = calc_nx(length_stats, x)
+    return stats
+
+def error_prob_to_qual(error_prob):
+    """Convert a mean error probability to a Phred quality score."""
+    return -10 * np.log10(error_prob)
+
+class QualityStats:
+    """
+    Constant-memory summary of the qualities and GC content of a stream of reads.
+
+    Keeps the number of reads and bases, the expected number of base errors
+    (the sum of every base's error probability), the GC base count, the sum
+    of each read's mean quality, and a histogram of reads and bases by read
+    length and mean quality (``reads[q, l]`` and ``bases[q, l]``; see
+    QC_QUAL_BIN_LIMIT and QC_LENGTH_EDGES). A read's mean quality is that of
+    the mean error probability of its bases, not the mean of their Phred
+    scores. Reads without bases are left out.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.gc_bases = 0
+        self.expected_errors = 0.0
+        self.read_qual_sum = 0.0
+        shape = (QC_QUAL_BIN_LIMIT + 1, len(QC_LENGTH_EDGES))
+        self.reads = np.zeros(shape, dtype=np.int64)
+        self.bases = np.zeros(shape, dtype=np.int64)
+
+    @property
+    def mean_qual(self) -> float:
+        """Quality of the mean error probability of every base."""
+        return float(error_prob_to_qual(self.expected_errors / self.total)) if self.total else 0.0
+
+    @property
+    def mean_read_qual(self) -> float:
+        """Mean of the reads' mean qualities."""
+        return self.read_qual_sum / self.count if self.count else 0.0
+
+    @property
+    def gc_content(self) -> float:
+        return self.gc_bases / self.total if self.total else 0.0
+
+    def add_batch(self, batch):
+        """Add the reads of a ReadBatch, a slice of reads at a time."""
+        # bytes.count scans for one byte value at C speed, without a temporary array
+        self.gc_bases += sum(batch.sequences.count(base) for base in (b"G", b"C", b"g", b"c"))
+        error_prob = _ERROR_PROB if batch.raw_quality else _FASTQ_ERROR_PROB
+        offsets = batch.offsets
+        first = 0
+        while first < len(batch):
+            # whole reads up to _QC_SLICE_BASES bases, and at least one read
+            last = max(int(np.searchsorted(offsets, offsets[first] + _QC_SLICE_BASES, side="right")) - 1, first + 1)
+            self._add_reads(batch, offsets[first:last + 1], batch.lengths[first:last], error_prob)
+            first = last
+
+    def _add_reads(self, batch, offsets, lengths, error_prob):
+        start, end = int(offsets[0]), int(offsets[-1])
+        nonempty = lengths > 0
+        if not nonempty.any():
+            return
+        probs = error_prob[np.frombuffer(batch.qualities, dtype=np.uint8, count=end - start, offset=start)]
+        # reads without bases add nothing between their neighbours' offsets
+        read_errors = np.add.reduceat(probs, offsets[:-1][nonempty] - start)
+        lengths = lengths[nonempty]
+        read_quals = error_prob_to_qual(read_errors / lengths)
+
+        self.count += len(lengths)
+        self.total += int(lengths.sum())
+        self.expected_errors += float(read_errors.sum())
+        self.read_qual_sum += float(read_quals.sum())
+        qual_bins = np.minimum(read_quals, QC_QUAL_BIN_LIMIT).astype(np.int64)
+        length_bins = np.searchsorted(QC_LENGTH_EDGES, lengths, side="right") - 1
+        np.add.at(self.reads, (qual_bins, length_bins), 1)
+        np.add.at(self.bases, (qual_bins, length_bins), lengths)
+
+    def merge(self, other: "QualityStats"):
+        """Add the reads summarised by another QualityStats to this one."""
+        self.count += other.count
+        self.total += other.total
+        self.gc_bases += other.gc_bases
+        self.expected_errors += other.expected_errors
+        self.read_qual_sum += other.read_qual_sum
+        self.reads += other.reads
+        self.bases += other.bases
+
+def summarise_quality(quality_stats):
+    """Build the statistics added by --extended from a QualityStats summary."""
     return {
-        "total_reads": total_reads,
-        "avg_read_len": avg_read_len,
-        "throughput": throughput,
-        "n50": n50
+        "mean_qual": round(quality_stats.mean_qual, 2),
+        "mean_read_qual": round(quality_stats.mean_read_qual, 2),
+        "gc_content": round(quality_stats.gc_content, 4),
     }
 
-    # fastq_file_stats is now handled by file_read_stats
+def iter_read_lengths(read_file, threads=None):
+    """
+    Yield arrays of the read lengths in a BAM or FASTQ file.
+
+    Only the lengths are decoded: FASTQ files are scanned for line positions
+    (see iter_fastq_lengths) and BAM/SAM/CRAM files for the flag and length of
+    each record (see iter_bam_lengths).
+    """
+    if is_fastq(read_file):
+        yield from iter_fastq_lengths(read_file, threads=threads)
+    else:
+        yield from iter_bam_lengths(read_file, threads=threads)
+
+def file_length_stats(read_file, threads=None, progress: bool = True):
+    """
+    Summarise the read lengths of a BAM or FASTQ file in a LengthStats histogram.
+
+    The lengths are added as they are read, so memory does not grow with the
+    number of reads. ``progress`` shows a progress bar for the file. A file
+    with an up-to-date bamurai index is not read at all; the histogram in the
+    index is returned.
+    """
+    index = load_index(read_file)
+    if index is not None:
+        return index.lengths
+
+    lengths = LengthStats()
+
+    if progress:
+        pbar = create_progress_bar_for_file(read_file, "Calculating statistics")
+
+    for batch_lengths in iter_read_lengths(read_file, threads=threads):
+        lengths.add_lengths(batch_lengths)
+        if progress:
+            pbar.update(len(batch_lengths))
+
+    if progress:
+        pbar.close()
+    return lengths
+
+def file_qc_stats(read_file, threads=None, progress: bool = True):
+    """
+    Summarise the read lengths, qualities and GC content of a BAM or FASTQ file in one pass.
+
+    Returns a LengthStats and a QualityStats. Unlike file_length_stats, every
+    read is parsed into ReadBatches, so an index is not used, records whose
+    sequence and quality lengths differ are an error, and BAM records without
+    qualities are skipped.
+    """
+    lengths = LengthStats()
+    quality = QualityStats()
+
+    if progress:
+        pbar = create_progress_bar_for_file(read_file, "Calculating statistics")
+
+    for batch in parse_read_batches(read_file, threads=threads):
+        lengths.add_lengths(batch.lengths)
+        quality.add_batch(batch)
+        if progress:
+            pbar.update(len(batch))
+
+    if progress:
+        pbar.close()
+    return lengths, quality
+
+def file_read_stats(read_file, threads=None, extended: bool = False):
+    """
+    Calculate statistics for a BAM or FASTQ file.
+
+    With ``extended``, the mean qualities and GC content of the reads are
+    added (see file_qc_stats and summarise_quality).
+    """
+    if extended:
+        lengths, quality = file_qc_stats(read_file, threads)
+        return {**summarise_lengths(lengths), **summarise_quality(quality)}
+    return summarise_lengths(file_length_stats(read_file, threads))
+
+def find_read_files(paths):
+    """
+    Expand the inputs of stats into a list of read files.
+
+    Directories contribute the BAM/SAM/CRAM and FASTQ files directly inside
+    them, and paths that do not exist are taken as glob patterns (``**``
+    matches subdirectories), for patterns the shell left unexpanded; both are
+    sorted by name. Other paths are kept as given.
+    """
+    read_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(os.path.join(path, name) for name in os.listdir(path) if is_read_file(name))
+            if not found:
+                raise FileNotFoundError(f"No BAM/SAM/CRAM or FASTQ files found in directory: {path}")
+        elif os.path.exists(path):
+            found = [path]
+        else:
+            found = sorted(match for match in glob.glob(path, recursive=True) if is_read_file(match))
+            if not found:
+                raise FileNotFoundError(f"No such file, or no read files matching pattern: {path}")
+        read_files.extend(found)
+    return read_files
+
+def write_summary(path, length_stats, read_files):
+    """
+    Write a mergeable summary of the read lengths of some files.
+
+    The summary is a JSON document (gzipped if ``path`` ends in .gz) holding
+    the LengthStats histogram and the names of the files it covers; stats
+    --merge combines summaries into the statistics of all their reads.
+    """
+    summary = {
+        "format": SUMMARY_FORMAT,
+        "version": SUMMARY_FORMAT_VERSION,
+        "files": list(read_files),
+        "lengths": length_stats.to_dict(),
+    }
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        json.dump(summary, f, separators=(",", ":"))
+
+def load_summary(path):
+    """
+    Load a summary written by write_summary as ``(length_stats, read_files)``.
+
+    The index files written by bamurai index hold the same histogram, and
+    are accepted as the summary of their read file.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") == "bamurai-index" and path.endswith(INDEX_SUFFIX):
+        return LengthStats.from_dict(data["lengths"]), [path[:-len(INDEX_SUFFIX)]]
+    if data.get("format") != SUMMARY_FORMAT or data.get("version") != SUMMARY_FORMAT_VERSION:
+        raise ValueError(f"Not a version {SUMMARY_FORMAT_VERSION} Bamurai stats summary: {path}")
+    return LengthStats.from_dict(data["lengths"]), data["files"]
+
+def _file_summary(read_file, threads=None, extended: bool = False, progress: bool = True):
+    """Summarise a read file for file_stats as a LengthStats and, if ``extended``, a QualityStats."""
+    if extended:
+        return file_qc_stats(read_file, threads=threads, progress=progress)
+    return file_length_stats(read_file, threads=threads, progress=progress), None
+
+def _print_stats(name, stats):
+    print(f"Statistics for {name}:")
+    print(f"  Total reads: {stats['total_reads']}")
+    print(f"  Average read length: {stats['avg_read_len']}")
+    print(f"  Median read length: {stats['median_read_len']}")
+    print(f"  Read length range: {stats['min_read_len']}-{stats['max_read_len']}")
+    print(f"  Throughput (Gb): {round(stats['throughput'] / 1e9, 2)}")
+    print(f"  N50: {stats['n50']}")
+    print("  Nx: " + ", ".join(f"N{x}={stats[f'n{x}']}" for x in NX_PERCENTAGES))
+    if "mean_qual" in stats:
+        print(f"  Mean base quality (Q): {stats['mean_qual']}")
+        print(f"  Mean read quality (Q): {stats['mean_read_qual']}")
+        print(f"  GC content (%): {round(stats['gc_content'] * 100, 2)}")
+
+def _print_tsv_row(name, stats):
+    columns = TSV_COLUMNS + EXTENDED_TSV_COLUMNS
+    print("\t".join([name] + [str(stats[column]) for column in columns if column in stats]))
+
+def _write_qual_histogram_rows(handle, name, quality_stats):
+    """Write the occupied bins of a length-by-quality histogram as TSV rows."""
+    for q, l in zip(*np.nonzero(quality_stats.reads)):
+        qual_bin = f"{q}+" if q == QC_QUAL_BIN_LIMIT else str(q)
+        max_len = str(QC_LENGTH_EDGES[l + 1] - 1) if l + 1 < len(QC_LENGTH_EDGES) else ""
+        handle.write(f"{name}\t{qual_bin}\t{QC_LENGTH_EDGES[l]}\t{max_len}\t"
+                     f"{quality_stats.reads[q, l]}\t{quality_stats.bases[q, l]}\n")
 
 def file_stats(args):
-    stats = file_read_stats(args.reads)
+    paths = args.reads if isinstance(args.reads, list) else [args.reads]
+    threads = getattr(args, 'threads', None)
+    workers = getattr(args, 'workers', 1)
+    summary_path = getattr(args, 'summary', None)
+    histogram_path = getattr(args, 'qual_histogram', None)
+    extended = getattr(args, 'extended', False) or histogram_path is not None
+
+    pbar = None
+    if getattr(args, 'merge', False):
+        # the inputs are summaries; no reads are touched
+        names = paths
+        summaries = ((lengths, None, files) for lengths, files in map(load_summary, paths))
+    else:
+        names = find_read_files(paths)
+        if len(names) == 1:
+            summaries = [(*_file_summary(names[0], threads=threads, extended=extended), names)]
+        else:
+            # files are summarised on the workers and their histograms merged
+            # here, so the aggregate N50 and quantiles are those of all the reads
+            file_summary = functools.partial(_file_summary, threads=threads, extended=extended, progress=False)
+            pbar = tqdm(total=len(names), desc="Calculating statistics", unit="files", disable=not progress_enabled())
+            summaries = ((lengths, quality, [name])
+                         for name, (lengths, quality) in zip(names, ordered_map(file_summary, names, workers)))
 
     if args.tsv:
         # print in tsv style
-        print(f"file_name\ttotal_reads\tavg_read_len\tthroughput\tn50")
-        print(f"{args.reads}\t{stats['total_reads']}\t{stats['avg_read_len']}\t{stats['throughput']}\t{stats['n50']}")
-    else:
-        print(f"Statistics for {args.reads}:")
-        print(f"  Total reads: {stats['total_reads']}")
-        print(f"  Average read length: {stats['avg_read_len']}")
-        print(f"  Throughput (Gb): {round(stats['throughput'] / 1e9, 2)}")
-        print(f"  N50: {stats['n50']}")
+        print("\t".join(("file_name",) + TSV_COLUMNS + (EXTENDED_TSV_COLUMNS if extended else ())))
+    print_stats = _print_tsv_row if args.tsv else _print_stats
+    histogram = None
+    if histogram_path:
+        histogram = open(histogram_path, "w", encoding="utf-8")
+        histogram.write("file_name\tmean_qual\tmin_read_len\tmax_read_len\treads\tbases\n")
+
+    total = LengthStats()
+    total_quality = QualityStats()
+    read_files = []
+    for name, (lengths, quality, files) in zip(names, summaries):
+        total.merge(lengths)
+        read_files.extend(files)
+        stats = summarise_lengths(lengths)
+        if quality is not None:
+            total_quality.merge(quality)
+            stats.update(summarise_quality(quality))
+            if histogram is not None:
+                _write_qual_histogram_rows(histogram, name, quality)
+        if pbar is not None:
+            pbar.update(1)
+            pbar.clear()
+        print_stats(name, stats)
+    if pbar is not None:
+        pbar.close()
+
+    if len(names) > 1:
+        aggregate_name = AGGREGATE_NAME if args.tsv else f"all {len(names)} files"
+        stats = summarise_lengths(total)
+        if extended:
+            stats.update(summarise_quality(total_quality))
+            if histogram is not None:
+                _write_qual_histogram_rows(histogram, AGGREGATE_NAME, total_quality)
+        print_stats(aggregate_name, stats)
+    if histogram is not None:
+        histogram.close()
+    if summary_path:
+        write_summary(summary_path, total, read_files)
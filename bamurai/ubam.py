@@ -0,0 +1,226 @@
+"""
+Unaligned BAM (uBAM) output for Bamurai.
+
+Reads split from a tagged BAM keep the tags of their parent, except those
+describing an alignment, which mean nothing once a read is unaligned. Records
+are put back in their original sequencing orientation, which is also the one
+base modification tags are written in. Most tags are copied as they are;
+per-base tags are cut down to each fragment:
+
+- MM/ML (base modifications, and their older Mm/Ml spelling) keep only the
+  calls that fall inside the fragment, with skip counts renumbered from its
+  start
+- MN (the sequence length MM/ML refer to) becomes the fragment length
+- OQ (original base qualities) is sliced like the quality string
+"""
+
+import array
+
+import numpy as np
+import pysam
+
+from bamurai.bgzf import DEFAULT_COMPRESSION_LEVEL
+from bamurai.fastq import FastqWriter
+from bamurai.utils import resolve_threads
+from bamurai.version import get_version
+
+# Tags describing an alignment, dropped when a record is unaligned (the same
+# set Picard's RevertSam removes, less PG).
+ALIGNMENT_TAGS = frozenset(("AS", "MC", "MD", "MQ", "NM", "SA", "UQ"))
+
+# Modification tags as named in the SAM specification, and the names used
+# before they were standardised.
+_MODIFICATION_TAG_PAIRS = (("MM", "ML"), ("Mm", "Ml"))
+_REVERSE_COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+def unaligned_fields(record):
+    """
+    Return the sequence, raw Phred qualities and tags of a pysam record as sequenced.
+
+    Reverse-strand records are reverse complemented back to their original
+    orientation, and alignment tags are dropped. Tags are (tag, value, type)
+    tuples as returned by get_tags(with_value_type=True).
+    """
+    sequence = record.query_sequence
+    phred = record.query_qualities.tobytes()
+    tags = [tag for tag in record.get_tags(with_value_type=True) if tag[0] not in ALIGNMENT_TAGS]
+    if record.is_reverse:
+        sequence = sequence.translate(_REVERSE_COMPLEMENT)[::-1]
+        phred = phred[::-1]
+        # OQ follows the stored sequence; MM/ML already refer to the original strand
+        tags = [(tag, value[::-1] if tag == "OQ" else value, value_type) for tag, value, value_type in tags]
+    return sequence, phred, tags
+
+def _modification_entries(mm):
+    """Split an MM tag into (base, strand, codes, flag, skip counts) entries."""
+    entries = []
+    for entry in mm.split(";"):
+        if not entry:
+            continue
+        fields = entry.split(",")
+        head = fields[0]
+        base, strand, codes = head[0], head[1], head[2:]
+        flag = ""
+        if codes and codes[-1] in ".?":
+            codes, flag = codes[:-1], codes[-1]
+        skips = [int(skip) for skip in fields[1:]]
+        entries.append((base, strand, codes, flag, skips))
+    return entries
+
+def _modification_count(codes):
+    """Number of modifications, and so of ML values per call, named by an MM entry."""
+    # either one ChEBI number or a run of single-letter codes
+    return 1 if codes.isdigit() else len(codes)
+
+def slice_modifications(mm, ml, sequence, start, end):
+    """
+    Restrict MM/ML base modification calls to the fragment ``sequence[start:end]``.
+
+    ``sequence`` is the whole read as bytes, in the orientation the MM tag
+    refers to (the original sequencing orientation). Returns the new MM string
+    and ML array; entries left without calls are kept with no skip counts.
+    """
+    seq = np.frombuffer(bytes(sequence), dtype=np.uint8)
+    ml = list(ml) if ml is not None else None
+    ml_pos = 0
+    new_mm, new_ml = [], []
+    for base, strand, codes, flag, skips in _modification_entries(mm):
+        # skip counts always count the listed base as it appears in the
+        # sequence, even for '-' strand calls (e.g. G-m: a 5mC opposite a G)
+        counted = ord(base)
+        if base == "N":
+            before = start
+            inside = end - start
+        else:
+            before = int(np.count_nonzero(seq[:start] == counted))
+            inside = int(np.count_nonzero(seq[start:end] == counted))
+
+        # occurrence number (among counted bases) of each call
+        occurrences = np.cumsum(np.asarray(skips, dtype=np.int64) + 1) - 1
+        keep = np.flatnonzero((occurrences >= before) & (occurrences < before + inside))
+        kept = occurrences[keep] - before
+        new_skips = np.diff(kept, prepend=-1) - 1
+
+        new_mm.append(f"{base}{strand}{codes}{flag}" + "".join(f",{skip}" for skip in new_skips.tolist()) + ";")
+        per_call = _modification_count(codes)
+        if ml is not None:
+            entry_ml = ml[ml_pos:ml_pos + len(skips) * per_call]
+            for k in keep.tolist():
+                new_ml.extend(entry_ml[k * per_call:(k + 1) * per_call])
+        ml_pos += len(skips) * per_call
+
+    return "".join(new_mm), array.array("B", new_ml)
+
+def slice_tags(tags, sequence, start, end):
+    """
+    Return a fragment's copy of ``tags`` for ``sequence[start:end]``.
+
+    ``tags`` is a list of (tag, value, type) tuples as returned by pysam's
+    get_tags(with_value_type=True).
+    """
+    values = {tag: value for tag, value, _ in tags}
+    sliced = {}
+    for mm_tag, ml_tag in _MODIFICATION_TAG_PAIRS:
+        if mm_tag in values:
+            mm, ml = slice_modifications(values[mm_tag], values.get(ml_tag), sequence, start, end)
+            sliced[mm_tag] = mm
+            if ml_tag in values:
+                sliced[ml_tag] = ml
+    if "MN" in values:
+        sliced["MN"] = end - start
+    if "OQ" in values:
+        sliced["OQ"] = values["OQ"][start:end]
+    return [(tag, sliced.get(tag, value), value_type) for tag, value, value_type in tags]
+
+def unaligned_header(template=None):
+    """
+    Build a uBAM header, keeping the read groups, programs and comments of ``template``.
+
+    ``template`` is a pysam AlignmentHeader or None; reference sequences are
+    dropped since the output is unaligned.
+    """
+    header = {"HD": {"VN": "1.6", "SO": "unknown"}}
+    source = template.to_dict() if template is not None else {}
+    for key in ("RG", "PG", "CO"):
+        if source.get(key):
+            header[key] = list(source[key])
+    programs = header.setdefault("PG", [])
+    ids = {program.get("ID") for program in programs}
+    program = {"ID": "bamurai", "PN": "bamurai", "VN": get_version()}
+    if programs:
+        program["PP"] = programs[-1]["ID"]
+    # keep IDs unique if the input already went through bamurai
+    suffix = 1
+    while program["ID"] in ids:
+        program["ID"] = f"bamurai.{suffix}"
+        suffix += 1
+    programs.append(program)
+    return pysam.AlignmentHeader.from_dict(header)
+
+class UbamWriter:
+    """
+    Unaligned BAM writer with the same interface as bamurai.fastq.FastqWriter.
+
+    Each Read becomes an unmapped record with its ``tags``, if any, and its
+    qualities passed through as raw Phred scores. BGZF compression runs on
+    ``threads`` htslib threads.
+    """
+
+    def __init__(self, path, template=None, threads: int = 1):
+        self.path = path
+        self.records_written = 0
+        self._header = unaligned_header(template)
+        self._bam = pysam.AlignmentFile(path, "wb", header=self._header, threads=threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, read):
+        record = pysam.AlignedSegment(self._header)
+        record.query_name = read.read_id
+        record.flag = 4
+        sequence = read.sequence
+        record.query_sequence = sequence if isinstance(sequence, str) else str(sequence, "ascii")
+        record.query_qualities = read.phred_quality()
+        if read.tags:
+            # pysam reports arrays with a 'B' type it will not accept back;
+            # without a type it infers the array subtype itself
+            record.set_tags([
+                (tag, value) if value_type == "B" else (tag, value, value_type)
+                for tag, value, value_type in read.tags
+            ])
+        self._bam.write(record)
+        self.records_written += 1
+
+    def write_reads(self, reads):
+        for read in reads:
+            self.write(read)
+
+    def close(self):
+        if self._bam is not None:
+            self._bam.close()
+            self._bam = None
+
+def is_bam_output(path):
+    """Check if an output path asks for unaligned BAM rather than FASTQ."""
+    return path is not None and path.endswith(".bam")
+
+def open_read_writer(output, reads_file, threads: int | None = None,
+                     compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+    """
+    Open the writer for a read-processing command's output.
+
+    Outputs ending in .bam get a UbamWriter whose header is based on that of
+    ``reads_file`` when it is a BAM/SAM/CRAM file; anything else, including
+    standard output (None), gets a FastqWriter.
+    """
+    if not is_bam_output(output):
+        return FastqWriter(output, threads=threads, compression_level=compression_level)
+    template = None
+    if reads_file.endswith((".bam", ".sam", ".cram")):
+        with pysam.AlignmentFile(reads_file, "rb", check_sq=False) as bam:
+            template = bam.header
+    return UbamWriter(output, template=template, threads=resolve_threads(threads))
@@ -1,6 +1,13 @@
+import os
+import sys
 import gzip
+import errno
 import time
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from typing import TextIO, BinaryIO, Union, Optional, Any, IO
 from bamurai.logging_config import LOGGING_FORMAT, LOGGING_DATEFMT
 
@@ -28,6 +35,254 @@ def print_elapsed_time_pretty(start_time, logger=None):
     else:
         logger.info("Time elapsed: %dh %dm %ds", hours, minutes, seconds)
 
+# Environment variable consulted for the thread count when --threads is not given,
+# so batch schedulers can set it once per job.
+THREADS_ENV_VAR = "BAMURAI_THREADS"
+
+def resolve_threads(threads: Optional[int] = None) -> int:
+    """
+    Resolve the number of htslib/compression threads to use.
+
+    An explicit value wins, then the BAMURAI_THREADS environment variable, then 1.
+    """
+    source = "--threads"
+    if threads is None:
+        env_value = os.environ.get(THREADS_ENV_VAR)
+        if not env_value:
+            return 1
+        source = THREADS_ENV_VAR
+        try:
+            threads = int(env_value)
+        except ValueError:
+            raise ValueError(f"{THREADS_ENV_VAR} must be an integer, got '{env_value}'") from None
+    if threads < 1:
+        raise ValueError(f"{source} must be at least 1, got {threads}")
+    return threads
+
+# Most bytes of items ordered_map hands out at once, by default
+DEFAULT_MAX_PENDING_BYTES = 256 * 1024 * 1024
+
+def _pool_context():
+    """
+    Return the multiprocessing context ordered_map starts its workers with.
+
+    The pool starts its workers on the first item, by which time the caller
+    has usually started BGZF, htslib or tqdm threads, and forking a process
+    with threads can deadlock. Workers are therefore forked from a fork
+    server, a single-threaded process, or spawned where there is none. The
+    fork server imports the Bamurai modules loaded here once, so workers do
+    not each import them again; a main module run with -m is left for the
+    workers to run, as importing it first would make runpy warn.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    main_spec = getattr(sys.modules["__main__"], "__spec__", None)
+    main_name = main_spec.name if main_spec is not None else None
+    modules = sorted(name for name in sys.modules if name.split(".")[0] == "bamurai" and name != main_name)
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", *modules])
+    return context
+
+def ordered_map(func, items, workers: int = 1, max_pending: Optional[int] = None, size=None,
+                max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES):
+    """
+    Apply ``func`` to each of ``items`` on a pool of worker processes.
+
+    Results are yielded in input order. At most ``max_pending`` items (default
+    ``workers * 2``) are handed out at once, and, when ``size`` gives the size
+    of an item in bytes, at most ``max_pending_bytes`` of them, though always
+    at least one item. The producer therefore cannot run ahead of the pool,
+    and memory stays bounded by item bytes however large items get. With one
+    worker ``func`` runs in this process. ``func`` and the items must be
+    picklable, and ``func`` importable by the workers (see _pool_context).
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    max_pending = max_pending or workers * 2
+    # futures handed out and the size of their items
+    pending = deque()
+    pending_bytes = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        for item in items:
+            item_size = size(item) if size else 0
+            while pending and (len(pending) >= max_pending or pending_bytes + item_size > max_pending_bytes):
+                future, done_size = pending.popleft()
+                pending_bytes -= done_size
+                yield future.result()
+            pending.append((pool.submit(func, item), item_size))
+            pending_bytes += item_size
+        while pending:
+            yield pending.popleft()[0].result()
+
+# Most bytes asked of one copy_file_range or sendfile call, and the block
+# size of copies made by reading and writing
+_COPY_STEP = 1 << 30
+_COPY_BLOCK_SIZE = 4 * 1024 * 1024
+
+# errnos of copy_file_range and sendfile meaning the call cannot be used for
+# these files, rather than that the copy failed
+_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}
+
+def copy_range(src_fd: int, dst_fd: int, offset: int, count: int):
+    """
+    Copy ``count`` bytes at ``offset`` of file descriptor ``src_fd`` to ``dst_fd`` at its current position.
+
+    The copy is made by the kernel with copy_file_range, which filesystems
+    that support it turn into a clone, or else sendfile, so the data is never
+    brought into Python; where neither works for the two files it is read
+    and written in blocks.
+    """
+    end = offset + count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(src_fd, dst_fd, min(end - offset, _COPY_STEP), offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in _COPY_UNSUPPORTED:
+                raise
+    if offset < end and hasattr(os, "sendfile"):
+        try:
+            while offset < end:
+                sent = os.sendfile(dst_fd, src_fd, offset, min(end - offset, _COPY_STEP))
+                if not sent:
+                    break
+                offset += sent
+        except OSError as e:
+            if e.errno not in _COPY_UNSUPPORTED:
+                raise
+    while offset < end:
+        data = os.pread(src_fd, min(end - offset, _COPY_BLOCK_SIZE), offset)
+        if not data:
+            raise EOFError(f"Input ended {end - offset} bytes before the range being copied")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        offset += len(data)
+
+# Read lengths below this get a histogram bin each in LengthStats; longer ones
+# share log-spaced bins, LENGTH_LOG_BINS_PER_DECADE per decade up to
+# LENGTH_LOG_BIN_LIMIT, the last bin taking anything longer.
+LENGTH_EXACT_LIMIT = 100_000
+LENGTH_LOG_BINS_PER_DECADE = 200
+LENGTH_LOG_BIN_LIMIT = 10**12
+
+def _log_bin_edges(exact_limit: int) -> np.ndarray:
+    """Lower edges of the log-spaced length bins starting at exact_limit, rounded up to whole bases."""
+    decades = np.log10(LENGTH_LOG_BIN_LIMIT / exact_limit)
+    steps = np.arange(int(np.ceil(decades * LENGTH_LOG_BINS_PER_DECADE)))
+    return np.unique(np.ceil(exact_limit * 10.0 ** (steps / LENGTH_LOG_BINS_PER_DECADE)).astype(np.int64))
+
+class LengthStats:
+    """
+    Constant-memory summary of a stream of read lengths.
+
+    Keeps the count, sum, minimum and maximum of the lengths seen and a
+    histogram of them: one bin per length below ``exact_limit`` and
+    log-spaced bins above it (see LENGTH_LOG_BINS_PER_DECADE), so memory does
+    not grow with the input. ``counts[i]`` and ``bases[i]`` hold the number
+    of lengths falling in bin i and their sum. Summaries built separately,
+    e.g. by worker processes, are combined with merge.
+    """
+
+    def __init__(self, exact_limit: int = LENGTH_EXACT_LIMIT):
+        self.exact_limit = exact_limit
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.log_edges = _log_bin_edges(exact_limit)
+        n_bins = exact_limit + len(self.log_edges)
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.bases = np.zeros(n_bins, dtype=np.int64)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def bin_index(self, lengths) -> np.ndarray:
+        """Return the histogram bin of each of an array of lengths."""
+        lengths = np.asarray(lengths, dtype=np.int64)
+        log_bins = self.exact_limit + np.searchsorted(self.log_edges, lengths, side="right") - 1
+        return np.where(lengths < self.exact_limit, lengths, log_bins)
+
+    def add(self, length: int):
+        """Add a single length."""
+        self.count += 1
+        self.total += length
+        if self.min is None or length < self.min:
+            self.min = length
+        if self.max is None or length > self.max:
+            self.max = length
+        if length < self.exact_limit:
+            i = length
+        else:
+            i = self.exact_limit + int(np.searchsorted(self.log_edges, length, side="right")) - 1
+        self.counts[i] += 1
+        self.bases[i] += length
+
+    def add_lengths(self, lengths):
+        """Add an array of lengths at once."""
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if lengths.size == 0:
+            return
+        self.count += int(lengths.size)
+        self.total += int(lengths.sum())
+        shortest, longest = int(lengths.min()), int(lengths.max())
+        if self.min is None or shortest < self.min:
+            self.min = shortest
+        if self.max is None or longest > self.max:
+            self.max = longest
+        bins = self.bin_index(lengths)
+        np.add.at(self.counts, bins, 1)
+        np.add.at(self.bases, bins, lengths)
+
+    def merge(self, other: "LengthStats"):
+        """Add the lengths summarised by another LengthStats to this one."""
+        if other.exact_limit != self.exact_limit:
+            raise ValueError(f"Cannot merge length summaries with exact limits {self.exact_limit} and {other.exact_limit}")
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.counts += other.counts
+        self.bases += other.bases
+
+    def to_dict(self) -> dict:
+        """Return the summary as a JSON-serialisable dict, listing only occupied bins."""
+        bins = np.flatnonzero(self.counts)
+        return {
+            "exact_limit": self.exact_limit,
+            "log_bins_per_decade": LENGTH_LOG_BINS_PER_DECADE,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "bins": bins.tolist(),
+            "counts": self.counts[bins].tolist(),
+            "bases": self.bases[bins].tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LengthStats":
+        """Rebuild a summary written by to_dict."""
+        if data["log_bins_per_decade"] != LENGTH_LOG_BINS_PER_DECADE:
+            raise ValueError(f"Length summary has {data['log_bins_per_decade']} log bins per decade, "
+                             f"expected {LENGTH_LOG_BINS_PER_DECADE}")
+        length_stats = cls(data["exact_limit"])
+        length_stats.count = data["count"]
+        length_stats.total = data["total"]
+        length_stats.min = data["min"]
+        length_stats.max = data["max"]
+        length_stats.counts[data["bins"]] = data["counts"]
+        length_stats.bases[data["bins"]] = data["bases"]
+        return length_stats
+
 def is_fastq(path):
     """Check if a file is a FASTQ file."""
     path = path.lower()
@@ -36,6 +291,10 @@ def is_fastq(path):
         path.endswith(".fastq.gz") or \
         path.endswith(".fq.gz")
 
+def is_read_file(path):
+    """Check if a file is a BAM/SAM/CRAM or FASTQ file."""
+    return path.lower().endswith((".bam", ".sam", ".cram")) or is_fastq(path)
+
 def smart_open(filename: str, mode: str = "rt", encoding: Optional[str] = None) -> Any:
     """Open a file normally or with gzip based on file extension. Supports text and binary modes."""
     try:
@@ -62,86 +321,39 @@ def calculate_percentage(count, total):
     return (count / total * 100) if total > 0 else 0
 
 # Progress bar utilities
-def create_progress_bar_for_file(filepath, desc="Processing", unit="reads", mininterval=0.2):
-    """Create appropriate progress bar based on file type using tqdm's built-in time buffering."""
-    import os
-    from tqdm import tqdm
-
-    if filepath.endswith(('.bam', '.sam', '.cram')):
-        # BAM files: Start with unknown total, will be updated async
-        return tqdm(desc=desc, unit=unit, mininterval=mininterval)
-    elif filepath.endswith(('.fastq', '.fq', '.fastq.gz', '.fq.gz')):
-        # FASTQ files: Use file size for progress
-        file_size = os.path.getsize(filepath)
-        return tqdm(total=file_size, desc=desc, unit="B", unit_scale=True, mininterval=mininterval)
-    else:
-        # Unknown format: Use unknown total
-        return tqdm(desc=desc, unit=unit, mininterval=mininterval)
 
-def count_reads_async_generic(filepath, progress_bar):
-    """Count reads asynchronously for different file types."""
-    import threading
-    import pysam
+# Functions returning how far the latest reader of each file has got into it,
+# in bytes of the file on disk, keyed by path. The parsers register their
+# handles here so progress bars can follow them without reading anything, and
+# an entry goes once its reader is closed, so a bar never follows a reader
+# that has already finished with the file.
+_READ_POSITIONS = {}
 
-    def count_bam_reads():
-        try:
-            with pysam.AlignmentFile(filepath, "rb") as infile:
-                total = sum(1 for read in infile if not (read.is_secondary or read.is_supplementary))
-                progress_bar.total = total
-                progress_bar.refresh()
-        except Exception:
-            pass
-
-    def count_fastq_reads():
-        try:
-            line_count = 0
-            with smart_open(filepath, "r") as f:
-                for _ in f:
-                    line_count += 1
-            total_reads = line_count // 4
-            progress_bar.total = total_reads
-            progress_bar.refresh()
-        except Exception:
-            pass
-
-    if filepath.endswith(('.bam', '.sam', '.cram')):
-        count_func = count_bam_reads
-    elif filepath.endswith(('.fastq', '.fq', '.fastq.gz', '.fq.gz')):
-        count_func = count_fastq_reads
-    else:
-        return  # Unknown format
+def track_read_position(path, position):
+    """Register ``position``, a function returning the offset reached in the file at ``path`` on disk."""
+    _READ_POSITIONS[os.path.realpath(path)] = position
 
-    count_thread = threading.Thread(target=count_func)
-    count_thread.daemon = True
-    count_thread.start()
-    return count_thread
+def untrack_read_position(path, position):
+    """Forget ``position`` for the file at ``path`` once its reader is done, unless a newer reader has replaced it."""
+    key = os.path.realpath(path)
+    if _READ_POSITIONS.get(key) is position:
+        del _READ_POSITIONS[key]
 
-def create_multi_file_progress_bar(filepaths, desc="Processing files", mininterval=0.2):  # pragma: no cover
-    """Create progress bar for multiple files using tqdm's built-in time buffering."""
-    from tqdm import tqdm
-    import threading
-    import pysam
-
-    total_pbar = tqdm(desc=desc, unit="reads", mininterval=mininterval)
+def track_alignment_file(path, alignment_file):
+    """Register the offset reached by a pysam AlignmentFile, taking BAM positions from their virtual offsets."""
+    if alignment_file.is_bam:
+        track_read_position(path, lambda: alignment_file.tell() >> 16)
+    else:
+        track_read_position(path, alignment_file.tell)
 
-    def count_all_reads():
-        try:
-            total = 0
-            for filepath in filepaths:
-                if filepath.endswith(('.bam', '.sam', '.cram')):
-                    with pysam.AlignmentFile(filepath, "rb") as infile:
-                        total += sum(1 for read in infile if not (read.is_secondary or read.is_supplementary))
-                elif filepath.endswith(('.fastq', '.fq', '.fastq.gz', '.fq.gz')):
-                    with smart_open(filepath, "r") as f:
-                        line_count = sum(1 for _ in f)
-                    total += line_count // 4
-            total_pbar.total = total
-            total_pbar.refresh()
-        except Exception:
-            pass
-
-    count_thread = threading.Thread(target=count_all_reads)
-    count_thread.daemon = True
-    count_thread.start()
-
-    return total_pbar, count_thread
+def read_position(path):
+    """Return the offset on disk reached by the latest reader of a file, or None if untracked or closed."""
+    position = _READ_POSITIONS.get(os.path.realpath(path))
+    if position is None:
+        return None
+    try:
+        return position()
+    except (ValueError, OSError):
+        # the reader's file has been closed
+        untrack_read_position(path, position)
+        return None
@@ -2,6 +2,7 @@ import pysam
 import pandas as pd
 import os
 from typing import Dict, Set, List
+from bamurai.utils import resolve_threads
 
 def parse_barcode_donor_mapping(tsv_file: str, barcode_column: str = None, donor_id_column: str = None) -> Dict[str, str]:
     """
@@ -93,24 +94,27 @@ def get_read_barcode(read) -> str | None:
             return read.get_tag(tag)
     return None
 
-def concatenate_bam_files(file_list: List[str], output_path: str) -> None:
+def concatenate_bam_files(file_list: List[str], output_path: str, threads: int | None = None) -> None:
     """
     Concatenate multiple BAM files into a single file
 
     Args:
         file_list: List of BAM files to concatenate
         output_path: Path to write the concatenated BAM file
+        threads: Number of htslib threads for reading and writing
     """
     if not file_list:
         return
 
+    threads = resolve_threads(threads)
+
     # Open the first file to use as a template
     with pysam.AlignmentFile(file_list[0], "rb") as template:
         # Create the output file using the template
-        with pysam.AlignmentFile(output_path, "wb", template=template) as outfile:
+        with pysam.AlignmentFile(output_path, "wb", template=template, threads=threads) as outfile:
             # Iterate through all input files
             for bam_file in file_list:
-                with pysam.AlignmentFile(bam_file, "rb") as infile:
+                with pysam.AlignmentFile(bam_file, "rb", threads=threads) as infile:
                     # Copy all reads from the input file to the output file
                     for read in infile:
                         outfile.write(read)
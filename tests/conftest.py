@@ -156,6 +156,22 @@ def write_bam(path, segments_spec, header=None):
     return str(path)
 
 
+def write_unaligned_cram(path, segments_spec=None):
+    """
+    Write segment specs (default: :func:`default_bam_specs`) to a CRAM file.
+
+    The header has no reference sequences and every record is marked unmapped,
+    so no reference is needed to write or read the file.
+    """
+    header = pysam.AlignmentHeader.from_dict({"HD": {"VN": "1.6", "SO": "unknown"}})
+    with pysam.AlignmentFile(str(path), "wc", header=header) as cram:
+        for spec in segments_spec or default_bam_specs():
+            cram.write(
+                make_segment(header, spec["name"], spec["sequence"], spec["quals"], flag=spec.get("flag", 4) | 4)
+            )
+    return str(path)
+
+
 def default_bam_specs():
     """
     Five primary reads plus one secondary and one supplementary record.
@@ -19,6 +19,7 @@ import argparse
 import gzip
 import os
 import sys
+from array import array
 
 import pysam
 
@@ -60,6 +61,14 @@ def _write_bam_with_sam(path, specs, header=None):
     _bam_to_sam(path, path[:-4] + ".sam")
 
 
+def write_bgzf_fastq(path, records):
+    """Write ``records`` as BGZF-compressed FASTQ, one BGZF block per record."""
+    with pysam.BGZFile(path, "wb") as f:
+        for read_id, sequence, quality in records:
+            f.write(f"@{read_id}\n{sequence}\n+\n{quality}\n".encode())
+            f.flush()
+
+
 # ---------------------------------------------------------------------------
 # Barcode / donor mapping TSVs
 # ---------------------------------------------------------------------------
@@ -145,6 +154,10 @@ def write_malformed_fastqs(out_dir):
         f.write("")                                  # zero records
     # A valid FASTQ using IUPAC ambiguity codes (must pass validation).
     write_fastq(p("iupac_ok.fastq"), [("r1", "ACGTNRYK", "IIIIIIII")])
+    # Windows line endings, which the block parser must strip like readline.
+    with open(p("crlf.fastq"), "wb") as f:
+        for read_id, seq, qual in default_fastq_records():
+            f.write(f"@{read_id}\r\n{seq}\r\n+\r\n{qual}\r\n".encode())
     # A non-BAM/FASTQ extension for the dispatcher's unsupported branch.
     with open(p("unsupported.txt"), "w") as f:
         f.write("hello")
@@ -238,12 +251,42 @@ def write_crafted_bams(out_dir):
         bam.write(seg)
 
 
+def write_modified_bam(path):
+    """
+    Reads carrying base modification (MM/ML) and other per-base tags.
+
+    Both reads are CACGCATCGC as sequenced, with 5mC calls on the Cs at 0, 4
+    and 9. The second is stored reverse complemented (flag 16), as an aligner
+    would; its MM/ML still refer to the original orientation while OQ follows
+    the stored sequence.
+    """
+    sequence = "CACGCATCGC"
+    reverse = sequence.translate(str.maketrans("ACGT", "TGCA"))[::-1]
+    quals = [10, 11, 12, 13, 14, 15, 16, 17, 18, 19]
+    tags = [
+        ("CB", DONOR1_BARCODE, "Z"),
+        ("MM", "C+m?,0,1,1;", "Z"),
+        ("ML", array("B", [10, 20, 30]), None),
+        ("MN", len(sequence), "i"),
+        ("NM", 0, "i"),
+    ]
+    oq = "ABCDEFGHIJ"
+    _write_bam_with_sam(path, [
+        {"name": "mod_fwd", "sequence": sequence, "quals": quals, "flag": 4,
+         "tags": tags + [("OQ", oq, "Z")]},
+        {"name": "mod_rev", "sequence": reverse, "quals": quals[::-1], "flag": 4 | 16,
+         "tags": tags + [("OQ", oq[::-1], "Z")]},
+    ])
+
+
 # Human-readable notes written to MANIFEST.txt, keyed by filename.
 _MANIFEST = {
     "reads.fastq":
         "5 FASTQ reads, lengths [50, 120, 250, 80, 300].",
     "reads.fastq.gz":
         "Gzip of reads.fastq (identical records).",
+    "reads_bgzf.fastq.gz":
+        "BGZF of reads.fastq with one block per record (multi-block input).",
     "reads.bam":
         "5 primary reads (same as reads.fastq) PLUS 1 secondary (flag 256) "
         "and 1 supplementary (flag 2048) record that parse_reads must ignore.",
@@ -282,6 +325,8 @@ _MANIFEST = {
         "Malformed FASTQ: non-IUPAC character 'Z' in sequence.",
     "truncated.fastq":
         "Malformed FASTQ: header line only, record truncated.",
+    "crlf.fastq":
+        "reads.fastq records written with CRLF (Windows) line endings.",
     "empty.fastq":
         "Empty FASTQ (zero records) - valid input.",
     "iupac_ok.fastq":
@@ -312,6 +357,11 @@ _MANIFEST = {
         "BAM record with a name but no sequence (validation must reject).",
     "noqual.bam":
         "BAM record with a sequence but absent qualities (validation rejects).",
+    "modified.bam":
+        "2 reads (CACGCATCGC as sequenced) with CB, MM/ML (5mC at 0, 4, 9), MN, "
+        "OQ and NM tags; mod_rev is stored reverse complemented (flag 16).",
+    "modified.sam":
+        "Plain-text SAM twin of modified.bam.",
 }
 
 
@@ -324,6 +374,7 @@ def generate(out_dir):
     # Core valid objects, built from the shared conftest builders.
     write_fastq(p("reads.fastq"), default_fastq_records())
     write_fastq(p("reads.fastq.gz"), default_fastq_records(), gzipped=True)
+    write_bgzf_fastq(p("reads_bgzf.fastq.gz"), default_fastq_records())
     _write_bam_with_sam(p("reads.bam"), default_bam_specs())
     _write_bam_with_sam(p("barcoded.bam"), barcoded_bam_specs())
 
@@ -342,6 +393,7 @@ def generate(out_dir):
 
     # Crafted BAMs (tag variants and incomplete records).
     write_crafted_bams(out_dir)
+    write_modified_bam(p("modified.bam"))
 
     # Manifest describing each artifact.
     with open(p("MANIFEST.txt"), "w") as f:
@@ -0,0 +1,165 @@
+"""Tests for bamurai.bgzf: BGZF detection and multi-threaded inflation and deflation."""
+
+import gzip
+import io
+
+import pysam
+import pytest
+
+from bamurai.bgzf import BgzfReader, BgzfWriter, BGZF_BLOCK_DATA_SIZE, is_bgzf, virtual_offset
+from bamurai.core import parse_reads
+from bamurai.fastq import open_fastq
+from conftest import data_path
+
+
+class TestIsBgzf:
+    @pytest.mark.parametrize("name", ["reads_bgzf.fastq.gz", "reads.bam"])
+    def test_bgzf_files(self, name):
+        assert is_bgzf(data_path(name))
+
+    @pytest.mark.parametrize("name", ["reads.fastq.gz", "reads.fastq", "empty.fastq"])
+    def test_other_files(self, name):
+        assert not is_bgzf(data_path(name))
+
+
+class TestBgzfReader:
+    @pytest.mark.parametrize("threads", [1, 2, 8])
+    def test_matches_gzip(self, threads):
+        path = data_path("reads_bgzf.fastq.gz")
+        with BgzfReader(path, threads=threads) as reader:
+            data = io.BufferedReader(reader).read()
+        with gzip.open(path, "rb") as f:
+            assert data == f.read()
+
+    def test_small_reads_cross_blocks(self):
+        path = data_path("reads_bgzf.fastq.gz")
+        chunks = []
+        with BgzfReader(path, threads=2) as reader:
+            while True:
+                chunk = reader.read(7)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        with open(data_path("reads.fastq"), "rb") as f:
+            assert b"".join(chunks) == f.read()
+
+    def test_rejects_plain_gzip(self):
+        with pytest.raises(ValueError, match="BGZF"):
+            BgzfReader(data_path("reads.fastq.gz"), threads=2)
+
+    def test_blocks_give_virtual_offsets(self, tmp_path):
+        path = tmp_path / "data.gz"
+        payload = bytes(range(256)) * 1000
+        with BgzfWriter(str(path)) as writer:
+            writer.write(payload)
+        with BgzfReader(str(path), threads=2) as reader:
+            blocks = list(reader.blocks())
+        assert b"".join(data for _, data in blocks) == payload
+        offsets = [offset for offset, _ in blocks]
+        assert len(blocks) > 2
+        assert offsets[0] == 0
+        assert offsets == sorted(offsets)
+        assert all(offset & 0xffff == 0 for offset in offsets)
+
+    def test_start_at_virtual_offset(self, tmp_path):
+        path = tmp_path / "data.gz"
+        payload = bytes(range(256)) * 1000
+        with BgzfWriter(str(path)) as writer:
+            writer.write(payload)
+        with BgzfReader(str(path), threads=2) as reader:
+            second_block = list(reader.blocks())[1][0]
+        start = virtual_offset(second_block >> 16, 100)
+        with BgzfReader(str(path), threads=2, start=start) as reader:
+            assert io.BufferedReader(reader).read() == payload[BGZF_BLOCK_DATA_SIZE + 100:]
+
+
+class TestBgzfWriter:
+    def _payload(self):
+        # several blocks' worth of FASTQ, ending part-way through a block
+        with open(data_path("reads.fastq"), "rb") as f:
+            return f.read() * (3 * BGZF_BLOCK_DATA_SIZE // 1000)
+
+    @pytest.mark.parametrize("threads", [1, 4])
+    def test_readable_by_gzip(self, tmp_path, threads):
+        out = tmp_path / "out.fastq.gz"
+        data = self._payload()
+        with BgzfWriter(str(out), threads=threads) as writer:
+            writer.write(data[:100])
+            writer.write(data[100:])
+        assert is_bgzf(str(out))
+        with gzip.open(out, "rb") as f:
+            assert f.read() == data
+        with BgzfReader(str(out), threads=2) as reader:
+            assert io.BufferedReader(reader).read() == data
+
+    def test_output_independent_of_threads(self, tmp_path):
+        data = self._payload()
+        outputs = []
+        for threads in (1, 3):
+            out = tmp_path / f"out_{threads}.gz"
+            with BgzfWriter(str(out), threads=threads, level=1) as writer:
+                writer.write(data)
+            outputs.append(out.read_bytes())
+        assert outputs[0] == outputs[1]
+
+    def test_ends_with_eof_block(self, tmp_path):
+        out = tmp_path / "empty.gz"
+        BgzfWriter(str(out)).close()
+        assert out.read_bytes() == bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+    def test_indexable_by_htslib(self, tmp_path):
+        out = tmp_path / "out.fastq.gz"
+        with BgzfWriter(str(out), threads=2) as writer:
+            writer.write(self._payload())
+        pysam.fqidx(str(out))
+        assert (tmp_path / "out.fastq.gz.fai").exists()
+        assert (tmp_path / "out.fastq.gz.gzi").exists()
+
+    def test_copy_blocks(self, tmp_path):
+        data = self._payload()
+        src = tmp_path / "src.gz"
+        with BgzfWriter(str(src)) as writer:
+            writer.write(data)
+        # every block but the end-of-file marker
+        blocks = src.read_bytes()[:-28]
+        out = tmp_path / "out.gz"
+        with BgzfWriter(str(out)) as writer, open(src, "rb") as f:
+            writer.write(b"head")
+            writer.finish_block()
+            size = writer.compressed_size
+            writer.copy_blocks(f.fileno(), 0, len(blocks))
+            assert writer.compressed_size == size + len(blocks)
+            writer.write(b"tail")
+        with gzip.open(out, "rb") as f:
+            assert f.read() == b"head" + data + b"tail"
+
+    def test_invalid_level(self, tmp_path):
+        with pytest.raises(ValueError, match="Compression level"):
+            BgzfWriter(str(tmp_path / "out.gz"), level=10)
+
+
+class TestOpenFastq:
+    def test_bgzf_uses_thread_pool(self):
+        with open_fastq(data_path("reads_bgzf.fastq.gz"), threads=4) as f:
+            assert isinstance(f.raw, BgzfReader)
+
+    def test_single_thread_falls_back_to_gzip(self):
+        with open_fastq(data_path("reads_bgzf.fastq.gz"), threads=1) as f:
+            assert isinstance(f, gzip.GzipFile)
+
+    def test_plain_gzip_falls_back_to_gzip(self):
+        with open_fastq(data_path("reads.fastq.gz"), threads=4) as f:
+            assert isinstance(f, gzip.GzipFile)
+
+    def test_text_mode(self):
+        with open_fastq(data_path("reads_bgzf.fastq.gz"), "rt", threads=4) as f:
+            assert f.readline() == "@read_0\n"
+
+    def test_invalid_mode(self, fastq_file):
+        with pytest.raises(ValueError, match="Unsupported mode"):
+            open_fastq(fastq_file, "wb")
+
+    @pytest.mark.parametrize("threads", [1, 4])
+    def test_parse_reads_bgzf(self, fastq_file, threads):
+        reads = list(parse_reads(data_path("reads_bgzf.fastq.gz"), threads=threads))
+        assert reads == list(parse_reads(fastq_file))
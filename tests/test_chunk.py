@@ -1,10 +1,18 @@
-"""Tests for bamurai.chunk: size-based file chunking."""
+"""Tests for bamurai.chunk: size-based file chunking and division into parts."""
 
 import glob
+import gzip
 import os
 
+import pysam
+import pytest
+
+import bamurai.chunk
 from bamurai.core import parse_reads
-from bamurai.chunk import chunk_reads, do_chunk
+from bamurai.chunk import chunk_reads, do_chunk, do_chunk_parts
+from bamurai.index import build_index, write_index
+from bamurai.bgzf import BgzfWriter, is_bgzf
+from conftest import data_path, make_sequence, make_qualities, qual_ints_to_ascii, write_bam, write_fastq
 
 
 class TestChunkReads:
@@ -52,9 +60,269 @@ class TestChunkReads:
         total = sum(len(list(parse_reads(c))) for c in chunks)
         assert total == 5
 
+    def test_chunks_concatenate_to_input(self, fastq_file, tmp_path):
+        prefix = str(tmp_path / "chunk")
+        do_chunk(fastq_file, chunk_size=400, output_prefix=prefix)
+        chunks = sorted(glob.glob(f"{prefix}_*.fastq"), key=lambda c: int(c.rsplit("_", 1)[1].split(".")[0]))
+        with open(fastq_file, "rb") as f:
+            assert b"".join(open(c, "rb").read() for c in chunks) == f.read()
+        # every chunk but the last reaches the requested size
+        assert all(os.path.getsize(c) >= 400 for c in chunks[:-1])
+
+    def test_compressed_chunks(self, fastq_file, tmp_path):
+        prefix = str(tmp_path / "chunk")
+        do_chunk(fastq_file, chunk_size=400, output_prefix=prefix, compress=True, threads=2)
+        chunks = sorted(glob.glob(f"{prefix}_*.fastq.gz"))
+        assert len(chunks) > 1
+        assert all(is_bgzf(c) for c in chunks)
+        assert sum(len(list(parse_reads(c))) for c in chunks) == 5
+
     def test_bam_input_chunked_to_fastq(self, bam_file, tmp_path):
         prefix = str(tmp_path / "chunk")
         do_chunk(bam_file, chunk_size=100, output_prefix=prefix)
         chunks = sorted(glob.glob(f"{prefix}_*.fastq"))
         total = sum(len(list(parse_reads(c))) for c in chunks)
         assert total == 5  # primary reads only
+
+
+def _chunk_files(prefix, extension=".fastq"):
+    return sorted(glob.glob(f"{prefix}_*{extension}"), key=lambda c: int(c.rsplit("_", 1)[1].split(".")[0]))
+
+
+class TestRawChunking:
+    def test_uncompressed_copy_does_not_parse(self, fastq_file, tmp_path, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError("reads parsed")
+
+        monkeypatch.setattr(bamurai.chunk, "parse_reads", fail)
+        monkeypatch.setattr(bamurai.chunk, "open_fastq", fail)
+        prefix = str(tmp_path / "chunk")
+        do_chunk(fastq_file, chunk_size=400, output_prefix=prefix)
+        with open(fastq_file, "rb") as f:
+            assert b"".join(open(c, "rb").read() for c in _chunk_files(prefix)) == f.read()
+
+    @pytest.mark.parametrize("chunk_size", [1, 100, 400, 10**6])
+    def test_gzipped_input_chunks_like_uncompressed(self, fastq_file, fastq_gz_file, tmp_path, chunk_size):
+        plain, gzipped = str(tmp_path / "plain"), str(tmp_path / "gzipped")
+        do_chunk(fastq_file, chunk_size=chunk_size, output_prefix=plain)
+        do_chunk(fastq_gz_file, chunk_size=chunk_size, output_prefix=gzipped)
+        plain_chunks, gzipped_chunks = _chunk_files(plain), _chunk_files(gzipped)
+        assert len(plain_chunks) == len(gzipped_chunks)
+        if chunk_size == 1:
+            assert len(plain_chunks) == 5
+        for a, b in zip(plain_chunks, gzipped_chunks):
+            assert open(a, "rb").read() == open(b, "rb").read()
+
+    @pytest.mark.parametrize("compress", [False, True])
+    def test_zero_size_gives_one_read_per_chunk(self, fastq_file, fastq_gz_file, tmp_path, compress):
+        for name, read_file in (("plain", fastq_file), ("gzipped", fastq_gz_file)):
+            prefix = str(tmp_path / name)
+            do_chunk(read_file, chunk_size=0, output_prefix=prefix, compress=compress)
+            chunks = _chunk_files(prefix, ".fastq.gz" if compress else ".fastq")
+            assert [len(list(parse_reads(c))) for c in chunks] == [1] * 5
+
+    def test_records_copied_unchanged(self, tmp_path):
+        # separator lines repeating the ID, CRLF line endings and trailing
+        # whitespace survive chunking
+        data = b"@r1 desc\r\nACGT\r\n+r1 desc\r\nIIII \r\n@r2\r\nAC\r\n+\r\nII\t \r\n"
+        path = tmp_path / "crlf.fastq"
+        path.write_bytes(data)
+        for compress in (False, True):
+            prefix = str(tmp_path / f"chunk{compress}")
+            do_chunk(str(path), chunk_size=10, output_prefix=prefix, compress=compress)
+            chunks = _chunk_files(prefix, ".fastq.gz" if compress else ".fastq")
+            opener = gzip.open if compress else open
+            second = data.index(b"@r2")
+            assert [opener(c, "rb").read() for c in chunks] == [data[:second], data[second:]]
+
+    def test_empty_file(self, tmp_path):
+        prefix = str(tmp_path / "chunk")
+        do_chunk(data_path("empty.fastq"), chunk_size=100, output_prefix=prefix)
+        assert _chunk_files(prefix) == []
+
+
+def _bam_records(path):
+    with pysam.AlignmentFile(path, "rb", check_sq=False) as bam:
+        return str(bam.header), [read.to_string() for read in bam]
+
+
+def _tagged_specs(n=3000):
+    return [{"name": f"r{i}", "sequence": make_sequence(150, seed=i), "quals": make_qualities(150, value=20 + i % 20),
+             "tags": [("CB", f"AAAC{i % 7}", "Z"), ("UB", f"GG{i}", "Z")]} for i in range(n)]
+
+
+@pytest.fixture
+def tagged_bam_file(tmp_path):
+    """A tagged unaligned BAM file written by htslib, spanning many BGZF blocks."""
+    return write_bam(tmp_path / "tagged.bam", _tagged_specs())
+
+
+class TestBamChunking:
+    def _chunk(self, bam_path, tmp_path, chunk_size):
+        prefix = str(tmp_path / "chunk")
+        do_chunk(bam_path, chunk_size=chunk_size, output_prefix=prefix, bam=True)
+        return _chunk_files(prefix, ".bam")
+
+    def _check_chunks(self, bam_path, chunks):
+        header, records = _bam_records(bam_path)
+        chunked = []
+        for chunk in chunks:
+            chunk_header, chunk_records = _bam_records(chunk)
+            assert chunk_header == header
+            assert chunk_records
+            chunked += chunk_records
+        assert chunked == records
+
+    def test_chunks_hold_header_and_records(self, tagged_bam_file, tmp_path):
+        chunks = self._chunk(tagged_bam_file, tmp_path, 5_000)
+        assert len(chunks) > 2
+        self._check_chunks(tagged_bam_file, chunks)
+        # the size applies to the compressed chunks; each but the last goes past
+        # it by less than a block
+        assert all(5_000 <= os.path.getsize(c) < 5_000 + 65_536 for c in chunks[:-1])
+
+    def test_blocks_copied_unchanged(self, tagged_bam_file, tmp_path, monkeypatch):
+        copied = []
+        copy_blocks = BgzfWriter.copy_blocks
+
+        def spy(self, src_fd, offset, count):
+            copied.append(count)
+            copy_blocks(self, src_fd, offset, count)
+
+        monkeypatch.setattr(BgzfWriter, "copy_blocks", spy)
+        chunks = self._chunk(tagged_bam_file, tmp_path, 5_000)
+        assert len(chunks) > 2
+        # htslib blocks start at records, so all but the header is copied
+        with open(tagged_bam_file, "rb") as f:
+            data = f.read()
+        for chunk in chunks:
+            with open(chunk, "rb") as f:
+                chunk_data = f.read()
+            # the header block is BSIZE + 1 bytes, and the end-of-file marker 28
+            header_block = int.from_bytes(chunk_data[16:18], "little") + 1
+            assert chunk_data[header_block:-28] in data
+        assert sum(copied) > 0.9 * os.path.getsize(tagged_bam_file)
+
+    def test_all_secondary_records_kept(self, bam_file, tmp_path):
+        chunks = self._chunk(bam_file, tmp_path, 1)
+        self._check_chunks(bam_file, chunks)
+        assert len(_bam_records(chunks[0])[1]) == 7
+
+    def test_records_straddling_blocks(self, tagged_bam_file, tmp_path):
+        # re-block the file so records run across block edges and the header
+        # shares a block with the first records
+        with pysam.AlignmentFile(tagged_bam_file, "rb", check_sq=False) as bam:
+            with pysam.AlignmentFile(str(tmp_path / "raw.bam"), "wbu", template=bam) as raw:
+                for read in bam:
+                    raw.write(read)
+        with gzip.open(tmp_path / "raw.bam", "rb") as f:
+            data = f.read()
+        reblocked = str(tmp_path / "reblocked.bam")
+        with BgzfWriter(reblocked) as writer:
+            writer.write(data[:100])
+            writer.finish_block()
+            writer.write(data[100:])
+        for chunk_size in (1, 5_000, 50_000):
+            for old in _chunk_files(str(tmp_path / "chunk"), ".bam"):
+                os.remove(old)
+            chunks = self._chunk(reblocked, tmp_path, chunk_size)
+            self._check_chunks(reblocked, chunks)
+
+    def test_empty_bam(self, tmp_path):
+        empty = write_bam(tmp_path / "empty.bam", [])
+        assert self._chunk(empty, tmp_path, 100) == []
+
+    def test_needs_bam_input(self, fastq_file, tmp_path):
+        with pytest.raises(ValueError, match="BAM file"):
+            do_chunk(fastq_file, 100, str(tmp_path / "chunk"), bam=True)
+
+
+def _varied_records(count=200):
+    records = []
+    for i in range(count):
+        length = 20 + (i * 37) % 400
+        records.append((f"r{i}", make_sequence(length, seed=i), qual_ints_to_ascii(make_qualities(length))))
+    return records
+
+
+@pytest.fixture
+def varied_fastq_file(tmp_path):
+    """A FASTQ file of 200 reads of 20 to 419 bases."""
+    return write_fastq(tmp_path / "varied.fastq", _varied_records())
+
+
+def _part_reads(prefix, parts, extension=".fastq"):
+    """Return the reads of each part, checking that exactly ``parts`` parts were written."""
+    files = _chunk_files(prefix, extension)
+    assert len(files) == parts
+    return [list(parse_reads(f)) for f in files]
+
+
+class TestChunkParts:
+    @pytest.mark.parametrize("parts", [1, 3, 4, 7])
+    def test_balanced_by_bases(self, varied_fastq_file, tmp_path, parts):
+        prefix = str(tmp_path / "part")
+        do_chunk_parts(varied_fastq_file, parts, prefix)
+        bases = [sum(len(read) for read in reads) for reads in _part_reads(prefix, parts)]
+        total = sum(len(seq) for _, seq, _ in _varied_records())
+        assert sum(bases) == total
+        # each part is within one read of an equal share
+        assert all(abs(b - total / parts) <= 419 for b in bases)
+        with open(varied_fastq_file, "rb") as f:
+            assert b"".join(open(c, "rb").read() for c in _chunk_files(prefix)) == f.read()
+
+    def test_balanced_by_records(self, varied_fastq_file, tmp_path):
+        prefix = str(tmp_path / "part")
+        do_chunk_parts(varied_fastq_file, 6, prefix, balance="records")
+        assert [len(reads) for reads in _part_reads(prefix, 6)] == [33, 34, 33, 33, 34, 33]
+
+    @pytest.mark.parametrize("compress", [False, True])
+    def test_gzipped_input_divides_like_uncompressed(self, varied_fastq_file, tmp_path, compress):
+        gzipped = write_fastq(tmp_path / "varied.fastq.gz", _varied_records(), gzipped=True)
+        do_chunk_parts(varied_fastq_file, 5, str(tmp_path / "plain"))
+        do_chunk_parts(gzipped, 5, str(tmp_path / "gzipped"), compress=compress)
+        extension = ".fastq.gz" if compress else ".fastq"
+        opener = gzip.open if compress else open
+        for a, b in zip(_chunk_files(str(tmp_path / "plain")), _chunk_files(str(tmp_path / "gzipped"), extension)):
+            assert open(a, "rb").read() == opener(b, "rb").read()
+
+    def test_bam_input(self, bam_file, tmp_path):
+        prefix = str(tmp_path / "part")
+        do_chunk_parts(bam_file, 2, prefix, balance="records")
+        parts = _part_reads(prefix, 2)
+        # primary alignments only, in input order
+        assert [len(reads) for reads in parts] == [2, 3]
+        assert [read.read_id for reads in parts for read in reads] == \
+            [read.read_id for read in parse_reads(bam_file)]
+
+    def test_more_parts_than_reads(self, fastq_file, tmp_path):
+        prefix = str(tmp_path / "part")
+        do_chunk_parts(fastq_file, 8, prefix, balance="records", compress=True)
+        parts = _part_reads(prefix, 8, ".fastq.gz")
+        assert sum(len(reads) for reads in parts) == 5
+        assert max(len(reads) for reads in parts) == 1
+
+    def test_empty_file(self, tmp_path):
+        prefix = str(tmp_path / "part")
+        do_chunk_parts(data_path("empty.fastq"), 3, prefix)
+        assert [os.path.getsize(f) for f in _chunk_files(prefix)] == [0, 0, 0]
+
+    def test_totals_from_index(self, varied_fastq_file, tmp_path, monkeypatch):
+        write_index(build_index(varied_fastq_file), varied_fastq_file)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("reads counted despite the index")
+
+        monkeypatch.setattr(bamurai.chunk, "iter_fastq_lengths", fail)
+        do_chunk_parts(varied_fastq_file, 6, str(tmp_path / "part"), balance="records")
+        assert [len(reads) for reads in _part_reads(str(tmp_path / "part"), 6)] == [33, 34, 33, 33, 34, 33]
+
+    def test_chunk_reads_dispatches_on_parts(self, fastq_file, tmp_path, make_args):
+        prefix = str(tmp_path / "part")
+        chunk_reads(make_args(reads=fastq_file, size=None, parts=2, balance="records", prefix=prefix))
+        assert [len(reads) for reads in _part_reads(prefix, 2)] == [2, 3]
+
+    @pytest.mark.parametrize("kwargs", [{"parts": 0}, {"parts": 2, "balance": "bytes"}])
+    def test_invalid_arguments(self, fastq_file, tmp_path, kwargs):
+        with pytest.raises(ValueError):
+            do_chunk_parts(fastq_file, output_prefix=str(tmp_path / "part"), **kwargs)
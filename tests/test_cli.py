@@ -5,10 +5,13 @@ command functions) rather than the command internals, which are covered
 elsewhere. Each test patches ``sys.argv`` and calls ``main()``.
 """
 
+import json
+import shutil
 import sys
 
 import pytest
 
+import bamurai.progress
 from bamurai.cli import main
 from conftest import data_path
 
@@ -29,6 +32,18 @@ class TestCliDispatch:
         out = capsys.readouterr().out
         assert out.startswith("file_name\t")
 
+    def test_stats_many_files(self, monkeypatch, capsys, fastq_file, bam_file):
+        _run(monkeypatch, ["stats", fastq_file, bam_file, "--tsv", "--workers", "2"])
+        lines = capsys.readouterr().out.strip().split("\n")
+        assert [line.split("\t")[:2] for line in lines[1:]] == [[fastq_file, "5"], [bam_file, "5"], ["all", "10"]]
+
+    def test_stats_summary_and_merge(self, monkeypatch, capsys, tmp_path, fastq_file, bam_file):
+        _run(monkeypatch, ["stats", fastq_file, "--summary", str(tmp_path / "a.json")])
+        _run(monkeypatch, ["stats", bam_file, "--summary", str(tmp_path / "b.json")])
+        capsys.readouterr()
+        _run(monkeypatch, ["stats", "--merge", str(tmp_path / "a.json"), str(tmp_path / "b.json")])
+        assert "Statistics for all 2 files:" in capsys.readouterr().out
+
     def test_split_to_output(self, monkeypatch, tmp_path, fastq_file):
         out = tmp_path / "split.fastq"
         _run(monkeypatch, ["split", fastq_file, "-l", "100", "-o", str(out)])
@@ -39,6 +54,12 @@ class TestCliDispatch:
         _run(monkeypatch, ["divide", fastq_file, "-n", "2", "-o", str(out)])
         assert out.exists()
 
+    def test_index(self, monkeypatch, capsys, tmp_path, fastq_file):
+        read_file = str(shutil.copy(fastq_file, tmp_path / "reads.fastq"))
+        _run(monkeypatch, ["index", read_file, "--interval", "2"])
+        assert "3 seek points" in capsys.readouterr().out
+        assert (tmp_path / "reads.fastq.bamurai.idx").exists()
+
     def test_validate(self, monkeypatch, capsys, fastq_file):
         _run(monkeypatch, ["validate", fastq_file])
         assert "valid FASTQ file" in capsys.readouterr().out
@@ -95,6 +116,128 @@ class TestCliSampleCommands:
         assert out.exists()
 
 
+class TestCliThreads:
+    def test_threads_option(self, monkeypatch, capsys, bam_file):
+        _run(monkeypatch, ["--threads", "2", "stats", bam_file])
+        assert "Total reads: 5" in capsys.readouterr().out
+
+    def test_threads_from_environment(self, monkeypatch, tmp_path, bam_file):
+        monkeypatch.setenv("BAMURAI_THREADS", "2")
+        out = tmp_path / "split.fastq"
+        _run(monkeypatch, ["split", bam_file, "-l", "100", "-o", str(out)])
+        assert out.exists()
+
+    def test_compressed_output(self, monkeypatch, tmp_path, fastq_file):
+        out = tmp_path / "split.fastq.gz"
+        _run(monkeypatch, ["--threads", "2", "split", fastq_file, "-l", "100", "-o", str(out), "--compression-level", "9"])
+        assert out.read_bytes()[:3] == b"\x1f\x8b\x08"
+
+    def test_compressed_chunks(self, monkeypatch, tmp_path, fastq_file):
+        prefix = str(tmp_path / "chunk")
+        _run(monkeypatch, ["chunk", fastq_file, "-s", "1K", "-p", prefix, "--compress"])
+        assert (tmp_path / "chunk_1.fastq.gz").exists()
+
+    def test_bam_chunks(self, monkeypatch, tmp_path, bam_file):
+        prefix = str(tmp_path / "chunk")
+        _run(monkeypatch, ["chunk", bam_file, "-s", "1K", "-p", prefix, "--bam"])
+        assert (tmp_path / "chunk_1.bam").exists()
+
+    def test_bam_chunks_need_bam_input(self, monkeypatch, capsys, tmp_path, fastq_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["chunk", fastq_file, "-s", "1K", "-p", str(tmp_path / "chunk"), "--bam"])
+        assert exc.value.code == 2
+        assert "--bam needs a BAM input file" in capsys.readouterr().err
+
+    def test_chunk_parts(self, monkeypatch, tmp_path, fastq_file):
+        prefix = str(tmp_path / "part")
+        _run(monkeypatch, ["chunk", fastq_file, "--parts", "3", "--balance", "records", "-p", prefix])
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["part_1.fastq", "part_2.fastq", "part_3.fastq"]
+
+    @pytest.mark.parametrize("options,message", [
+        ([], "one of --size and --parts"),
+        (["-s", "1K", "--parts", "2"], "one of --size and --parts"),
+        (["--parts", "0"], "--parts must be at least 1"),
+    ])
+    def test_chunk_size_or_parts(self, monkeypatch, capsys, fastq_file, options, message):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["chunk", fastq_file, *options])
+        assert exc.value.code == 2
+        assert message in capsys.readouterr().err
+
+    def test_chunk_parts_not_bam(self, monkeypatch, capsys, bam_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["chunk", bam_file, "--parts", "2", "--bam"])
+        assert exc.value.code == 2
+        assert "--parts cannot be used with --bam" in capsys.readouterr().err
+
+    def test_invalid_compression_level_rejected(self, monkeypatch, capsys, fastq_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["divide", fastq_file, "--compression-level", "12"])
+        assert exc.value.code == 2
+
+    def test_workers(self, monkeypatch, tmp_path, fastq_file):
+        out = tmp_path / "split.fastq"
+        _run(monkeypatch, ["split", fastq_file, "-l", "100", "-o", str(out), "--workers", "2"])
+        assert out.read_bytes().count(b"\n+\n") == 8
+
+    def test_invalid_workers_rejected(self, monkeypatch, capsys, fastq_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["divide", fastq_file, "--workers", "0"])
+        assert exc.value.code == 2
+        assert "--workers must be at least 1" in capsys.readouterr().err
+
+    def test_extended_merge_rejected(self, monkeypatch, capsys, tmp_path):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["stats", "--merge", "--extended", str(tmp_path / "a.json")])
+        assert exc.value.code == 2
+        assert "cannot be used with --merge" in capsys.readouterr().err
+
+    def test_invalid_interval_rejected(self, monkeypatch, capsys, fastq_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["index", fastq_file, "--interval", "0"])
+        assert exc.value.code == 2
+        assert "--interval must be at least 1" in capsys.readouterr().err
+
+    def test_invalid_threads_rejected(self, monkeypatch, capsys, bam_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["--threads", "0", "stats", bam_file])
+        assert exc.value.code == 2
+        assert "at least 1" in capsys.readouterr().err
+
+
+class TestCliProgress:
+    @pytest.fixture(autouse=True)
+    def progress_settings(self, monkeypatch):
+        settings = bamurai.progress.ProgressSettings()
+        monkeypatch.setattr(bamurai.progress, "_settings", settings)
+        yield settings
+        if settings.owns_stream:
+            settings.json_stream.close()
+
+    def test_progress_json(self, monkeypatch, tmp_path, fastq_file, progress_settings):
+        path = tmp_path / "progress.jsonl"
+        out = tmp_path / "split.fastq"
+        _run(monkeypatch, ["--no-progress", "--progress-json", str(path), "split", fastq_file, "-l", "100", "-o", str(out)])
+        assert not progress_settings.enabled
+        progress_settings.json_stream.flush()
+        end = json.loads(path.read_text().splitlines()[-1])
+        assert end["event"] == "end"
+        assert end["desc"] == "Splitting reads"
+        assert end["records"] == 5
+
+    def test_invalid_progress_interval_rejected(self, monkeypatch, capsys, fastq_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["--progress-interval", "0", "stats", fastq_file])
+        assert exc.value.code == 2
+        assert "--progress-interval must be positive" in capsys.readouterr().err
+
+    def test_unopenable_progress_json_rejected(self, monkeypatch, capsys, tmp_path, fastq_file):
+        with pytest.raises(SystemExit) as exc:
+            _run(monkeypatch, ["--progress-json", str(tmp_path / "missing" / "p.jsonl"), "stats", fastq_file])
+        assert exc.value.code == 2
+        assert "cannot open --progress-json" in capsys.readouterr().err
+
+
 class TestCliMeta:
     def test_version(self, monkeypatch, capsys):
         with pytest.raises(SystemExit) as exc:
@@ -1,14 +1,20 @@
-"""Tests for bamurai.core: the Read dataclass and parsing primitives."""
+"""Tests for bamurai.core: the Read class and parsing primitives."""
 
+import numpy as np
 import pytest
 
 from bamurai.core import (
     Read,
+    ReadBatch,
     qual_to_fastq_numpy,
+    phred_to_fastq,
+    fastq_to_phred,
     parse_reads,
+    parse_read_batches,
+    iter_bam_lengths,
     split_read,
 )
-from conftest import make_sequence, make_qualities, qual_ints_to_ascii
+from conftest import data_path, make_sequence, make_qualities, qual_ints_to_ascii, write_unaligned_cram
 
 
 # ---------------------------------------------------------------------------
@@ -41,6 +47,45 @@ class TestRead:
         read = Read("r1", "ACGT", "IIII")
         assert read.to_fastq() == "@r1\nACGT\n+\nIIII"
 
+    def test_slotted(self):
+        read = Read("r1", "ACGT", "IIII")
+        assert not hasattr(read, "__dict__")
+        with pytest.raises(AttributeError):
+            read.extra = 1
+
+    def test_validate_false_skips_check(self):
+        read = Read("bad", "ACGT", "II", validate=False)
+        assert not read.is_valid()
+
+    def test_bytes_backed(self):
+        read = Read("r1", b"ACGT", b"IIII")
+        assert len(read) == 4
+        assert read.to_fastq() == "@r1\nACGT\n+\nIIII"
+        assert read.to_fastq_bytes() == b"@r1\nACGT\n+\nIIII\n"
+
+    def test_memoryview_backed(self):
+        buffer = b"xxACGTxx"
+        read = Read("r1", memoryview(buffer)[2:6], memoryview(b"IIII"))
+        assert read.to_fastq_bytes() == b"@r1\nACGT\n+\nIIII\n"
+
+    def test_bytes_backed_mismatch_raises(self):
+        with pytest.raises(ValueError, match="equal length"):
+            Read("bad", b"ACGT", b"II")
+
+    def test_to_fastq_bytes_from_str(self):
+        assert Read("r1", "ACGT", "IIII").to_fastq_bytes() == b"@r1\nACGT\n+\nIIII\n"
+
+    def test_raw_quality_converted_on_output(self):
+        read = Read("r1", b"ACGT", bytes([0, 30, 40, 40]), raw_quality=True)
+        assert read.to_fastq_bytes() == b"@r1\nACGT\n+\n!?II\n"
+        assert read.to_fastq() == "@r1\nACGT\n+\n!?II"
+        assert read.quality == bytes([0, 30, 40, 40])
+
+    def test_phred_quality(self):
+        assert Read("r1", "ACG", "!?I").phred_quality() == bytes([0, 30, 40])
+        raw = Read("r1", "ACG", bytes([0, 30, 40]), raw_quality=True)
+        assert raw.phred_quality() == bytes([0, 30, 40])
+
 
 # ---------------------------------------------------------------------------
 # qual_to_fastq_numpy
@@ -58,6 +103,15 @@ class TestQualConversion:
         quals = make_qualities(20, value=25)
         assert qual_to_fastq_numpy(quals) == qual_ints_to_ascii(quals)
 
+    def test_phred_to_fastq(self):
+        quals = make_qualities(20, value=25)
+        assert phred_to_fastq(quals) == qual_ints_to_ascii(quals).encode()
+        assert phred_to_fastq(memoryview(bytes([0, 30, 40]))) == b"!?I"
+
+    def test_fastq_to_phred_roundtrip(self):
+        assert fastq_to_phred("!?I") == bytes([0, 30, 40])
+        assert phred_to_fastq(fastq_to_phred(b"!?I")) == b"!?I"
+
 
 # ---------------------------------------------------------------------------
 # split_read
@@ -96,6 +150,22 @@ class TestSplitRead:
         assert [r.sequence for r in result] == ["AA", "BB", "CC", "DD"]
         assert [r.read_id for r in result] == ["r1_0", "r1_1", "r1_2", "r1_3"]
 
+    def test_bytes_read_fragments_are_views(self):
+        read = Read("r1", b"AAAACCCC", b"IIIIJJJJ")
+        result = split_read(read, at=[4])
+        assert all(isinstance(r.sequence, memoryview) for r in result)
+        assert [r.sequence.obj for r in result] == [read.sequence, read.sequence]
+        assert [bytes(r.quality) for r in result] == [b"IIII", b"JJJJ"]
+        assert [r.to_fastq_bytes() for r in result] == [
+            b"@r1_0\nAAAA\n+\nIIII\n", b"@r1_1\nCCCC\n+\nJJJJ\n",
+        ]
+
+    def test_raw_quality_kept_in_fragments(self):
+        read = Read("r1", b"AACC", bytes([0, 0, 40, 40]), raw_quality=True)
+        result = split_read(read, at=[2])
+        assert all(r.raw_quality for r in result)
+        assert [r.to_fastq_bytes() for r in result] == [b"@r1_0\nAA\n+\n!!\n", b"@r1_1\nCC\n+\nII\n"]
+
     def test_fragments_cover_full_read(self):
         read = Read("r1", make_sequence(100), qual_ints_to_ascii(make_qualities(100)))
         result = split_read(read, at=[25, 50, 75])
@@ -126,6 +196,23 @@ class TestParseReadsFastq:
     def test_fastq_all_valid(self, fastq_file):
         assert all(r.is_valid() for r in parse_reads(fastq_file))
 
+    def test_fastq_undecoded(self, fastq_file):
+        reads = list(parse_reads(fastq_file, engine="block", decode=False))
+        assert isinstance(reads[0].read_id, str)
+        assert isinstance(reads[0].sequence, bytes)
+        assert [r.to_fastq() for r in reads] == [r.to_fastq() for r in parse_reads(fastq_file)]
+
+    def test_fastq_undecoded_mmap(self, fastq_file):
+        reads = list(parse_reads(fastq_file, engine="mmap", decode=False))
+        assert isinstance(reads[0].sequence, memoryview)
+        assert [r.to_fastq() for r in reads] == [r.to_fastq() for r in parse_reads(fastq_file)]
+
+    def test_fastq_validation_can_be_disabled(self):
+        with pytest.raises(ValueError, match="equal length"):
+            list(parse_reads(data_path("length_mismatch.fastq")))
+        reads = list(parse_reads(data_path("length_mismatch.fastq"), validate=False))
+        assert len(reads) == 1 and not reads[0].is_valid()
+
 
 class TestParseReadsBam:
     def test_primary_only(self, bam_file):
@@ -144,3 +231,137 @@ class TestParseReadsBam:
         # First read built with quality value 30 -> '?'
         reads = list(parse_reads(bam_file))
         assert reads[0].quality[0] == "?"
+
+    def test_undecoded_keeps_raw_phred(self, bam_file):
+        raw = list(parse_reads(bam_file, decode=False))
+        assert raw[0].raw_quality
+        assert raw[0].quality[0] == 30
+        assert isinstance(raw[0].sequence, bytes)
+        assert [r.to_fastq() for r in raw] == [r.to_fastq() for r in parse_reads(bam_file)]
+
+    def test_threaded_matches_single_threaded(self, bam_file):
+        assert list(parse_reads(bam_file, threads=4)) == list(parse_reads(bam_file))
+        batches = parse_read_batches(bam_file, threads=4)
+        assert [r for b in batches for r in b] == list(parse_reads(bam_file))
+
+
+# ---------------------------------------------------------------------------
+# ReadBatch and parse_read_batches
+# ---------------------------------------------------------------------------
+
+class TestReadBatch:
+    def _batch(self):
+        return ReadBatch.from_records([b"r1", b"read2"], [b"ACGT", b"GG"], [b"IIII", b"!!"])
+
+    def test_columnar_layout(self):
+        batch = self._batch()
+        assert batch.names == b"r1read2"
+        assert batch.sequences == b"ACGTGG"
+        assert batch.qualities == b"IIII!!"
+        assert batch.name_offsets.tolist() == [0, 2, 7]
+        assert batch.offsets.tolist() == [0, 4, 6]
+        assert batch.lengths.tolist() == [4, 2]
+        assert batch.offsets.dtype == np.int64
+        assert batch.lengths.dtype == np.int64
+
+    def test_len_and_total_bases(self):
+        batch = self._batch()
+        assert len(batch) == 2
+        assert batch.total_bases == 6
+
+    def test_iter_yields_reads(self):
+        assert list(self._batch()) == [Read("r1", "ACGT", "IIII"), Read("read2", "GG", "!!")]
+
+    def test_to_fastq(self):
+        assert self._batch().to_fastq() == b"@r1\nACGT\n+\nIIII\n@read2\nGG\n+\n!!\n"
+
+    def test_mismatched_lengths_raise(self):
+        with pytest.raises(ValueError, match="Offending read: bad"):
+            ReadBatch.from_records([b"ok", b"bad"], [b"AC", b"ACGT"], [b"II", b"II"])
+
+    def test_fragments(self):
+        batch = self._batch()
+        fragments = batch.fragments(np.array([0, 1, 3, 0]), np.array([1, 3, 4, 2]), np.array([3, 1]))
+        assert list(fragments) == split_read(Read("r1", "ACGT", "IIII"), at=[1, 3]) + split_read(Read("read2", "GG", "!!"), at=[])
+        assert fragments.sequences is batch.sequences
+
+    def test_fragments_keep_raw_qualities(self):
+        batch = ReadBatch.from_records([b"r1"], [b"AC"], [bytes([0, 40])], raw_quality=True)
+        fragments = batch.fragments(np.array([0, 1]), np.array([1, 2]), np.array([2]))
+        assert fragments.to_fastq() == b"@r1_0\nA\n+\n!\n@r1_1\nC\n+\nI\n"
+
+
+class TestParseReadBatches:
+    @pytest.mark.parametrize("name", ["reads.fastq", "reads.fastq.gz", "reads.bam", "reads.sam"])
+    def test_matches_parse_reads(self, name):
+        path = data_path(name)
+        batched = [read for batch in parse_read_batches(path) for read in batch]
+        assert batched == list(parse_reads(path))
+
+    @pytest.mark.parametrize("name", ["reads.fastq", "reads.bam"])
+    def test_batch_size(self, name):
+        batches = list(parse_read_batches(data_path(name), batch_size=2))
+        assert [len(b) for b in batches] == [2, 2, 1]
+        lengths = np.concatenate([b.lengths for b in batches])
+        assert lengths.tolist() == [50, 120, 250, 80, 300]
+
+    @pytest.mark.parametrize("name,engine", [("reads.fastq", "block"), ("reads.fastq", "mmap"),
+                                             ("reads.fastq.gz", "auto"), ("reads.bam", "auto")])
+    def test_max_bases(self, name, engine):
+        # a batch ends with the read that takes it to max_bases
+        batches = list(parse_read_batches(data_path(name), engine=engine, max_bases=100))
+        assert [b.lengths.tolist() for b in batches] == [[50, 120], [250], [80, 300]]
+
+    def test_bam_qualities_kept_raw(self, bam_file):
+        batch = next(parse_read_batches(bam_file))
+        assert batch.raw_quality
+        assert batch.qualities[0] == 30
+        assert batch.fastq_qualities()[:1] == b"?"
+
+    def test_bam_batch_to_fastq_matches_reads(self, bam_file):
+        batch = next(parse_read_batches(bam_file))
+        assert batch.to_fastq() == b"".join(r.to_fastq_bytes() for r in parse_reads(bam_file))
+        assert batch.read(0, decode=False).raw_quality
+
+    def test_bam_incomplete_records_skipped(self):
+        assert list(parse_read_batches(data_path("noqual.bam"))) == []
+
+    def test_empty_fastq(self):
+        assert list(parse_read_batches(data_path("empty.fastq"))) == []
+
+    def test_invalid_batch_size(self, fastq_file):
+        with pytest.raises(ValueError, match="batch_size"):
+            list(parse_read_batches(fastq_file, batch_size=0))
+        with pytest.raises(ValueError, match="max_bases"):
+            list(parse_read_batches(fastq_file, max_bases=0))
+
+    @pytest.mark.parametrize("name,engine", [("reads.fastq", "block"), ("reads.fastq", "mmap"),
+                                             ("reads.fastq.gz", "auto"), ("reads.bam", "auto")])
+    def test_limit(self, name, engine):
+        batches = list(parse_read_batches(data_path(name), batch_size=2, engine=engine, limit=3))
+        assert np.concatenate([b.lengths for b in batches]).tolist() == [50, 120, 250]
+
+    @pytest.mark.parametrize("engine", ["block", "mmap"])
+    def test_start_at_byte_offset(self, fastq_file, engine):
+        with open(fastq_file, "rb") as f:
+            start = f.read().index(b"@read_3")
+        batches = list(parse_read_batches(fastq_file, engine=engine, start=start, limit=2))
+        assert [b.read_id(i) for b in batches for i in range(len(b))] == ["read_3", "read_4"]
+
+
+class TestIterBamLengths:
+    @pytest.mark.parametrize("name", ["reads.bam", "reads.sam"])
+    def test_primary_lengths(self, name):
+        batches = list(iter_bam_lengths(data_path(name), batch_size=2))
+        assert [len(b) for b in batches] == [2, 2, 1]
+        assert np.concatenate(batches).tolist() == [50, 120, 250, 80, 300]
+
+    def test_unaligned_cram(self, tmp_path):
+        cram = write_unaligned_cram(tmp_path / "reads.cram")
+        assert np.concatenate(list(iter_bam_lengths(cram))).tolist() == [50, 120, 250, 80, 300]
+
+    def test_missing_sequence_skipped(self):
+        assert list(iter_bam_lengths(data_path("noseq.bam"))) == []
+
+    def test_missing_qualities_counted(self):
+        assert [b.tolist() for b in iter_bam_lengths(data_path("noqual.bam"))] == [[8]]
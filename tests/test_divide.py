@@ -1,7 +1,12 @@
 """Tests for bamurai.divide: fixed-fragment-count splitting."""
 
-from bamurai.core import Read, parse_reads
-from bamurai.divide import calculate_split_pieces, divide_reads
+import functools
+
+import numpy as np
+
+import bamurai.index
+from bamurai.core import Read, parse_reads, parse_read_batches
+from bamurai.divide import calculate_split_pieces, calculate_split_pieces_batch, divide_reads
 from conftest import make_sequence, make_qualities, qual_ints_to_ascii
 
 
@@ -29,6 +34,20 @@ class TestCalculateSplitPieces:
         assert calculate_split_pieces(_read(101), num_pieces=3) == [33, 66]
 
 
+class TestCalculateSplitPiecesBatch:
+    def test_matches_per_read(self):
+        lengths = [1, 2, 100, 101, 149, 150, 151, 999]
+        starts, ends, counts = calculate_split_pieces_batch(np.array(lengths), num_pieces=3, min_length=50)
+        expected_starts, expected_ends = [], []
+        for length in lengths:
+            bounds = [0, *calculate_split_pieces(_read(length), num_pieces=3, min_length=50), length]
+            expected_starts += bounds[:-1]
+            expected_ends += bounds[1:]
+        assert starts.tolist() == expected_starts
+        assert ends.tolist() == expected_ends
+        assert counts.tolist() == [1, 1, 1, 1, 1, 3, 3, 3]
+
+
 class TestDivideReadsIntegration:
     def test_each_read_divided(self, fastq_file, tmp_path, make_args):
         out = tmp_path / "divide.fastq"
@@ -57,3 +76,10 @@ class TestDivideReadsIntegration:
         divide_reads(args)
         out_bases = sum(len(r) for r in parse_reads(str(out)))
         assert in_bases == out_bases
+
+    def test_workers_output_identical(self, fastq_file, tmp_path, make_args, monkeypatch):
+        monkeypatch.setattr(bamurai.index, "parse_read_batches", functools.partial(parse_read_batches, batch_size=2))
+        single, multi = tmp_path / "single.fastq", tmp_path / "multi.fastq"
+        divide_reads(make_args(reads=fastq_file, num_fragments=3, min_length=30, output=str(single)))
+        divide_reads(make_args(reads=fastq_file, num_fragments=3, min_length=30, output=str(multi), workers=2))
+        assert multi.read_bytes() == single.read_bytes()
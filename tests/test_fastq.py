@@ -0,0 +1,285 @@
+"""Tests for bamurai.fastq: the block-buffered and memory-mapped FASTQ parsers and the writer."""
+
+import gzip
+import io
+
+import numpy as np
+import pytest
+
+from bamurai.core import Read, ReadBatch, parse_reads
+from bamurai.core import parse_read_batches
+from bamurai.fastq import (
+    FastqWriter,
+    iter_fastq_lines,
+    iter_fastq_records,
+    iter_fastq_records_mmap,
+    iter_fastq_views,
+    iter_fastq_lengths,
+    find_record_start,
+    gather_spans,
+)
+from conftest import data_path, default_fastq_records
+
+
+def _expected_bytes():
+    return [
+        (read_id.encode(), seq.encode(), qual.encode())
+        for read_id, seq, qual in default_fastq_records()
+    ]
+
+
+class TestIterFastqLines:
+    def test_lines_grouped_in_whole_records(self):
+        handle = io.BytesIO(b"@a\nAC\n+\nII\n@b\nG\n+\nI\n")
+        blocks = list(iter_fastq_lines(handle, block_size=5))
+        assert all(len(lines) % 4 == 0 for lines in blocks)
+        assert sum(blocks, []) == [b"@a", b"AC", b"+", b"II", b"@b", b"G", b"+", b"I"]
+
+    def test_missing_final_newline(self):
+        handle = io.BytesIO(b"@a\nAC\n+\nII")
+        assert sum(iter_fastq_lines(handle), []) == [b"@a", b"AC", b"+", b"II"]
+
+    def test_truncated_record_padded(self):
+        handle = io.BytesIO(b"@a\nAC\n")
+        assert sum(iter_fastq_lines(handle), []) == [b"@a", b"AC", b"", b""]
+
+    def test_crlf_split_across_blocks(self):
+        # block_size=3 puts a '\r' at the end of the first block and its '\n'
+        # at the start of the next.
+        handle = io.BytesIO(b"@a\r\nAC\r\n+\r\nII\r\n")
+        assert sum(iter_fastq_lines(handle, block_size=3), []) == [b"@a", b"AC", b"+", b"II"]
+
+    def test_lines_stripped(self):
+        handle = io.BytesIO(b"@a \nAC\t\n+\nII \r\n@b\nG\n+\nI ")
+        assert sum(iter_fastq_lines(handle), []) == [b"@a", b"AC", b"+", b"II", b"@b", b"G", b"+", b"I"]
+
+
+class TestIterFastqRecords:
+    def test_plain(self, fastq_file):
+        assert list(iter_fastq_records(fastq_file)) == _expected_bytes()
+
+    def test_gzipped(self, fastq_gz_file):
+        assert list(iter_fastq_records(fastq_gz_file)) == _expected_bytes()
+
+    @pytest.mark.parametrize("block_size", [1, 7, 64, 1000])
+    def test_records_crossing_block_edges(self, fastq_file, block_size):
+        records = list(iter_fastq_records(fastq_file, block_size=block_size))
+        assert records == _expected_bytes()
+
+    def test_crlf_line_endings(self):
+        assert list(iter_fastq_records(data_path("crlf.fastq"))) == _expected_bytes()
+
+    def test_empty(self):
+        assert list(iter_fastq_records(data_path("empty.fastq"))) == []
+
+    @pytest.mark.parametrize("block_size", [1, 7, 1000])
+    def test_decoded(self, fastq_file, block_size):
+        assert list(iter_fastq_records(fastq_file, block_size=block_size, decode=True)) == default_fastq_records()
+
+    def test_non_ascii_decoded_across_block_edges(self, tmp_path):
+        path = tmp_path / "utf8.fastq"
+        path.write_bytes("@é1\nAC\n+\nII\n@é2\nG\n+\nI\n".encode())
+        assert list(iter_fastq_records(str(path), block_size=3, decode=True)) == [("é1", "AC", "II"), ("é2", "G", "I")]
+
+    def test_truncated_record_padded(self):
+        assert list(iter_fastq_records(data_path("truncated.fastq"))) == [(b"read1", b"", b"")]
+
+
+def _as_bytes(records):
+    return [tuple(bytes(field) for field in record) for record in records]
+
+
+class TestIterFastqMmap:
+    def test_plain(self, fastq_file):
+        assert _as_bytes(iter_fastq_records_mmap(fastq_file)) == _expected_bytes()
+
+    def test_fields_are_views(self, fastq_file):
+        read_id, sequence, quality = next(iter_fastq_records_mmap(fastq_file))
+        assert all(isinstance(f, memoryview) for f in (read_id, sequence, quality))
+
+    @pytest.mark.parametrize("block_size", [1, 7, 64, 1000])
+    def test_records_crossing_block_edges(self, fastq_file, block_size):
+        records = iter_fastq_records_mmap(fastq_file, block_size=block_size)
+        assert _as_bytes(records) == _expected_bytes()
+
+    def test_decoded(self, fastq_file):
+        records = list(iter_fastq_records_mmap(fastq_file, decode=True))
+        assert records == [tuple(r) for r in default_fastq_records()]
+
+    def test_spans_cover_whole_records(self, fastq_file):
+        (data, line_starts, line_ends), = iter_fastq_views(fastq_file)
+        assert line_starts.shape == (5, 4)
+        assert bytes(data[line_starts[0, 0]:line_ends[0, 0]]) == b"@read_0"
+        assert (line_ends[:, 1] - line_starts[:, 1]).tolist() == [50, 120, 250, 80, 300]
+
+    def test_gather_spans(self):
+        data = np.frombuffer(b"0123456789", dtype=np.uint8)
+        joined, lengths = gather_spans(data, np.array([1, 5, 9]), np.array([3, 5, 10]))
+        assert joined == b"129"
+        assert lengths.tolist() == [2, 0, 1]
+
+    def test_crlf_line_endings(self):
+        assert _as_bytes(iter_fastq_records_mmap(data_path("crlf.fastq"))) == _expected_bytes()
+
+    def test_truncated_record_padded(self):
+        assert _as_bytes(iter_fastq_records_mmap(data_path("truncated.fastq"))) == [(b"read1", b"", b"")]
+
+    def test_empty(self):
+        assert list(iter_fastq_records_mmap(data_path("empty.fastq"))) == []
+
+    def test_byte_ranges_partition_file(self, fastq_file):
+        with open(fastq_file, "rb") as f:
+            data = f.read()
+        cuts = [0] + [find_record_start(data, offset) for offset in (100, 400, 900)] + [len(data)]
+        records = []
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            records += iter_fastq_records_mmap(fastq_file, start, end)
+        assert _as_bytes(records) == _expected_bytes()
+
+
+def _lengths(path, **kwargs):
+    return np.concatenate([np.empty(0, dtype=np.int64), *iter_fastq_lengths(path, **kwargs)]).tolist()
+
+
+class TestIterFastqLengths:
+    @pytest.mark.parametrize("block_size", [1, 7, 64, 4096])
+    def test_plain_and_gzipped(self, fastq_file, fastq_gz_file, block_size):
+        assert _lengths(fastq_file, block_size=block_size) == [50, 120, 250, 80, 300]
+        assert _lengths(fastq_gz_file, block_size=block_size) == [50, 120, 250, 80, 300]
+
+    @pytest.mark.parametrize("name", ["crlf.fastq", "iupac_ok.fastq", "truncated.fastq", "empty.fastq", "reads_bgzf.fastq.gz"])
+    def test_matches_parser(self, name):
+        path = data_path(name)
+        assert _lengths(path) == [len(read) for read in parse_reads(path)]
+
+    def test_stops_at_empty_header(self, tmp_path):
+        path = tmp_path / "blank.fastq.gz"
+        with gzip.open(path, "wb") as f:
+            f.write(b"@a\nACG\n+\nIII\n\n\n@b\nA\n+\nI\n")
+        assert _lengths(str(path), block_size=5) == [3]
+
+    def test_records_not_validated(self):
+        # ACGT with a two-character quality string
+        assert _lengths(data_path("length_mismatch.fastq")) == [4]
+
+
+class TestFindRecordStart:
+    def test_at_record_boundary(self):
+        assert find_record_start(b"@a\nAC\n+\nII\n", 0) == 0
+
+    def test_skips_quality_line_starting_with_at(self):
+        data = b"@a\nAC\n+\n@I\n@b\nGG\n+\nII\n"
+        # offset 9 is the start of the quality line "@I"
+        assert find_record_start(data, 9) == data.index(b"@b")
+
+    def test_mid_line(self):
+        data = b"@a\nAC\n+\nII\n@b\nGG\n+\nII\n"
+        assert find_record_start(data, 1) == data.index(b"@b")
+
+    def test_past_last_record(self):
+        data = b"@a\nAC\n+\nII\n"
+        assert find_record_start(data, 5) == len(data)
+
+
+class TestParseReadsEngines:
+    @pytest.mark.parametrize("engine", ["block", "mmap"])
+    @pytest.mark.parametrize("name", ["reads.fastq", "crlf.fastq", "iupac_ok.fastq", "truncated.fastq"])
+    def test_engines_match_readline(self, name, engine):
+        path = data_path(name)
+        assert list(parse_reads(path, engine=engine)) == list(parse_reads(path, engine="readline"))
+
+    @pytest.mark.parametrize("engine", ["block", "mmap"])
+    def test_lines_stripped_like_readline(self, tmp_path, engine):
+        path = tmp_path / "padded.fastq"
+        path.write_bytes(b"@a \nACGT \n+\nIIII\r\n@b\t\nGG\r\n+ \nII ")
+        reads = list(parse_reads(str(path), engine=engine))
+        assert reads == list(parse_reads(str(path), engine="readline"))
+        assert [(r.read_id, r.sequence, r.quality) for r in reads] == [("a", "ACGT", "IIII"), ("b", "GG", "II")]
+        batches = list(parse_read_batches(str(path), engine=engine))
+        assert [r for b in batches for r in b] == reads
+
+    def test_block_matches_readline_gzipped(self, fastq_gz_file):
+        assert list(parse_reads(fastq_gz_file, engine="block")) == list(parse_reads(fastq_gz_file, engine="readline"))
+
+    def test_auto_is_default(self, fastq_file):
+        reads = list(parse_reads(fastq_file))
+        assert [r.read_id for r in reads] == [f"read_{i}" for i in range(5)]
+        assert isinstance(reads[0].sequence, str)
+
+    def test_mmap_undecoded_are_views(self, fastq_file):
+        assert isinstance(next(parse_reads(fastq_file, engine="mmap", decode=False)).sequence, memoryview)
+
+    def test_mmap_rejects_gzip(self, fastq_gz_file):
+        with pytest.raises(ValueError, match="uncompressed"):
+            list(parse_reads(fastq_gz_file, engine="mmap"))
+
+    def test_mmap_batch_mismatch_raises(self):
+        with pytest.raises(ValueError, match="Offending read: read1"):
+            list(parse_read_batches(data_path("length_mismatch.fastq"), engine="mmap"))
+
+    @pytest.mark.parametrize("engine", ["block", "mmap"])
+    def test_batch_engines_agree(self, fastq_file, engine):
+        batches = list(parse_read_batches(fastq_file, batch_size=2, engine=engine))
+        assert [len(b) for b in batches] == [2, 2, 1]
+        assert [r for b in batches for r in b] == list(parse_reads(fastq_file))
+
+    def test_batches_reject_readline(self, fastq_file):
+        with pytest.raises(ValueError, match="readline"):
+            list(parse_read_batches(fastq_file, engine="readline"))
+
+    def test_unknown_engine(self, fastq_file):
+        with pytest.raises(ValueError, match="Unknown FASTQ engine"):
+            list(parse_reads(fastq_file, engine="nope"))
+
+
+class TestFastqWriter:
+    def test_write_and_count(self, tmp_path):
+        out = tmp_path / "out.fastq"
+        with FastqWriter(str(out)) as writer:
+            assert writer.write(Read("r1", "ACGT", "IIII")) == 16
+            writer.write_reads([Read("r2", b"GG", b"!!"), Read("r3", "T", "I")])
+            assert writer.records_written == 3
+            assert writer.bytes_written == 16 + 12 + 10
+        assert out.read_bytes() == b"@r1\nACGT\n+\nIIII\n@r2\nGG\n+\n!!\n@r3\nT\n+\nI\n"
+
+    def test_buffer_written_when_full(self, tmp_path):
+        out = tmp_path / "out.fastq"
+        # records larger than the file object's own buffer, so they reach the file
+        read = Read("r1", "A" * io.DEFAULT_BUFFER_SIZE, "I" * io.DEFAULT_BUFFER_SIZE)
+        writer = FastqWriter(str(out), buffer_size=3 * io.DEFAULT_BUFFER_SIZE)
+        size = writer.write(read)
+        assert out.read_bytes() == b""
+        writer.write(read)
+        assert len(out.read_bytes()) == 2 * size
+        writer.close()
+
+    def test_full_buffer_does_not_wait_for_compression(self, tmp_path, monkeypatch):
+        out = tmp_path / "out.fastq.gz"
+        writer = FastqWriter(str(out), buffer_size=20, threads=2)
+        monkeypatch.setattr(writer._handle, "flush", lambda: pytest.fail("waited for compression"))
+        for i in range(100):
+            writer.write(Read(f"r{i}", "ACGT", "IIII"))
+        monkeypatch.undo()
+        writer.close()
+        with gzip.open(out, "rb") as f:
+            assert f.read().count(b"\n+\n") == 100
+
+    def test_write_batch(self, tmp_path):
+        out = tmp_path / "out.fastq"
+        batch = ReadBatch.from_records([b"r1"], [b"AC"], [bytes([0, 40])], raw_quality=True)
+        with FastqWriter(str(out)) as writer:
+            writer.write_batch(batch)
+        assert out.read_bytes() == b"@r1\nAC\n+\n!I\n"
+
+    def test_gzipped(self, tmp_path):
+        out = tmp_path / "out.fastq.gz"
+        with FastqWriter(str(out)) as writer:
+            writer.write(Read("r1", "ACGT", "IIII"))
+        with gzip.open(out, "rb") as f:
+            assert f.read() == b"@r1\nACGT\n+\nIIII\n"
+
+    def test_stdout(self, capsys):
+        print("before")
+        with FastqWriter() as writer:
+            writer.write(Read("r1", "ACGT", "IIII"))
+        assert capsys.readouterr().out == "before\n@r1\nACGT\n+\nIIII\n"
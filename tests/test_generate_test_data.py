@@ -19,7 +19,8 @@ import generate_test_data as gen
 # (rather than derived) so it independently pins what the generator must emit.
 EXPECTED_FILES = {
     # valid core inputs
-    "reads.fastq", "reads.fastq.gz", "reads.bam", "reads.sam",
+    "reads.fastq", "reads.fastq.gz", "reads_bgzf.fastq.gz",
+    "reads.bam", "reads.sam",
     "barcoded.bam", "barcoded.sam", "barcoded.fastq",
     # barcode->donor mapping TSVs (incl. column-detection variants)
     "mapping.tsv", "cell_donor.tsv", "both_columns.tsv",
@@ -28,13 +29,15 @@ EXPECTED_FILES = {
     # malformed / edge-case FASTQ inputs (+ unsupported extension)
     "bad_header.fastq", "bad_separator.fastq", "length_mismatch.fastq",
     "invalid_chars.fastq", "truncated.fastq", "empty.fastq",
-    "iupac_ok.fastq", "unsupported.txt",
+    "iupac_ok.fastq", "crlf.fastq", "unsupported.txt",
     # HTO read pairs (plain, gzipped, multi-record)
     "hto_R1.fastq", "hto_R2.fastq", "hto_R1.fastq.gz", "hto_R2.fastq.gz",
     "hto_multi_R1.fastq", "hto_multi_R2.fastq",
     # crafted BAMs (tag variants, concat inputs, incomplete records)
     "rx.bam", "both_tags.bam", "concat_in_0.bam", "concat_in_1.bam",
     "noseq.bam", "noqual.bam",
+    # per-base tags (base modifications) for unaligned BAM output
+    "modified.bam", "modified.sam",
     # manifest
     "MANIFEST.txt",
 }
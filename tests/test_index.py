@@ -0,0 +1,180 @@
+"""Tests for bamurai.index: sidecar indexes of read files."""
+
+import os
+import shutil
+
+import pytest
+
+import bamurai.stats
+from bamurai.core import parse_read_batches
+from bamurai.fastq import FastqWriter
+from bamurai.index import (
+    build_index,
+    write_index,
+    load_index,
+    index_path,
+    index_files,
+    map_read_batches,
+)
+from bamurai.stats import file_length_stats, summarise_lengths
+from bamurai.progress import FileProgressBar
+from conftest import data_path, make_sequence, make_qualities, qual_ints_to_ascii, write_fastq, write_unaligned_cram
+
+
+def _copy(name, tmp_path):
+    """Copy a data file into tmp_path, so its index is not written next to the committed data."""
+    return str(shutil.copy(data_path(name), tmp_path / name))
+
+
+def _read_ids(read_file, **kwargs):
+    return [batch.read_id(i) for batch in parse_read_batches(read_file, **kwargs) for i in range(len(batch))]
+
+
+def _many_reads(n=2000):
+    return [(f"r{i}", make_sequence(150 + i % 50, seed=i), qual_ints_to_ascii(make_qualities(150 + i % 50)))
+            for i in range(n)]
+
+
+@pytest.fixture
+def bgzf_fastq_file(tmp_path):
+    """A BGZF-compressed FASTQ file spanning several blocks."""
+    path = str(tmp_path / "many.fastq.gz")
+    with open(write_fastq(tmp_path / "many.fastq", _many_reads()), "rb") as f, FastqWriter(path) as writer:
+        writer.write_fastq(f.read(), 2000)
+    return path
+
+
+class TestBuildIndex:
+    @pytest.mark.parametrize("name,offset_type", [
+        ("reads.fastq", "byte"), ("reads.bam", "bgzf"), ("reads_bgzf.fastq.gz", "bgzf"),
+        ("reads.fastq.gz", None), ("reads.sam", None),
+    ])
+    def test_lengths_match_stats(self, name, offset_type):
+        index = build_index(data_path(name), interval=2)
+        assert index.offset_type == offset_type
+        assert index.records == 5
+        assert index.bases == 800
+        expected = summarise_lengths(file_length_stats(data_path(name), progress=False))
+        assert summarise_lengths(index.lengths) == expected
+
+    def test_cram_has_no_seek_points(self, tmp_path):
+        index = build_index(write_unaligned_cram(str(tmp_path / "reads.cram")), interval=2)
+        assert index.records == 5
+        assert not index.seekable
+        assert index.seek_points == []
+
+    def test_plain_fastq_byte_offsets(self, fastq_file):
+        index = build_index(fastq_file, interval=2)
+        with open(fastq_file, "rb") as f:
+            data = f.read()
+        assert index.seek_points == [0, data.index(b"@read_2"), data.index(b"@read_4")]
+
+    @pytest.mark.parametrize("name", ["reads.fastq", "reads.bam", "reads_bgzf.fastq.gz"])
+    def test_ranges_cover_file(self, name):
+        index = build_index(data_path(name), interval=2)
+        assert [limit for _, limit in index.ranges()] == [2, 2, 1]
+        ranges = [_read_ids(data_path(name), start=start, limit=limit) for start, limit in index.ranges()]
+        assert ranges == [["read_0", "read_1"], ["read_2", "read_3"], ["read_4"]]
+
+    @pytest.mark.parametrize("interval", [1, 7, 500])
+    def test_bgzf_fastq_ranges_across_blocks(self, bgzf_fastq_file, interval):
+        index = build_index(bgzf_fastq_file, interval=interval, threads=2)
+        assert index.records == 2000
+        # the seek points fall in several blocks
+        assert len({offset >> 16 for offset in index.seek_points}) > 1
+        read_ids = []
+        for start, limit in index.ranges():
+            read_ids += _read_ids(bgzf_fastq_file, start=start, limit=limit, threads=2)
+        assert read_ids == [f"r{i}" for i in range(2000)]
+
+    def test_empty_file(self):
+        index = build_index(data_path("empty.fastq"))
+        assert index.records == 0
+        assert index.ranges() == []
+
+    def test_invalid_interval(self, fastq_file):
+        with pytest.raises(ValueError, match="interval"):
+            build_index(fastq_file, interval=0)
+
+
+class TestLoadIndex:
+    def test_missing(self, tmp_path):
+        assert load_index(_copy("reads.fastq", tmp_path)) is None
+
+    def test_round_trip(self, tmp_path):
+        read_file = _copy("reads.bam", tmp_path)
+        index = build_index(read_file, interval=2)
+        assert write_index(index, read_file) == index_path(read_file) == read_file + ".bamurai.idx"
+        loaded = load_index(read_file)
+        assert loaded.seek_points == index.seek_points
+        assert loaded.offset_type == "bgzf"
+        assert summarise_lengths(loaded.lengths) == summarise_lengths(index.lengths)
+
+    def test_changed_file_ignored(self, tmp_path, caplog):
+        read_file = _copy("reads.fastq", tmp_path)
+        write_index(build_index(read_file), read_file)
+        with open(read_file, "ab") as f:
+            f.write(b"@extra\nACGT\n+\nIIII\n")
+        assert load_index(read_file) is None
+        assert "has changed" in caplog.text
+
+    def test_touched_file_ignored(self, tmp_path):
+        read_file = _copy("reads.fastq", tmp_path)
+        write_index(build_index(read_file), read_file)
+        stat = os.stat(read_file)
+        os.utime(read_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert load_index(read_file) is None
+
+    def test_unreadable_index_ignored(self, tmp_path, caplog):
+        read_file = _copy("reads.fastq", tmp_path)
+        with open(index_path(read_file), "w") as f:
+            f.write("not json")
+        assert load_index(read_file) is None
+        assert "unreadable" in caplog.text
+
+
+class TestIndexUse:
+    def test_stats_read_from_index(self, tmp_path, monkeypatch):
+        read_file = _copy("reads.bam", tmp_path)
+        expected = summarise_lengths(file_length_stats(read_file, progress=False))
+        write_index(build_index(read_file), read_file)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("file read despite its index")
+
+        monkeypatch.setattr(bamurai.stats, "iter_read_lengths", fail)
+        assert summarise_lengths(file_length_stats(read_file)) == expected
+
+    def test_progress_total_from_index(self, tmp_path):
+        read_file = _copy("reads.fastq", tmp_path)
+        write_index(build_index(read_file), read_file)
+        pbar = FileProgressBar(read_file)
+        assert not pbar.by_bytes
+        assert pbar.bar.total == 5
+        pbar.update(5)
+        assert pbar.bar.n == 5
+        pbar.close()
+
+    @pytest.mark.parametrize("name", ["reads.fastq", "reads.bam"])
+    def test_map_read_batches_uses_ranges(self, tmp_path, name):
+        read_file = _copy(name, tmp_path)
+        unindexed = list(map_read_batches(len, read_file, workers=2))
+        write_index(build_index(read_file, interval=2), read_file)
+        assert unindexed == [5]
+        assert list(map_read_batches(len, read_file, workers=2)) == [2, 2, 1]
+
+    def test_map_read_batches_skips_large_ranges(self, tmp_path):
+        read_file = _copy("reads.fastq", tmp_path)
+        write_index(build_index(read_file, interval=2), read_file)
+        # two ranges of 2 reads of 160 bases on average, sequence and quality
+        # (1280 bytes) do not fit in 1000 bytes, so batches are parsed here
+        assert list(map_read_batches(len, read_file, workers=2, max_pending_bytes=1000)) == [5]
+        assert list(map_read_batches(len, read_file, workers=2, max_pending_bytes=1280)) == [2, 2, 1]
+
+    def test_index_files(self, tmp_path, make_args, capsys):
+        fastq, bam = _copy("reads.fastq", tmp_path), _copy("reads.bam", tmp_path)
+        index_files(make_args(reads=[str(tmp_path)], interval=2))
+        out = capsys.readouterr().out
+        assert f"Indexed {bam}: 5 reads, 800 bases, 3 seek points" in out
+        assert f"Indexed {fastq}: 5 reads, 800 bases, 3 seek points" in out
+        assert load_index(fastq) is not None and load_index(bam) is not None
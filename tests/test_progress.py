@@ -0,0 +1,232 @@
+"""Tests for bamurai.progress: progress bars and JSON progress records."""
+
+import os
+import json
+import signal
+
+import pytest
+
+import bamurai.progress
+from bamurai.core import parse_reads
+from bamurai.fastq import iter_fastq_lengths
+from bamurai.progress import (
+    FileProgressBar,
+    ProgressSettings,
+    configure_progress,
+    progress_enabled,
+    current_rss,
+    NO_PROGRESS_ENV_VAR,
+)
+from bamurai.utils import track_read_position
+from conftest import data_path
+
+
+@pytest.fixture(autouse=True)
+def progress_settings(monkeypatch):
+    """Give each test the default settings, closing any JSON stream it configures."""
+    settings = ProgressSettings()
+    monkeypatch.setattr(bamurai.progress, "_settings", settings)
+    yield settings
+    if settings.owns_stream:
+        settings.json_stream.close()
+
+
+def _records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestConfigureProgress:
+    def test_disable(self, monkeypatch):
+        monkeypatch.delenv(NO_PROGRESS_ENV_VAR, raising=False)
+        configure_progress()
+        assert progress_enabled()
+        configure_progress(enabled=False)
+        assert not progress_enabled()
+
+    @pytest.mark.parametrize("value,enabled", [("1", False), ("yes", False), ("0", True), ("", True)])
+    def test_env_var(self, monkeypatch, value, enabled):
+        monkeypatch.setenv(NO_PROGRESS_ENV_VAR, value)
+        configure_progress()
+        assert progress_enabled() == enabled
+
+    def test_explicit_value_wins(self, monkeypatch):
+        monkeypatch.setenv(NO_PROGRESS_ENV_VAR, "1")
+        configure_progress(enabled=True)
+        assert progress_enabled()
+
+    def test_invalid_interval(self):
+        with pytest.raises(ValueError, match="interval"):
+            configure_progress(json_interval=0)
+
+    def test_file_descriptor(self, tmp_path):
+        path = tmp_path / "progress.jsonl"
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+        try:
+            configure_progress(json_target=str(fd))
+            pbar = FileProgressBar(data_path("reads.fastq"))
+            pbar.close()
+            configure_progress()
+            # the inherited descriptor stays open
+            os.fstat(fd)
+        finally:
+            os.close(fd)
+        assert [record["event"] for record in _records(path)] == ["end"]
+
+
+class TestFileProgressBar:
+    @pytest.mark.parametrize("name", ["reads.fastq", "reads.fastq.gz", "reads_bgzf.fastq.gz", "reads.bam"])
+    def test_follows_reader_to_end_of_file(self, name):
+        read_file = data_path(name)
+        pbar = FileProgressBar(read_file, mininterval=0)
+        # totals are in bytes of the file on disk, compressed or not
+        assert pbar.by_bytes
+        assert pbar.bar.total == os.path.getsize(read_file)
+        reads = parse_reads(read_file)
+        next(reads)
+        pbar.update(1)
+        assert 0 < pbar.bar.n <= pbar.bar.total
+        for _ in reads:
+            pbar.update(1)
+        pbar.close()
+        assert pbar.reads == 5
+        assert pbar.bar.n == pbar.bar.total
+
+    def test_reader_of_an_earlier_pass_not_followed(self):
+        # chunk --parts counts the reads in one pass over the file, then reads
+        # it again under its progress bar
+        read_file = data_path("reads.fastq")
+        assert sum(len(lengths) for lengths in iter_fastq_lengths(read_file)) == 5
+        pbar = FileProgressBar(read_file, mininterval=0)
+        pbar.poll()
+        assert pbar.bar.n == 0
+        positions = []
+        for _ in parse_reads(read_file, engine="mmap"):
+            pbar.update(1)
+            positions.append(pbar.bar.n)
+        pbar.close()
+        assert positions == sorted(positions)
+        assert pbar.bar.n == pbar.bar.total
+
+    def test_empty_file(self):
+        pbar = FileProgressBar(data_path("empty.fastq"))
+        pbar.close()
+        assert pbar.reads == 0
+
+    def test_iterate_counts_in_batches(self):
+        pbar = FileProgressBar(data_path("reads.fastq"))
+        seen = []
+        for read in pbar.iterate(parse_reads(data_path("reads.fastq")), batch_size=2):
+            seen.append(read.read_id)
+            # reads are counted once their batch has been handed out
+            assert pbar.reads == (len(seen) - 1) // 2 * 2
+        pbar.close()
+        assert pbar.reads == len(seen) == 5
+
+    def test_iterate_hands_items_on_before_an_error(self):
+        pbar = FileProgressBar(data_path("reads.fastq"))
+        seen = []
+
+        def items():
+            yield from range(3)
+            raise OSError("truncated file")
+
+        with pytest.raises(OSError):
+            for item in pbar.iterate(items(), batch_size=10):
+                seen.append(item)
+        # every item read before the error was processed and counted
+        assert seen == [0, 1, 2]
+        assert pbar.reads == 3
+        pbar.close()
+
+    def test_clock_checked_less_often_for_fast_updates(self):
+        pbar = FileProgressBar(data_path("reads.fastq"), mininterval=60)
+        for _ in range(100):
+            pbar.update(1)
+        assert pbar._check_at > pbar.reads + 1
+        pbar.close()
+
+    def test_disabled_bar_does_not_poll(self, monkeypatch):
+        configure_progress(enabled=False)
+        pbar = FileProgressBar(data_path("reads.fastq"))
+        monkeypatch.setattr(pbar, "_check", lambda: pytest.fail("polled with progress off"))
+        pbar.update(5)
+        monkeypatch.undo()
+        pbar.close()
+        assert pbar.bar.disable
+
+
+    def test_without_read_counts(self, tmp_path):
+        path = tmp_path / "progress.jsonl"
+        configure_progress(json_target=str(path))
+        read_file = data_path("reads.fastq")
+        pbar = FileProgressBar(read_file, mininterval=0, count_reads=False)
+        position = [100]
+        track_read_position(read_file, lambda: position[0])
+        pbar.poll()
+        assert pbar.bar.n == 100
+        position[0] = os.path.getsize(read_file)
+        pbar.close()
+        end = _records(path)[-1]
+        assert end["records"] is None and end["records_per_sec"] is None
+        assert end["bytes"] == os.path.getsize(read_file)
+
+
+class TestProgressJson:
+    def test_records(self, tmp_path):
+        path = tmp_path / "progress.jsonl"
+        configure_progress(enabled=False, json_target=str(path), json_interval=1e-9)
+        read_file = data_path("reads.fastq")
+        pbar = FileProgressBar(read_file, desc="Testing", mininterval=0)
+        for read in parse_reads(read_file):
+            pbar.update(1)
+        pbar.close()
+        records = _records(path)
+        assert {record["event"] for record in records[:-1]} == {"progress"}
+        end = records[-1]
+        assert end["event"] == "end"
+        assert end["desc"] == "Testing"
+        assert end["file"] == read_file
+        assert end["records"] == 5
+        assert end["bytes"] == end["total_bytes"] == os.path.getsize(read_file)
+        assert end["total_records"] is None
+        assert end["eta"] == 0
+        assert end["rss"] > 0
+        assert set(end) >= {"time", "pid", "elapsed", "records_per_sec", "bytes_per_sec"}
+
+    def test_interval(self, tmp_path):
+        path = tmp_path / "progress.jsonl"
+        configure_progress(json_target=str(path), json_interval=3600)
+        pbar = FileProgressBar(data_path("reads.fastq"), mininterval=0)
+        pbar.update(5)
+        pbar.close()
+        assert [record["event"] for record in _records(path)] == ["end"]
+
+    @pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="no SIGUSR1 on this platform")
+    def test_sigusr1_snapshot(self, tmp_path):
+        path = tmp_path / "progress.jsonl"
+        configure_progress(json_target=str(path))
+        previous = signal.getsignal(signal.SIGUSR1)
+        pbar = FileProgressBar(data_path("reads.fastq"))
+        pbar.update(3)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        pbar.close()
+        # the handler is removed with the last bar
+        assert signal.getsignal(signal.SIGUSR1) is previous
+        snapshot, end = _records(path)
+        assert snapshot["event"] == "snapshot"
+        assert snapshot["records"] == 3
+        assert end["event"] == "end"
+
+    @pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="no SIGUSR1 on this platform")
+    def test_sigusr1_snapshot_without_json(self, capsys):
+        pbar = FileProgressBar(data_path("reads.fastq"))
+        os.kill(os.getpid(), signal.SIGUSR1)
+        pbar.close()
+        err = capsys.readouterr().err.replace("\r", "\n")
+        snapshots = [json.loads(line) for line in err.splitlines() if line.startswith("{")]
+        assert [snapshot["event"] for snapshot in snapshots] == ["snapshot"]
+
+
+def test_current_rss():
+    assert current_rss() > 0
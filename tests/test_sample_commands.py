@@ -7,9 +7,14 @@ BAM fixture and its matching barcode->donor TSV. Recall that the fixture has:
   * 1 read with an unknown barcode -> unmapped
 """
 
+import gzip
+
 import pysam
 import pytest
 
+import bamurai.assign_samples
+import bamurai.progress
+from bamurai.bgzf import is_bgzf
 from bamurai.split_samples import split_samples
 from bamurai.extract_sample import extract_sample, extract_reads_from_bam
 from bamurai.assign_samples import assign_samples
@@ -66,6 +71,23 @@ class TestSplitSamples:
         assert _fastq_read_names(str(out_dir / "donor2.fastq")) == ["r1"]
         assert _fastq_read_names(str(out_dir / "unmapped.fastq")) == ["r2"]
 
+    def test_fastq_split_compressed(self, tmp_path, barcode_donor_tsv, make_args):
+        out_dir = tmp_path / "split_out"
+        args = make_args(
+            input=[data_path("barcoded.fastq")],
+            tsv=barcode_donor_tsv,
+            output_dir=str(out_dir),
+            barcode_column=None,
+            donor_id_column=None,
+            compress=True,
+        )
+        split_samples(args)
+
+        with gzip.open(out_dir / "donor1.fastq.gz", "rt") as f:
+            assert f.readline().startswith("@r0")
+        assert is_bgzf(str(out_dir / "unmapped.fastq.gz"))
+        assert not (out_dir / "donor1.fastq").exists()
+
     def test_bam_split_multiple_inputs(self, barcoded_bam_file,
                                        barcode_donor_tsv, tmp_path, make_args):
         # Two input BAMs exercise the per-donor concatenation path (each donor
@@ -84,6 +106,20 @@ class TestSplitSamples:
         assert _count(str(out_dir / "donor2.bam")) == 4
         assert _count(str(out_dir / "unmapped.bam")) == 2
 
+    def test_bam_split_with_threads(self, barcoded_bam_file,
+                                    barcode_donor_tsv, tmp_path, make_args):
+        out_dir = tmp_path / "split_out"
+        args = make_args(
+            input=[barcoded_bam_file, barcoded_bam_file],
+            tsv=barcode_donor_tsv,
+            output_dir=str(out_dir),
+            barcode_column=None,
+            donor_id_column=None,
+            threads=3,
+        )
+        split_samples(args)
+        assert _count(str(out_dir / "donor1.bam")) == 4
+
 
 class TestExtractSample:
     def test_extract_single_donor(self, barcoded_bam_file, barcode_donor_tsv,
@@ -110,6 +146,16 @@ class TestExtractSample:
         assert count == 2
         assert _count(path) == 2
 
+    def test_extract_reads_from_bam_threaded(self, barcoded_bam_file,
+                                             barcode_donor_tsv, tmp_path):
+        mapping = parse_barcode_donor_mapping(barcode_donor_tsv)
+        barcodes = get_barcodes_for_donor(mapping, "donor2")
+        count, path = extract_reads_from_bam(
+            barcoded_bam_file, barcodes, output_file=str(tmp_path / "d2.bam"),
+            threads=4)
+        assert count == 2
+        assert _count(path) == 2
+
     def test_multiple_bam_inputs(self, barcoded_bam_file, barcode_donor_tsv,
                                  tmp_path, make_args):
         out = tmp_path / "donor1.bam"
@@ -236,6 +282,22 @@ class TestAssignSamples:
             rg_ids = [rg["ID"] for rg in bam.header.to_dict()["RG"]]
         assert rg_ids == sorted(set(rg_ids))
 
+    def test_error_closes_progress_bar(self, barcoded_bam_file, barcode_donor_tsv,
+                                       tmp_path, make_args, monkeypatch):
+        def fail(read):
+            raise RuntimeError("unreadable barcode")
+
+        monkeypatch.setattr(bamurai.assign_samples, "get_read_barcode", fail)
+        out = tmp_path / "assigned.bam"
+        args = make_args(
+            bam=barcoded_bam_file, tsv=barcode_donor_tsv, output=str(out),
+            barcode_column=None, donor_id_column=None,
+        )
+        with pytest.raises(RuntimeError):
+            assign_samples(args)
+        assert bamurai.progress._open_bars == []
+        assert not out.exists()
+
     def test_missing_donor_column_raises(self, barcoded_bam_file, tmp_path,
                                          make_args):
         # missing_donor.tsv has 'barcode' and 'sample' but no 'donor_id' column.
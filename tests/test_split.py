@@ -1,7 +1,18 @@
 """Tests for bamurai.split: target-length splitting."""
 
+import functools
+import gzip
+import shutil
+
+import numpy as np
+
+from bamurai.bgzf import is_bgzf
 from bamurai.core import Read, parse_reads
-from bamurai.split import calculate_split_len, split_reads
+import bamurai.index
+import bamurai.split
+from bamurai.core import parse_read_batches
+from bamurai.index import build_index, write_index
+from bamurai.split import calculate_split_len, calculate_split_len_batch, split_reads
 from conftest import make_sequence, make_qualities, qual_ints_to_ascii
 
 
@@ -34,6 +45,29 @@ class TestCalculateSplitLen:
         assert all(150 <= f <= 250 for f in fragments)
 
 
+def _per_read_bounds(lengths, split_locs):
+    starts, ends = [], []
+    for length in lengths:
+        bounds = [0, *split_locs(_read(length)), length]
+        starts += bounds[:-1]
+        ends += bounds[1:]
+    return starts, ends
+
+
+class TestCalculateSplitLenBatch:
+    def test_matches_per_read(self):
+        # includes exact halves (250, 350), which round to even
+        lengths = [0, 1, 50, 99, 100, 149, 150, 250, 301, 350, 1000, 1234]
+        starts, ends, counts = calculate_split_len_batch(np.array(lengths), target_len=100)
+        expected = _per_read_bounds(lengths, lambda read: calculate_split_len(read, target_len=100))
+        assert (starts.tolist(), ends.tolist()) == expected
+        assert counts.tolist() == [len(calculate_split_len(_read(n), 100)) + 1 for n in lengths]
+
+    def test_empty(self):
+        starts, ends, counts = calculate_split_len_batch(np.array([], dtype=np.int64), target_len=100)
+        assert starts.size == ends.size == counts.size == 0
+
+
 class TestSplitReadsIntegration:
     def test_output_file_written(self, fastq_file, tmp_path, make_args):
         out = tmp_path / "split.fastq"
@@ -58,3 +92,49 @@ class TestSplitReadsIntegration:
         args = make_args(reads=bam_file, len_target=100, output=str(out))
         split_reads(args)
         assert len(list(parse_reads(str(out)))) == 8
+
+    def test_bam_and_fastq_output_identical(self, fastq_file, bam_file, tmp_path, make_args):
+        outputs = []
+        for name, reads in (("fq", fastq_file), ("bam", bam_file)):
+            out = tmp_path / f"{name}.fastq"
+            split_reads(make_args(reads=reads, len_target=100, output=str(out)))
+            outputs.append(out.read_bytes())
+        assert outputs[0] == outputs[1]
+
+    def test_gzipped_output(self, fastq_file, tmp_path, make_args):
+        plain, gzipped = tmp_path / "split.fastq", tmp_path / "split.fastq.gz"
+        split_reads(make_args(reads=fastq_file, len_target=100, output=str(plain)))
+        split_reads(make_args(reads=fastq_file, len_target=100, output=str(gzipped), threads=2, compression_level=1))
+        assert is_bgzf(str(gzipped))
+        with gzip.open(gzipped, "rb") as f:
+            assert f.read() == plain.read_bytes()
+
+    def test_stdout_output(self, fastq_file, tmp_path, make_args, capsys):
+        out = tmp_path / "split.fastq"
+        split_reads(make_args(reads=fastq_file, len_target=100, output=str(out)))
+        split_reads(make_args(reads=fastq_file, len_target=100, output=None))
+        assert capsys.readouterr().out == out.read_text()
+
+    def test_workers_output_identical(self, fastq_file, tmp_path, make_args, monkeypatch, caplog):
+        # two reads per batch, so the five reads are spread over three workers' tasks
+        monkeypatch.setattr(bamurai.index, "parse_read_batches", functools.partial(parse_read_batches, batch_size=2))
+        single, multi = tmp_path / "single.fastq", tmp_path / "multi.fastq"
+        split_reads(make_args(reads=fastq_file, len_target=100, output=str(single)))
+        caplog.clear()
+        with caplog.at_level("INFO"):
+            split_reads(make_args(reads=fastq_file, len_target=100, output=str(multi), workers=3))
+        assert multi.read_bytes() == single.read_bytes()
+        assert "Total input reads: 5" in caplog.text
+        assert "Total output reads: 8" in caplog.text
+        assert "Total unsplit reads: 3" in caplog.text
+        # 800 bases over 8 fragments
+        assert "Average split read length: 100" in caplog.text
+
+    def test_indexed_workers_output_identical(self, fastq_file, tmp_path, make_args):
+        # with an index, each worker parses its own two-read range of the file
+        indexed = shutil.copy(fastq_file, tmp_path / "indexed.fastq")
+        write_index(build_index(str(indexed), interval=2), str(indexed))
+        single, multi = tmp_path / "single.fastq", tmp_path / "multi.fastq"
+        split_reads(make_args(reads=fastq_file, len_target=100, output=str(single)))
+        split_reads(make_args(reads=str(indexed), len_target=100, output=str(multi), workers=3))
+        assert multi.read_bytes() == single.read_bytes()
@@ -1,7 +1,37 @@
 """Tests for bamurai.stats: N50 and file statistics."""
 
-from bamurai.stats import calc_n50, file_read_stats, file_stats
-from conftest import data_path
+import numpy as np
+import pytest
+
+import shutil
+
+import bamurai.stats
+from bamurai.core import ReadBatch
+from bamurai.index import build_index, write_index, index_path
+from bamurai.stats import (
+    calc_n50,
+    calc_nx,
+    calc_quantile,
+    file_qc_stats,
+    file_read_stats,
+    file_stats,
+    find_read_files,
+    load_summary,
+    summarise_lengths,
+    write_summary,
+    QualityStats,
+    EXTENDED_TSV_COLUMNS,
+    QC_LENGTH_EDGES,
+    TSV_COLUMNS,
+)
+from bamurai.utils import LengthStats
+from conftest import data_path, write_unaligned_cram
+
+
+def _length_stats(lengths, exact_limit=100_000):
+    stats = LengthStats(exact_limit=exact_limit)
+    stats.add_lengths(lengths)
+    return stats
 
 
 class TestCalcN50:
@@ -26,6 +56,35 @@ class TestCalcN50:
         assert lengths == [2, 5, 3, 6, 4]
 
 
+class TestHistogramStats:
+    def test_n50_matches_sorting(self):
+        lengths = np.random.default_rng(1).integers(1, 50_000, size=1000)
+        assert calc_nx(_length_stats(lengths), 50) == calc_n50(lengths)
+
+    @pytest.mark.parametrize("x", [10, 50, 90])
+    def test_nx_by_definition(self, x):
+        lengths = np.random.default_rng(x).integers(1, 5000, size=300)
+        nx = calc_nx(_length_stats(lengths), x)
+        # reads at least nx long hold x% of the bases; longer ones alone do not
+        assert lengths[lengths >= nx].sum() >= lengths.sum() * x / 100
+        assert lengths[lengths > nx].sum() < lengths.sum() * x / 100
+
+    @pytest.mark.parametrize("q", [0, 0.25, 0.5, 0.75, 1])
+    def test_quantiles_match_numpy(self, q):
+        lengths = [2, 3, 4, 5, 6, 10, 10, 200]
+        assert calc_quantile(_length_stats(lengths), q) == np.quantile(lengths, q)
+
+    def test_long_reads_approximate(self):
+        # above the exact limit a bin's mean length stands in for its reads
+        stats = _length_stats([150, 160, 170], exact_limit=100)
+        assert calc_nx(stats, 50) == 160
+        assert calc_quantile(stats, 0.5) == 160
+
+    def test_empty(self):
+        assert calc_nx(LengthStats(), 50) is None
+        assert calc_quantile(LengthStats(), 0.5) is None
+
+
 class TestFileReadStats:
     def test_fastq_stats(self, fastq_file):
         stats = file_read_stats(fastq_file)
@@ -35,6 +94,11 @@ class TestFileReadStats:
         assert stats["avg_read_len"] == 160
         # Sorted desc 300,250,...; cumulative 300, 550 crosses half (400) at 250.
         assert stats["n50"] == 250
+        assert stats["median_read_len"] == 120
+        assert (stats["min_read_len"], stats["max_read_len"]) == (50, 300)
+        assert (stats["q25_read_len"], stats["q75_read_len"]) == (80, 250)
+        # 10% of 800 is reached by the 300 read alone, 90% only by adding the 80
+        assert (stats["n10"], stats["n90"]) == (300, 80)
 
     def test_bam_stats_primary_only(self, bam_file):
         stats = file_read_stats(bam_file)
@@ -45,16 +109,136 @@ class TestFileReadStats:
     def test_fastq_and_bam_agree(self, fastq_file, bam_file):
         assert file_read_stats(fastq_file) == file_read_stats(bam_file)
 
+    def test_cram_stats(self, fastq_file, tmp_path):
+        cram = write_unaligned_cram(tmp_path / "reads.cram")
+        assert file_read_stats(cram) == file_read_stats(fastq_file)
+
+    def test_gzipped_fastq(self, fastq_file, fastq_gz_file):
+        assert file_read_stats(fastq_gz_file) == file_read_stats(fastq_file)
+
+    def test_fastq_records_not_parsed(self):
+        # only lengths are read, so a quality/sequence mismatch is not an error
+        assert file_read_stats(data_path("length_mismatch.fastq"))["throughput"] == 4
+
     def test_empty_file_stats(self):
         # An empty FASTQ yields zeroed stats (n50 coerced to 0 for display,
         # distinct from calc_n50([]) which returns None).
         stats = file_read_stats(data_path("empty.fastq"))
-        assert stats == {
-            "total_reads": 0,
-            "avg_read_len": 0,
-            "throughput": 0,
-            "n50": 0,
-        }
+        assert stats["total_reads"] == stats["throughput"] == stats["n50"] == 0
+        assert set(stats.values()) == {0}
+
+
+def _random_batch(seed=0, n=50, raw_quality=False):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, 400, size=n)
+    # reads without bases are left out
+    lengths[3] = 0
+    sequences = [bytes(rng.choice(list(b"ACGTN"), size=length).astype(np.uint8)) for length in lengths]
+    phred = [bytes(rng.integers(2, 42, size=length).astype(np.uint8)) for length in lengths]
+    qualities = phred if raw_quality else [bytes(q + 33 for q in quals) for quals in phred]
+    return ReadBatch.from_records([b"r%d" % i for i in range(n)], sequences, qualities, raw_quality), sequences, phred
+
+
+class TestQualityStats:
+    def test_matches_per_read_calculation(self):
+        batch, sequences, phred = _random_batch()
+        stats = QualityStats()
+        stats.add_batch(batch)
+
+        reads = [(seq, quals) for seq, quals in zip(sequences, phred) if seq]
+        errors = [sum(10 ** (-q / 10) for q in quals) for _, quals in reads]
+        read_quals = [-10 * np.log10(error / len(seq)) for error, (seq, _) in zip(errors, reads)]
+        bases = sum(len(seq) for seq, _ in reads)
+        assert (stats.count, stats.total) == (len(reads), bases)
+        assert stats.mean_qual == pytest.approx(-10 * np.log10(sum(errors) / bases))
+        assert stats.mean_read_qual == pytest.approx(np.mean(read_quals))
+        gc = sum(seq.count(b"G") + seq.count(b"C") for seq, _ in reads)
+        assert stats.gc_content == pytest.approx(gc / bases)
+        # each read lands in the bin of its whole mean quality and length
+        assert stats.reads.sum() == len(reads)
+        assert stats.bases.sum() == bases
+        seq, _ = reads[0]
+        length_bin = np.searchsorted(QC_LENGTH_EDGES, len(seq), side="right") - 1
+        assert stats.reads[int(read_quals[0]), length_bin] >= 1
+
+    def test_mean_quality_in_probability_space(self):
+        # Q10 and Q30 bases: error probabilities 0.1 and 0.001 average to
+        # 0.0505, about Q13, not the Q20 of averaging the scores
+        batch = ReadBatch.from_records([b"r"], [b"AC"], [bytes([10, 30])], raw_quality=True)
+        stats = QualityStats()
+        stats.add_batch(batch)
+        assert stats.mean_read_qual == pytest.approx(-10 * np.log10(0.0505))
+        assert round(stats.mean_read_qual) == 13
+
+    def test_raw_and_fastq_qualities_agree(self):
+        fastq, raw = QualityStats(), QualityStats()
+        fastq.add_batch(_random_batch(raw_quality=False)[0])
+        raw.add_batch(_random_batch(raw_quality=True)[0])
+        assert (fastq.mean_qual, fastq.mean_read_qual) == (raw.mean_qual, raw.mean_read_qual)
+        assert np.array_equal(fastq.reads, raw.reads)
+
+    def test_slices_do_not_change_result(self, monkeypatch):
+        batch = _random_batch(seed=1)[0]
+        whole = QualityStats()
+        whole.add_batch(batch)
+        monkeypatch.setattr(bamurai.stats, "_QC_SLICE_BASES", 500)
+        sliced = QualityStats()
+        sliced.add_batch(batch)
+        assert sliced.mean_qual == pytest.approx(whole.mean_qual)
+        assert sliced.read_qual_sum == pytest.approx(whole.read_qual_sum)
+        assert np.array_equal(sliced.bases, whole.bases)
+
+    def test_merge(self):
+        left, right, both = QualityStats(), QualityStats(), QualityStats()
+        for stats, seeds in ((left, [0]), (right, [1]), (both, [0, 1])):
+            for seed in seeds:
+                stats.add_batch(_random_batch(seed)[0])
+        left.merge(right)
+        assert (left.count, left.total, left.gc_bases) == (both.count, both.total, both.gc_bases)
+        assert left.mean_read_qual == pytest.approx(both.mean_read_qual)
+        assert np.array_equal(left.reads, both.reads)
+
+    def test_empty(self):
+        assert (QualityStats().mean_qual, QualityStats().mean_read_qual, QualityStats().gc_content) == (0, 0, 0)
+
+
+class TestExtendedStats:
+    def test_fastq_and_bam_agree(self, fastq_file, bam_file):
+        fastq_stats = file_read_stats(fastq_file, extended=True)
+        assert fastq_stats == file_read_stats(bam_file, extended=True)
+        assert {column: fastq_stats[column] for column in TSV_COLUMNS} == file_read_stats(fastq_file)
+        # reads of Q30..Q34 throughout
+        assert fastq_stats["mean_read_qual"] == 32.0
+        assert 32 < fastq_stats["mean_qual"] < 33
+
+    def test_same_pass_lengths(self, fastq_file):
+        lengths, quality = file_qc_stats(fastq_file, progress=False)
+        assert (lengths.count, lengths.total) == (quality.count, quality.total) == (5, 800)
+
+    def test_tsv_columns(self, fastq_file, make_args, capsys):
+        file_stats(make_args(reads=fastq_file, tsv=True, extended=True))
+        rows = _tsv_rows(capsys.readouterr().out)
+        assert list(rows[0])[1:] == list(TSV_COLUMNS + EXTENDED_TSV_COLUMNS)
+        assert rows[0]["mean_read_qual"] == "32.0"
+
+    def test_human_readable(self, fastq_file, make_args, capsys):
+        file_stats(make_args(reads=fastq_file, tsv=False, extended=True))
+        out = capsys.readouterr().out
+        assert "Mean read quality (Q): 32.0" in out
+        assert "GC content (%):" in out
+
+    def test_qual_histogram(self, fastq_file, bam_file, tmp_path, make_args, capsys):
+        path = tmp_path / "hist.tsv"
+        file_stats(make_args(reads=[fastq_file, bam_file], tsv=True, qual_histogram=str(path)))
+        rows = _tsv_rows(path.read_text())
+        assert {row["file_name"] for row in rows} == {fastq_file, bam_file, "all"}
+        aggregate = [row for row in rows if row["file_name"] == "all"]
+        assert sum(int(row["reads"]) for row in aggregate) == 10
+        assert sum(int(row["bases"]) for row in aggregate) == 1600
+        # the 300 bp read of Q34
+        assert {"mean_qual": "34", "min_read_len": "252", "max_read_len": "316"}.items() <= \
+            next(row for row in aggregate if row["mean_qual"] == "34").items()
+        assert _tsv_rows(capsys.readouterr().out)[-1]["mean_read_qual"] == "32.0"
 
 
 class TestFileStatsOutput:
@@ -74,7 +258,130 @@ class TestFileStatsOutput:
         file_stats(make_args(reads=fastq_file, tsv=True))
         out = capsys.readouterr().out
         lines = out.strip().split("\n")
-        assert lines[0] == "file_name\ttotal_reads\tavg_read_len\tthroughput\tn50"
-        fields = lines[1].split("\t")
-        assert fields[1] == "5"  # total_reads
-        assert fields[3] == "800"  # throughput
+        # the original columns come first
+        assert lines[0].startswith("file_name\ttotal_reads\tavg_read_len\tthroughput\tn50\t")
+        assert lines[0].split("\t")[1:] == list(TSV_COLUMNS)
+        fields = dict(zip(lines[0].split("\t"), lines[1].split("\t")))
+        assert fields["total_reads"] == "5"
+        assert fields["throughput"] == "800"
+        assert fields["median_read_len"] == "120"
+        assert fields["n90"] == "80"
+
+    def test_human_readable_nx(self, fastq_file, make_args, capsys):
+        file_stats(make_args(reads=fastq_file, tsv=False))
+        out = capsys.readouterr().out
+        assert "Median read length: 120" in out
+        assert "N10=300" in out
+
+
+def _tsv_rows(out):
+    lines = out.strip().split("\n")
+    header = lines[0].split("\t")
+    return [dict(zip(header, line.split("\t"))) for line in lines[1:]]
+
+
+class TestMultipleFiles:
+    def test_row_per_file_and_aggregate(self, fastq_file, bam_file, make_args, capsys):
+        file_stats(make_args(reads=[fastq_file, bam_file, data_path("length_mismatch.fastq")], tsv=True))
+        rows = _tsv_rows(capsys.readouterr().out)
+        assert [row["file_name"] for row in rows] == [fastq_file, bam_file, data_path("length_mismatch.fastq"), "all"]
+        assert [row["total_reads"] for row in rows] == ["5", "5", "1", "11"]
+        # lengths [50,120,250,80,300] twice plus 4: half of 1604 bases is
+        # reached by 300,300,250
+        assert rows[-1]["throughput"] == "1604"
+        assert rows[-1]["n50"] == "250"
+        assert (rows[-1]["min_read_len"], rows[-1]["max_read_len"]) == ("4", "300")
+
+    def test_aggregate_matches_concatenated_file(self, fastq_file, tmp_path, make_args, capsys):
+        lengths = np.random.default_rng(0).integers(1, 3000, size=200)
+        paths = []
+        for i, chunk in enumerate(np.array_split(lengths, 3)):
+            path = tmp_path / f"part{i}.fastq"
+            path.write_text("".join(f"@r\n{'A' * n}\n+\n{'I' * n}\n" for n in chunk))
+            paths.append(str(path))
+        file_stats(make_args(reads=paths, tsv=True, workers=2))
+        aggregate = _tsv_rows(capsys.readouterr().out)[-1]
+        assert int(aggregate["n50"]) == calc_n50(lengths)
+        assert int(aggregate["median_read_len"]) == round(np.median(lengths))
+
+    def test_human_readable(self, fastq_file, bam_file, make_args, capsys):
+        file_stats(make_args(reads=[fastq_file, bam_file], tsv=False))
+        out = capsys.readouterr().out
+        assert f"Statistics for {bam_file}:" in out
+        assert "Statistics for all 2 files:" in out
+        assert out.count("Total reads: 5") == 2
+        assert "Total reads: 10" in out
+
+    def test_single_file_has_no_aggregate(self, fastq_file, make_args, capsys):
+        file_stats(make_args(reads=[fastq_file], tsv=True))
+        assert len(_tsv_rows(capsys.readouterr().out)) == 1
+
+
+class TestSummaries:
+    @pytest.mark.parametrize("suffix", [".json", ".json.gz"])
+    def test_write_and_load(self, bam_file, tmp_path, suffix):
+        path = str(tmp_path / f"summary{suffix}")
+        lengths = LengthStats()
+        lengths.add_lengths([50, 120, 250])
+        write_summary(path, lengths, [bam_file])
+        loaded, files = load_summary(path)
+        assert files == [bam_file]
+        assert (loaded.count, loaded.total) == (3, 420)
+
+    def test_load_rejects_other_json(self, tmp_path):
+        path = tmp_path / "other.json"
+        path.write_text('{"format": "something else"}')
+        with pytest.raises(ValueError, match="stats summary"):
+            load_summary(str(path))
+
+    def test_merge_matches_reading_all_files(self, fastq_file, bam_file, tmp_path, make_args, capsys):
+        files = [fastq_file, bam_file, data_path("length_mismatch.fastq")]
+        file_stats(make_args(reads=files, tsv=True))
+        expected = _tsv_rows(capsys.readouterr().out)[-1]
+
+        # one summary per "flowcell", then merged without reading the reads
+        summaries = [str(tmp_path / "fc1.json"), str(tmp_path / "fc2.json.gz")]
+        file_stats(make_args(reads=files[:2], tsv=True, summary=summaries[0]))
+        file_stats(make_args(reads=files[2:], tsv=True, summary=summaries[1]))
+        capsys.readouterr()
+        file_stats(make_args(reads=summaries, tsv=True, merge=True, summary=str(tmp_path / "project.json")))
+        rows = _tsv_rows(capsys.readouterr().out)
+        assert [row["file_name"] for row in rows] == summaries + ["all"]
+        assert [row["total_reads"] for row in rows] == ["10", "1", "11"]
+        assert rows[-1] == expected
+
+        # merged summaries keep every file they cover, and merge again
+        lengths, read_files = load_summary(str(tmp_path / "project.json"))
+        assert read_files == files
+        assert summarise_lengths(lengths) == {column: int(expected[column]) for column in TSV_COLUMNS}
+
+    def test_merge_index_file(self, fastq_file, tmp_path, make_args, capsys):
+        read_file = str(shutil.copy(fastq_file, tmp_path / "reads.fastq"))
+        write_index(build_index(read_file), read_file)
+        file_stats(make_args(reads=[index_path(read_file)], tsv=True, merge=True))
+        assert _tsv_rows(capsys.readouterr().out)[0]["total_reads"] == "5"
+
+
+class TestFindReadFiles:
+    def test_directory(self, tmp_path, fastq_file, bam_file):
+        shutil.copy(fastq_file, tmp_path / "b.fastq")
+        shutil.copy(bam_file, tmp_path / "a.bam")
+        (tmp_path / "notes.txt").write_text("not reads")
+        assert find_read_files([str(tmp_path)]) == [str(tmp_path / "a.bam"), str(tmp_path / "b.fastq")]
+
+    def test_glob_pattern(self, tmp_path, fastq_file):
+        (tmp_path / "run").mkdir()
+        for name in ("x_2.fastq", "x_1.fastq", "y.fastq"):
+            shutil.copy(fastq_file, tmp_path / "run" / name)
+        assert find_read_files([str(tmp_path / "run" / "x_*.fastq")]) == [
+            str(tmp_path / "run" / "x_1.fastq"), str(tmp_path / "run" / "x_2.fastq")]
+        assert len(find_read_files([str(tmp_path / "**" / "*.fastq")])) == 3
+
+    def test_files_kept_in_order(self, fastq_file, bam_file):
+        assert find_read_files([fastq_file, bam_file]) == [fastq_file, bam_file]
+
+    def test_nothing_found(self, tmp_path):
+        with pytest.raises(FileNotFoundError, match="no read files matching"):
+            find_read_files([str(tmp_path / "*.fastq")])
+        with pytest.raises(FileNotFoundError, match="in directory"):
+            find_read_files([str(tmp_path)])
@@ -0,0 +1,154 @@
+"""Tests for bamurai.ubam: unaligned BAM output and per-base tag slicing."""
+
+from array import array
+
+import pysam
+
+from bamurai.core import Read, parse_reads, split_read
+from bamurai.divide import divide_reads
+from bamurai.split import split_reads
+from bamurai.ubam import (
+    UbamWriter,
+    slice_modifications,
+    slice_tags,
+    unaligned_header,
+    open_read_writer,
+)
+from bamurai.fastq import FastqWriter
+from conftest import data_path
+
+
+SEQUENCE = b"CACGCATCGC"
+
+
+def _records(path):
+    with pysam.AlignmentFile(path, "rb", check_sq=False) as bam:
+        return [
+            (r.query_name, r.query_sequence, r.query_qualities.tobytes(), r.get_tags())
+            for r in bam
+        ]
+
+
+class TestSliceModifications:
+    def test_calls_renumbered_per_fragment(self):
+        # 5mC calls on the Cs at 0, 4 and 9 (C occurrences 0, 2 and 4)
+        assert slice_modifications("C+m?,0,1,1;", [10, 20, 30], SEQUENCE, 0, 5) == ("C+m?,0,1;", array("B", [10, 20]))
+        assert slice_modifications("C+m?,0,1,1;", [10, 20, 30], SEQUENCE, 5, 10) == ("C+m?,1;", array("B", [30]))
+
+    def test_fragment_without_calls_keeps_entry(self):
+        assert slice_modifications("C+m.,0;", [99], SEQUENCE, 1, 4) == ("C+m.;", array("B"))
+
+    def test_multiple_codes_and_entries(self):
+        # two ML values per call for C+mh (Cs at 0 and 4); one A call at 5
+        mm = "C+mh,0,1;A+a,1;"
+        ml = [1, 2, 3, 4, 50]
+        assert slice_modifications(mm, ml, SEQUENCE, 2, 10) == ("C+mh,1;A+a,0;", array("B", [3, 4, 50]))
+
+    def test_reverse_strand_counts_listed_base(self):
+        # G-m counts the Gs of the sequence (at 3 and 8)
+        assert slice_modifications("G-m,1;", [7], SEQUENCE, 5, 10) == ("G-m,0;", array("B", [7]))
+
+    def test_n_counts_every_base(self):
+        # calls at bases 3 and 6
+        assert slice_modifications("N+n,3,2;", [1, 2], SEQUENCE, 2, 6) == ("N+n,1;", array("B", [1]))
+
+
+class TestSliceTags:
+    def test_per_base_tags_sliced(self):
+        tags = [
+            ("CB", "AAA", "Z"),
+            ("MM", "C+m?,0,1,1;", "Z"),
+            ("ML", array("B", [10, 20, 30]), "B"),
+            ("MN", 10, "i"),
+            ("OQ", "ABCDEFGHIJ", "Z"),
+        ]
+        assert slice_tags(tags, SEQUENCE, 5, 10) == [
+            ("CB", "AAA", "Z"),
+            ("MM", "C+m?,1;", "Z"),
+            ("ML", array("B", [30]), "B"),
+            ("MN", 5, "i"),
+            ("OQ", "FGHIJ", "Z"),
+        ]
+
+
+class TestParseReadsTags:
+    def test_original_orientation(self):
+        fwd, rev = parse_reads(data_path("modified.bam"), tags=True)
+        assert fwd.sequence == rev.sequence == SEQUENCE.decode()
+        assert fwd.quality == rev.quality
+        assert dict((t, v) for t, v, _ in fwd.tags) == dict((t, v) for t, v, _ in rev.tags)
+
+    def test_alignment_tags_dropped(self):
+        read = next(parse_reads(data_path("modified.bam"), tags=True))
+        assert "NM" not in [tag for tag, _, _ in read.tags]
+        assert "CB" in [tag for tag, _, _ in read.tags]
+
+    def test_split_read_slices_tags(self):
+        read = next(parse_reads(data_path("modified.bam"), decode=False, tags=True))
+        first, second = split_read(read, at=[5])
+        assert dict((t, v) for t, v, _ in second.tags)["MM"] == "C+m?,1;"
+        assert first.tags[0] == ("CB", read.tags[0][1], "Z")
+
+    def test_fastq_output_unchanged_without_tags(self):
+        rev = list(parse_reads(data_path("modified.bam")))[1]
+        assert rev.sequence == "GCGATGCGTG"
+        assert rev.tags is None
+
+
+class TestUbamWriter:
+    def test_header(self):
+        with pysam.AlignmentFile(data_path("modified.bam"), "rb", check_sq=False) as bam:
+            header = unaligned_header(bam.header).to_dict()
+        assert not header.get("SQ")
+        assert header["HD"]["SO"] == "unknown"
+        assert header["PG"][-1]["ID"] == "bamurai"
+
+    def test_program_ids_stay_unique(self):
+        header = unaligned_header(unaligned_header())
+        assert [pg["ID"] for pg in header.to_dict()["PG"]] == ["bamurai", "bamurai.1"]
+
+    def test_round_trip(self, tmp_path):
+        out = str(tmp_path / "out.bam")
+        read = Read("r1", b"ACGT", bytes([1, 2, 3, 4]), raw_quality=True,
+                    tags=[("CB", "AAA", "Z"), ("ML", array("B", [5]), "B")])
+        with UbamWriter(out, threads=2) as writer:
+            writer.write(read)
+            writer.write(Read("r2", "GG", "II"))
+        assert _records(out) == [
+            ("r1", "ACGT", bytes([1, 2, 3, 4]), [("CB", "AAA"), ("ML", array("B", [5]))]),
+            ("r2", "GG", bytes([40, 40]), []),
+        ]
+        with pysam.AlignmentFile(out, "rb", check_sq=False) as bam:
+            assert all(r.is_unmapped for r in bam)
+
+    def test_writer_chosen_by_extension(self, tmp_path, fastq_file):
+        bam_writer = open_read_writer(str(tmp_path / "out.bam"), fastq_file)
+        fastq_writer = open_read_writer(str(tmp_path / "out.fastq"), fastq_file)
+        assert isinstance(bam_writer, UbamWriter)
+        assert isinstance(fastq_writer, FastqWriter)
+        bam_writer.close()
+        fastq_writer.close()
+
+
+class TestCommandsUbamOutput:
+    def test_split_keeps_tags(self, tmp_path, make_args):
+        out = str(tmp_path / "split.bam")
+        split_reads(make_args(reads=data_path("modified.bam"), len_target=5, output=out))
+        records = _records(out)
+        assert [name for name, *_ in records] == ["mod_fwd_0", "mod_fwd_1", "mod_rev_0", "mod_rev_1"]
+        assert [seq for _, seq, _, _ in records] == ["CACGC", "ATCGC"] * 2
+        tags = dict(records[1][3])
+        assert tags["MM"] == "C+m?,1;"
+        assert list(tags["ML"]) == [30]
+        assert tags["MN"] == 5
+        assert tags["OQ"] == "FGHIJ"
+        assert tags["CB"] == "AAACCCAAAGGGTTT"
+        assert "NM" not in tags
+        # reverse-strand reads come out as sequenced
+        assert records[0][1:] == records[2][1:]
+
+    def test_divide_fastq_input(self, tmp_path, make_args, fastq_file):
+        out = str(tmp_path / "divide.bam")
+        divide_reads(make_args(reads=fastq_file, num_fragments=2, min_length=0, output=out, threads=2))
+        assert len(_records(out)) == 10
+        assert [len(r) for r in parse_reads(out)] == [25, 25, 60, 60, 125, 125, 40, 40, 150, 150]
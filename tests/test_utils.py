@@ -1,15 +1,35 @@
 """Tests for bamurai.utils: general helpers."""
 
+import os
 import gzip
+import json
+import errno
+import threading
+import warnings
 
+import numpy as np
 import pytest
 
+import bamurai.utils
+
 from bamurai.utils import (
     is_fastq,
+    is_read_file,
     smart_open,
     calculate_percentage,
     print_elapsed_time_pretty,
+    resolve_threads,
+    ordered_map,
+    _pool_context,
+    LengthStats,
+    THREADS_ENV_VAR,
+    track_read_position,
+    untrack_read_position,
+    read_position,
+    _READ_POSITIONS,
+    copy_range,
 )
+from conftest import data_path
 
 
 class TestIsFastq:
@@ -25,6 +45,16 @@ class TestIsFastq:
         assert not is_fastq(name)
 
 
+class TestIsReadFile:
+    @pytest.mark.parametrize("name", ["x.bam", "x.SAM", "x.cram", "x.fq.gz"])
+    def test_true(self, name):
+        assert is_read_file(name)
+
+    @pytest.mark.parametrize("name", ["x.txt", "x.bai", "x.fastq.gz.fai"])
+    def test_false(self, name):
+        assert not is_read_file(name)
+
+
 class TestSmartOpen:
     def test_plain_roundtrip(self, tmp_path):
         path = tmp_path / "f.txt"
@@ -46,6 +76,201 @@ class TestSmartOpen:
             smart_open(str(tmp_path / "nope.txt"), "rt")
 
 
+class TestResolveThreads:
+    def test_default_is_one(self, monkeypatch):
+        monkeypatch.delenv(THREADS_ENV_VAR, raising=False)
+        assert resolve_threads() == 1
+
+    def test_explicit_value(self, monkeypatch):
+        monkeypatch.setenv(THREADS_ENV_VAR, "8")
+        assert resolve_threads(4) == 4
+
+    def test_environment_variable(self, monkeypatch):
+        monkeypatch.setenv(THREADS_ENV_VAR, "8")
+        assert resolve_threads() == 8
+
+    def test_invalid_environment_variable(self, monkeypatch):
+        monkeypatch.setenv(THREADS_ENV_VAR, "many")
+        with pytest.raises(ValueError, match=THREADS_ENV_VAR):
+            resolve_threads()
+
+    @pytest.mark.parametrize("value", [0, -2])
+    def test_below_one_raises(self, value):
+        with pytest.raises(ValueError, match="at least 1"):
+            resolve_threads(value)
+
+
+class TestOrderedMap:
+    def test_single_worker_runs_inline(self):
+        # a lambda cannot be pickled, so this only works without a pool
+        assert list(ordered_map(lambda x: x * 2, range(5))) == [0, 2, 4, 6, 8]
+
+    def test_results_in_input_order(self):
+        assert list(ordered_map(str, range(50), workers=2, max_pending=3)) == [str(i) for i in range(50)]
+
+    def test_pending_bounded_by_bytes(self):
+        drawn = []
+
+        def items():
+            for i in range(10):
+                drawn.append(i)
+                yield i
+
+        results = ordered_map(str, items(), workers=2, size=lambda item: 6, max_pending_bytes=10)
+        # one item of 6 bytes at a time: the next is drawn, then waits for the first
+        assert next(results) == "0"
+        assert drawn == [0, 1]
+        assert list(results) == [str(i) for i in range(1, 10)]
+
+    def test_workers_not_forked_from_threaded_process(self):
+        # the caller's reader threads are running when the pool starts its workers
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", DeprecationWarning)
+                assert list(ordered_map(str, range(4), workers=2)) == ["0", "1", "2", "3"]
+        finally:
+            stop.set()
+            thread.join()
+        assert _pool_context().get_start_method() != "fork"
+
+    def test_worker_errors_raised(self):
+        with pytest.raises(ValueError):
+            list(ordered_map(int, ["1", "x"], workers=2))
+
+
+class TestLengthStats:
+    def test_summary(self):
+        stats = LengthStats()
+        stats.add_lengths(np.array([50, 120, 250]))
+        stats.add(80)
+        assert (stats.count, stats.total, stats.min, stats.max) == (4, 500, 50, 250)
+        assert stats.mean == 125
+
+    def test_empty(self):
+        stats = LengthStats()
+        stats.add_lengths(np.array([], dtype=np.int64))
+        assert (stats.count, stats.total, stats.min, stats.max, stats.mean) == (0, 0, None, None, 0)
+
+    def test_exact_and_log_bins(self):
+        stats = LengthStats(exact_limit=1000)
+        stats.add_lengths([5, 5, 999, 1000, 1001, 10**13])
+        assert stats.counts[5] == 2 and stats.bases[5] == 10
+        assert stats.counts[999] == 1
+        # 1000 and 1001 share the first log bin; overlong lengths land in the last
+        assert stats.counts[1000] == 2 and stats.bases[1000] == 2001
+        assert stats.counts[-1] == 1
+        assert stats.counts.sum() == 6 and stats.bases.sum() == stats.total
+
+    def test_add_matches_add_lengths(self):
+        lengths = [1, 99_999, 100_000, 123_456, 5_000_000]
+        one_by_one, batched = LengthStats(), LengthStats()
+        for length in lengths:
+            one_by_one.add(length)
+        batched.add_lengths(lengths)
+        assert np.array_equal(one_by_one.counts, batched.counts)
+        assert np.array_equal(one_by_one.bases, batched.bases)
+
+    def test_merge(self):
+        left, right, both = LengthStats(), LengthStats(), LengthStats()
+        left.add_lengths([10, 200_000])
+        right.add_lengths([3, 40])
+        both.add_lengths([10, 200_000, 3, 40])
+        left.merge(right)
+        left.merge(LengthStats())
+        assert (left.count, left.total, left.min, left.max) == (4, 200_053, 3, 200_000)
+        assert np.array_equal(left.counts, both.counts)
+
+    def test_merge_mismatched_bins_raises(self):
+        with pytest.raises(ValueError, match="exact limits"):
+            LengthStats().merge(LengthStats(exact_limit=10))
+
+    def test_dict_round_trip(self):
+        stats = LengthStats(exact_limit=1000)
+        stats.add_lengths([5, 5, 999, 1000, 123_456])
+        data = json.loads(json.dumps(stats.to_dict()))
+        # only the occupied bins are stored
+        assert len(data["bins"]) == 4
+        restored = LengthStats.from_dict(data)
+        assert (restored.exact_limit, restored.count, restored.total, restored.min, restored.max) == \
+            (1000, 5, 125_465, 5, 123_456)
+        assert np.array_equal(restored.counts, stats.counts)
+        assert np.array_equal(restored.bases, stats.bases)
+
+    def test_empty_dict_round_trip(self):
+        restored = LengthStats.from_dict(LengthStats().to_dict())
+        assert (restored.count, restored.min, restored.max) == (0, None, None)
+
+    def test_from_dict_rejects_other_bins(self):
+        data = LengthStats().to_dict()
+        data["log_bins_per_decade"] = 10
+        with pytest.raises(ValueError, match="log bins per decade"):
+            LengthStats.from_dict(data)
+
+
+class TestReadPosition:
+    def test_read_position(self, tmp_path):
+        path = str(tmp_path / "reads.fastq")
+        assert read_position(path) is None
+        track_read_position(path, lambda: 123)
+        assert read_position(path) == 123
+
+    def test_closed_reader_has_no_position(self, tmp_path):
+        path = str(tmp_path / "reads.fastq")
+        with open(data_path("reads.fastq"), "rb") as f:
+            track_read_position(path, f.tell)
+        assert read_position(path) is None
+        assert os.path.realpath(path) not in _READ_POSITIONS
+
+    def test_untrack_keeps_newer_reader(self, tmp_path):
+        path = str(tmp_path / "reads.fastq")
+        first, second = (lambda: 1), (lambda: 2)
+        track_read_position(path, first)
+        track_read_position(path, second)
+        untrack_read_position(path, first)
+        assert read_position(path) == 2
+        untrack_read_position(path, second)
+        assert read_position(path) is None
+
+
+class TestCopyRange:
+    def _copy(self, tmp_path, offset, count):
+        src = tmp_path / "src"
+        src.write_bytes(bytes(range(256)) * 100)
+        with open(src, "rb") as s, open(tmp_path / "dst", "wb") as d:
+            d.write(b"head")
+            d.flush()
+            copy_range(s.fileno(), d.fileno(), offset, count)
+        return (tmp_path / "dst").read_bytes(), src.read_bytes()
+
+    def test_copy(self, tmp_path):
+        copied, data = self._copy(tmp_path, 1000, 5000)
+        assert copied == b"head" + data[1000:6000]
+
+    def test_sendfile_fallback(self, tmp_path, monkeypatch):
+        def unsupported(*args):
+            raise OSError(errno.EXDEV, "cross-device")
+
+        monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+        copied, data = self._copy(tmp_path, 10, 20000)
+        assert copied == b"head" + data[10:20010]
+
+    def test_read_write_fallback(self, tmp_path, monkeypatch):
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+        monkeypatch.delattr(os, "sendfile", raising=False)
+        monkeypatch.setattr(bamurai.utils, "_COPY_BLOCK_SIZE", 1000)
+        copied, data = self._copy(tmp_path, 7, 5000)
+        assert copied == b"head" + data[7:5007]
+
+    def test_short_input(self, tmp_path, monkeypatch):
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+        monkeypatch.delattr(os, "sendfile", raising=False)
+        with pytest.raises(EOFError):
+            self._copy(tmp_path, 25000, 1000)
+
+
 class TestCalculatePercentage:
     def test_normal(self):
         assert calculate_percentage(1, 4) == 25.0
@@ -3,8 +3,26 @@
 Inputs are static objects under tests/data/ (see generate_test_data.py).
 """
 
+import gzip
+import json
+
+import pysam
+import pytest
+
+import bamurai.progress
+from bamurai.progress import ProgressSettings, configure_progress, PROGRESS_BATCH_SIZE
 from bamurai.validate import validate_fastq, validate_bam, validate_file
-from conftest import data_path
+from conftest import data_path, make_sequence, make_qualities, write_bam
+
+
+@pytest.fixture
+def progress_records(tmp_path, monkeypatch):
+    """Send progress records to a file for the test; returns a function reading their events."""
+    monkeypatch.setattr(bamurai.progress, "_settings", ProgressSettings())
+    path = tmp_path / "progress.jsonl"
+    configure_progress(enabled=False, json_target=str(path))
+    yield lambda: [json.loads(line)["event"] for line in path.read_text().splitlines()]
+    bamurai.progress._settings.json_stream.close()
 
 
 class TestValidateFastq:
@@ -14,6 +32,9 @@ class TestValidateFastq:
     def test_valid_gzipped(self, fastq_gz_file):
         assert validate_fastq(fastq_gz_file) is True
 
+    def test_valid_bgzf_threaded(self):
+        assert validate_fastq(data_path("reads_bgzf.fastq.gz"), threads=4) is True
+
     def test_bad_header(self):
         # missing leading '@'
         assert validate_fastq(data_path("bad_header.fastq")) is False
@@ -37,6 +58,20 @@ class TestValidateFastq:
         # Header present but sequence/separator/quality lines missing.
         assert validate_fastq(data_path("truncated.fastq")) is False
 
+    def test_failure_closes_progress_bar(self, progress_records):
+        assert validate_fastq(data_path("bad_header.fastq")) is False
+        assert progress_records() == ["end"]
+        assert bamurai.progress._open_bars == []
+
+    def test_read_error_closes_progress_bar(self, tmp_path, progress_records):
+        path = tmp_path / "cut.fastq.gz"
+        data = gzip.compress(b"".join(b"@r%d\nACGT\n+\nIIII\n" % i for i in range(1000)))
+        path.write_bytes(data[:len(data) // 2])
+        with pytest.raises(EOFError):
+            validate_fastq(str(path))
+        assert progress_records() == ["end"]
+        assert bamurai.progress._open_bars == []
+
     def test_empty_file_is_valid_with_zero_records(self):
         assert validate_fastq(data_path("empty.fastq")) is True
 
@@ -45,6 +80,9 @@ class TestValidateBam:
     def test_valid_file(self, bam_file):
         assert validate_bam(bam_file) is True
 
+    def test_valid_file_threaded(self, bam_file):
+        assert validate_bam(bam_file, threads=2) is True
+
     def test_missing_file_returns_false(self, tmp_path):
         assert validate_bam(str(tmp_path / "nope.bam")) is False
 
@@ -53,6 +91,28 @@ class TestValidateBam:
         assert validate_bam(data_path("noseq.bam")) is False
         assert "Missing query sequence" in capsys.readouterr().out
 
+    def test_failure_closes_progress_bar(self, progress_records):
+        assert validate_bam(data_path("noseq.bam")) is False
+        assert progress_records() == ["end"]
+        assert bamurai.progress._open_bars == []
+
+    def test_read_error_reports_record(self, tmp_path, capsys):
+        path = tmp_path / "cut.bam"
+        write_bam(path, [{"name": f"r{i}", "sequence": make_sequence(100, seed=i), "quals": make_qualities(100)}
+                         for i in range(3000)])
+        data = path.read_bytes()
+        # cut the file in the middle of a block, keeping the end-of-file marker
+        path.write_bytes(data[:len(data) // 2] + data[-28:])
+        # the records readable before the cut
+        readable = 0
+        with pytest.raises(OSError):
+            with pysam.AlignmentFile(str(path), "rb", check_sq=False) as bam:
+                for _ in bam:
+                    readable += 1
+        assert readable > PROGRESS_BATCH_SIZE
+        assert validate_bam(str(path)) is False
+        assert f"Error reading BAM file at record {readable}:" in capsys.readouterr().out
+
     def test_missing_qualities_returns_false(self, capsys):
         # A record with a sequence but absent qualities must fail validation.
         assert validate_bam(data_path("noqual.bam")) is False